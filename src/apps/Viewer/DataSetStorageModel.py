@@ -1,5 +1,6 @@
 from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex
 from PyQt5.QtGui import QColor
+import numpy as np
 import logging
 
 
@@ -12,18 +13,56 @@ class DataSetStorageModel(QAbstractTableModel):
 
         self.c_names = ('Name', 'Channel', u'💀⏱', 'CountTime', 'Cps', u'χ²')
 
+        # columns of q_app.data extracted to numpy arrays for rendering, motor positions are stored as
+        # ('Motors', motor name). The views ask for every cell and role on every repaint, so the table is only read
+        # once per change.
+        self._cache = dict()
+
+        self.q_app.dataRowsInserted.connect(self.on_rows_changed)
+        self.q_app.dataRowsRemoved.connect(self.on_rows_changed)
+        self.q_app.dataSorted.connect(self.on_rows_changed)
+        self.q_app.dataActiveChanged.connect(self.on_data_ac)
         self.q_app.genFitResChanged.connect(self.on_gen_fit_changed)
         self.q_app.peakListChanged.connect(self.on_gen_fit_changed)
         self.q_app.bckgListChanged.connect(self.on_gen_fit_changed)
 
+    def on_rows_changed(self, *args):
+        self.logger.debug('on_rows_changed: Handling dataRowsInserted / dataRowsRemoved / dataSorted')
+        self._cache.clear()
+
+    def _update_cache(self, column, rows):
+        if column in self._cache:
+            for row in rows:
+                self._cache[column][row] = self.q_app.data.loc[row, column]
+
+    def on_data_ac(self, rows):
+        self.logger.debug('on_data_ac: Handling dataActiveChanged(%s)' % (str(rows),))
+        self._update_cache('Active', rows)
+        # the signal may arrive after the views were told to repaint, they are repainted again with the new state
+        if rows:
+            self.dataChanged.emit(self.index(min(rows), 0), self.index(max(rows), 0))
+
     def on_gen_fit_changed(self, rows):
         self.logger.debug('on_gen_fit_changed: Handling genFitResChanged(%s)' % (str(rows),))
+        self._update_cache('Chi2', rows)
         if rows:
             self.dataChanged.emit(
                 self.index(min(rows), 0),
-                self.index(max(rows), 4)
+                self.index(max(rows), len(self.c_names) - 1)
             )
 
+    def _column(self, column):
+        """
+        Column of :code:`q_app.data` as a numpy array, extracted on first use after a change of the rows.
+        """
+        if column not in self._cache:
+            if isinstance(column, tuple):
+                motors = self.q_app.motors.column(column[1])
+                self._cache[column] = np.where(np.isnan(motors), None, motors)
+            else:
+                self._cache[column] = self.q_app.data[column].to_numpy(dtype=object, copy=True)
+        return self._cache[column]
+
     def columnCount(self, parent=None, *args, **kwargs):
         return len(self.c_names) + len(self.q_app.motors_cols)
 
@@ -38,51 +77,49 @@ class DataSetStorageModel(QAbstractTableModel):
         if not ii.isValid():
             return None
 
-        item_row = self.q_app.data.loc[ii.row()]
+        row = ii.row()
 
         if ii.column() == 0:
             if role == Qt.DisplayRole:
-                return item_row['ScreenName']
+                return self._column('ScreenName')[row]
             elif role == Qt.CheckStateRole:
-                return Qt.Checked if item_row['Active'] else Qt.Unchecked
+                return Qt.Checked if self._column('Active')[row] else Qt.Unchecked
             elif role == Qt.ForegroundRole:
-                if item_row['Active']:
-                    return QColor(item_row['Color'])
+                if self._column('Active')[row]:
+                    return QColor(self._column('Color')[row])
                 else:
                     return QColor('Black')
             else:
                 return None
         elif ii.column() == 1:
             if role == Qt.DisplayRole:
-                return item_row['Channel']
+                return self._column('Channel')[row]
             else:
                 return None
         elif ii.column() == 2:
             if role == Qt.DisplayRole:
-                return item_row['DeadTime']
+                return self._column('DeadTime')[row]
             else:
                 return None
         elif ii.column() == 3:
             if role == Qt.DisplayRole:
-                return item_row['CountTime']
+                return self._column('CountTime')[row]
             else:
                 return None
         elif ii.column() == 4:
             if role == Qt.DisplayRole:
-                return item_row['Cps']
+                return self._column('Cps')[row]
             else:
                 return None
         elif ii.column() == 5:
             if role == Qt.DisplayRole:
-                return '%.01e' % item_row['Chi2'] if item_row['Chi2'] is not None else None
+                chi2 = self._column('Chi2')[row]
+                return '%.01e' % chi2 if chi2 is not None else None
             else:
                 return None
         elif len(self.c_names) <= ii.column() < len(self.q_app.motors_cols) + len(self.c_names):
             if role == Qt.DisplayRole:
-                if item_row['Motors'] is not None:
-                    return item_row['Motors'][self.q_app.motors_cols[ii.column() - len(self.c_names)]]
-                else:
-                    return None
+                return self._column(('Motors', self.q_app.motors_cols[ii.column() - len(self.c_names)]))[row]
             else:
                 return None
         else:
@@ -102,15 +139,46 @@ class DataSetStorageModel(QAbstractTableModel):
     def insertRows(self, position, rows, parent=QModelIndex(), *args, **kwargs):
         self.beginInsertRows(parent, position, position + rows - 1)
         self.q_app.insert_rows(position, rows)
+        self._cache.clear()
         self.endInsertRows()
         return True
 
     def removeRows(self, position, rows, parent=QModelIndex(), *args, **kwargs):
         self.beginRemoveRows(parent, position, position + rows - 1)
         self.q_app.remove_rows(position, rows)
+        self._cache.clear()
         self.endRemoveRows()
         return True
 
+    def insert_data(self, position, frame):
+        """
+        Inserts the rows of the DataFrame :code:`frame` to :code:`self.q_app.data` at :code:`position`.
+        """
+        self.beginInsertRows(QModelIndex(), position, position + frame.shape[0] - 1)
+        self.q_app.insert_data(position, frame)
+        self._cache.clear()
+        self.endInsertRows()
+
+    def remove_data(self, rows):
+        """
+        Removes the rows at the positions :code:`rows` from :code:`self.q_app.data` at once. Scattered rows reset the
+        model instead of notifying the views block by block.
+        """
+        rows = sorted(set(rows))
+        if not rows:
+            return
+
+        if rows[-1] - rows[0] + 1 == len(rows):
+            self.beginRemoveRows(QModelIndex(), rows[0], rows[-1])
+            self.q_app.remove_data(rows)
+            self._cache.clear()
+            self.endRemoveRows()
+        else:
+            self.beginResetModel()
+            self.q_app.remove_data(rows)
+            self._cache.clear()
+            self.endResetModel()
+
     def insertColumns(self, column: int, count: int, parent=QModelIndex(), *args, **kwargs) -> bool:
         self.beginInsertColumns(parent, column, column + count - 1)
         self.q_app.motors_cols = self.q_app.motors_cols[:column - len(self.c_names)] + ('', ) * count + \
@@ -128,6 +196,7 @@ class DataSetStorageModel(QAbstractTableModel):
     def setData(self, ii: QModelIndex, value, role=None):
         if ii.column() == 0 and role == Qt.CheckStateRole:
             self.q_app.set_active_status(ii.row(), bool(value))
+            self._update_cache('Active', [ii.row()])
             self.dataChanged.emit(ii, ii)
             return True
         else:
@@ -0,0 +1,93 @@
+import os
+import zipfile
+import hashlib
+import logging
+import numpy as np
+
+
+class DecodedCache:
+    """
+    On-disk cache of decoded spectra. Every entry is an uncompressed .npz file holding the arrays a reader produced
+    for one data file, so that a cache hit is a single sequential read.
+
+    Entries are keyed by the identity of the data file (absolute path, size, modification time) and by the reader
+    parameters that change the decoded result (reader version, calibration, ...). The total size of the cache is
+    bounded by :code:`max_bytes`: :code:`evict()` removes the least recently used entries, a hit counts as a use.
+
+    Entries are written to a temporary file first and moved into place, so several processes can share the cache.
+    """
+    suffix = '.npz'
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.logger = logging.getLogger(str(self.__class__))
+
+    def key(self, f_name, *params):
+        """
+        :param f_name: data file
+        :param params: reader parameters that change the decoded result, have to have a stable repr
+        :return: cache key as a hex string
+        """
+        st = os.stat(f_name)
+        identity = (os.path.abspath(f_name), st.st_size, st.st_mtime_ns) + params
+        return hashlib.sha1(repr(identity).encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + self.suffix)
+
+    def get(self, key):
+        """
+        :return: dict name -> array or None if there is no valid entry for the key
+        """
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as entry:
+                arrays = {name: entry[name] for name in entry.files}
+            os.utime(path)
+        except (OSError, ValueError, zipfile.BadZipFile) as e:
+            self.logger.info('get: Dropping unreadable cache entry %s (%s)' % (path, str(e)))
+            self.remove(path)
+            return None
+        return arrays
+
+    def put(self, key, arrays):
+        """
+        :param key: cache key
+        :param arrays: dict name -> numpy array
+        """
+        path = self.path(key)
+        tmp_path = path + '.%d.tmp' % os.getpid()
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            self.logger.info('put: Could not write cache entry %s (%s)' % (path, str(e)))
+            self.remove(tmp_path)
+
+    @staticmethod
+    def remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits into :code:`max_bytes`.
+        """
+        try:
+            entries = [(e.path, e.stat()) for e in os.scandir(self.cache_dir) if e.name.endswith(self.suffix)]
+        except OSError:
+            return
+
+        total = sum(st.st_size for _, st in entries)
+        for path, st in sorted(entries, key=lambda item: item[1].st_mtime_ns):
+            if total <= self.max_bytes:
+                break
+            self.remove(path)
+            total -= st.st_size
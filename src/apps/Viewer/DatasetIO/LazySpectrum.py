@@ -0,0 +1,166 @@
+import os
+import h5py
+import numpy as np
+from numpy.lib.mixins import NDArrayOperatorsMixin
+from collections import OrderedDict
+
+
+class LRU:
+    """
+    Bounded least-recently-used mapping. The bound is either the number of items or, if :code:`size_fn` is given, the
+    total size of the stored values. Evicted values are passed to :code:`on_evict`.
+    """
+    def __init__(self, max_size, size_fn=None, on_evict=None):
+        self.max_size = max_size
+        self.size_fn = size_fn if size_fn is not None else (lambda val: 1)
+        self.on_evict = on_evict
+        self.size = 0
+        self._items = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        if key not in self._items:
+            return default
+        self._items.move_to_end(key)
+        return self._items[key]
+
+    def put(self, key, val):
+        if key in self._items:
+            self.pop(key)
+        self._items[key] = val
+        self.size += self.size_fn(val)
+        while self.size > self.max_size and len(self._items) > 1:
+            self.pop(next(iter(self._items)))
+
+    def pop(self, key):
+        val = self._items.pop(key)
+        self.size -= self.size_fn(val)
+        if self.on_evict is not None:
+            self.on_evict(val)
+        return val
+
+    def clear(self):
+        while self._items:
+            self.pop(next(iter(self._items)))
+
+
+def _close_source(src):
+    if isinstance(src, h5py.Dataset):
+        src.file.close()
+
+
+# open datasets / memory maps, one per (file, dataset path)
+sources = LRU(64, on_evict=_close_source)
+# recently touched frames, bounded by memory
+frames = LRU(256 * 2 ** 20, size_fn=lambda val: val.nbytes)
+
+
+def forget(f_name):
+    """
+    Closes the open datasets of :code:`f_name` and drops its frames from the cache, has to be called before the file
+    is replaced.
+    """
+    f_name = os.path.abspath(f_name)
+    for cache in (sources, frames):
+        for key in [key for key in cache._items if os.path.abspath(key[0]) == f_name]:
+            cache.pop(key)
+
+
+def get_source(f_name, path):
+    """
+    Returns an object that can be sliced by frame number for the :code:`path` dataset in :code:`f_name`.
+    Contiguous uncompressed datasets are memory-mapped directly, everything else goes through h5py.
+    """
+    src = sources.get((f_name, path))
+    if src is None:
+        f = h5py.File(f_name, 'r')
+        ds = f[path]
+        offset = ds.id.get_offset()
+        if ds.chunks is None and ds.compression is None and not ds.external and offset is not None:
+            src = np.memmap(f_name, dtype=ds.dtype, mode='r', offset=offset, shape=ds.shape)
+            f.close()
+        else:
+            src = ds
+        sources.put((f_name, path), src)
+    return src
+
+
+class LazySpectrum(NDArrayOperatorsMixin):
+    """
+    Handle to a single histogram frame stored in a NeXuS file. Stores only (file, dataset, frame index) and reads the
+    frame on first access. Numpy functions and arithmetic work on the handle as if it was the array itself.
+
+    The same post-processing as in :code:`P61ANexusReader` is applied on reading: intensities below
+    :code:`noise_cut` bin and in the last bin are set to 0, and if :code:`clip` is not None, intensities below it are
+    replaced by :code:`clip`.
+    """
+    __slots__ = ('f_name', 'path', 'frame', 'shape', 'dtype', 'noise_cut', 'clip')
+
+    def __init__(self, f_name, path, frame, shape, dtype, noise_cut=20, clip=1.0):
+        self.f_name = f_name
+        self.path = path
+        self.frame = frame
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.noise_cut = noise_cut
+        self.clip = clip
+
+    @property
+    def key(self):
+        return self.f_name, self.path, self.frame
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def load(self):
+        result = frames.get(self.key)
+        if result is None:
+            result = np.array(get_source(self.f_name, self.path)[self.frame])
+            if self.noise_cut is not None:
+                result[:self.noise_cut] = 0
+                result[-1] = 0
+            if self.clip is not None:
+                result[result < self.clip] = self.clip
+            result.flags.writeable = False
+            frames.put(self.key, result)
+        return result
+
+    def __array__(self, dtype=None):
+        if dtype is None:
+            return self.load()
+        return self.load().astype(dtype)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = tuple(x.load() if isinstance(x, LazySpectrum) else x for x in inputs)
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, item):
+        return self.load()[item]
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __repr__(self):
+        return 'LazySpectrum(%s, %s, %d)' % self.key
+
+    def astype(self, dtype, *args, **kwargs):
+        return self.load().astype(dtype, *args, **kwargs)
+
+    def copy(self):
+        return self.load().copy()
+
+    def tolist(self):
+        return self.load().tolist()
@@ -3,13 +3,13 @@ import numpy as np
 import pandas as pd
 import os
 
-from P61App import P61App
+from DatasetIO.P61ANexusReader import P61ANexusReader
 
 
 class P61ACSVReader:
 
-    def __init__(self):
-        self.q_app = P61App.instance()
+    def __init__(self, columns=None, **kwargs):
+        self.columns = tuple(columns) if columns is not None else P61ANexusReader.columns
 
     def validate(self, f_name):
         try:
@@ -26,8 +26,8 @@ class P61ACSVReader:
 
         ch = int(f_name.replace('.csv', '')[-2:])
 
-        result = pd.DataFrame(columns=self.q_app.data.columns)
-        row = {c: None for c in self.q_app.data.columns}
+        result = pd.DataFrame(columns=self.columns)
+        row = {c: None for c in self.columns}
         row.update({
             'DataX': 1E-3 * dd.index.to_numpy(),
             'DataY': dd['counts'].to_numpy(),
@@ -35,7 +35,6 @@ class P61ACSVReader:
             'Channel': ch,
             'ScreenName': os.path.basename(f_name),
             'Active': True,
-            'Color': next(self.q_app.params['ColorWheel'])
         })
         result.loc[result.shape[0]] = row
 
@@ -4,6 +4,9 @@ import pandas as pd
 import os
 from time import sleep, localtime, strftime
 
+from DatasetIO.frame_reduction import reductions, reduce_frames
+from DatasetIO.energy_axes import energy_axis
+
 # import basics.functions as bf
 # import basics.filehandling as fg
 # import diffraction.filehandling as fs
@@ -86,33 +89,21 @@ class P61ANexusHandler:
                 # if no frames existing
                 if '/'.join((*channel, self.hist)) not in f:
                     continue
-                # determine frames of measured intensity
+                # determine frames of measured intensity and scaler values
                 frames = f['/'.join((*channel, self.hist))]
-                if accum_frames == 'sum':
-                    frames = [np.sum(frames, axis=0)]
-                elif accum_frames == 'mean':
-                    frames = [np.mean(frames, axis=0)]
-                elif accum_frames == 'median':
-                    frames = [np.median(frames, axis=0)]
-                elif accum_frames == 'max':
-                    frames = [np.max(frames, axis=0)]
-                elif accum_frames == 'min':
-                    frames = [np.min(frames, axis=0)]
-                # determine scaler values
-                scaler_values = pd.DataFrame(columns=self.rawcols[3:])
-                for scaler_val in self.scaler_items:
-                    if '/'.join((*channel, self.scaler, scaler_val)) in f:
-                        scaler_values[scaler_val] = f['/'.join((*channel, self.scaler, scaler_val))]
-                if accum_frames == 'sum':
-                    scaler_values = scaler_values.sum()
-                elif accum_frames == 'mean':
-                    scaler_values = scaler_values.mean()
-                elif accum_frames == 'median':
-                    scaler_values = scaler_values.median()
-                elif accum_frames == 'max':
-                    scaler_values = scaler_values.max()
-                elif accum_frames == 'min':
-                    scaler_values = scaler_values.min()
+                scalers = {scaler_val: f['/'.join((*channel, self.scaler, scaler_val))]
+                           for scaler_val in self.scaler_items
+                           if '/'.join((*channel, self.scaler, scaler_val)) in f}
+                if accum_frames in reductions:
+                    # both are reduced block-wise in one pass, without loading the whole stack
+                    frame, scaler_values = reduce_frames(frames, scalers, accum_frames)
+                    frames = [frame]
+                    scaler_values = pd.Series({scaler_val: scaler_values.get(scaler_val, np.nan)
+                                               for scaler_val in self.scaler_items})
+                else:
+                    scaler_values = pd.DataFrame(columns=self.rawcols[3:])
+                    for scaler_val in scalers:
+                        scaler_values[scaler_val] = scalers[scaler_val]
                 # iterate over frames
                 for fr_num, frame in enumerate(frames):
                     if extract:
@@ -128,8 +119,8 @@ class P61ANexusHandler:
                         #     kev = np.arange(frames.shape[0]) * 0.04995786201326 + 0.106286326963684
                         # else:
                         #     kev = (np.arange(frames.shape[0]) + 0.5) * kev_per_bin
-                        ch_vals = np.arange(frame.shape[0]) + 1  # index starting at 1
-                        kev = self.calib[ii, 0] * ch_vals ** 2 + self.calib[ii, 1] * ch_vals + self.calib[ii, 2]
+                        # shared by all frames of the channel, index starting at 1
+                        kev = energy_axis(ii, self.calib[ii], frame.shape[0], offset=1.)
                         # only intensities >0 allowed
                         if self._replace:
                             frame[frame < 1.0] = 1.0
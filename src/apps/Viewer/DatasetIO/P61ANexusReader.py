@@ -4,7 +4,9 @@ import pandas as pd
 import os
 import logging
 
-from P61App import P61App
+from DatasetIO.LazySpectrum import LazySpectrum
+from DatasetIO.DecodedCache import DecodedCache
+from DatasetIO.energy_axes import energy_axis
 
 
 class P61ANexusReader:
@@ -17,14 +19,37 @@ class P61ANexusReader:
     hist = ('histogram', )
     # define column names for resulting table
     columns = ('DataX', 'DataY', 'DataID', 'Channel', 'ScreenName', 'Active', 'Color', 'DeadTime', 'CountTime', 'Cps')
+    # linear energy calibration (kev per bin, offset) for ch0 and ch1
+    calib = ((0.050494483569344, 0.029899315869827),  # old
+             (0.04995786201326, 0.106286326963684))  # old
+    # calib = ((0.0502526643786186, 0.0233578244744876),  # 07.07.22
+    #          (0.0499765125529105, 0.02579913996599))  # 07.07.22
+    # xspress3 clock period in seconds
+    tick = 1.25e-8
+    # has to be increased whenever the decoding changes, invalidates the decoded cache
+    version = 1
 
-    def __init__(self):
-        self.q_app = P61App.instance()
+    def __init__(self, columns=None, merge_frames=False, lazy_spectra=False, cache_dir=None, cache_size_mb=0):
+        """
+        The reader does not depend on a running :code:`P61App`, so that it can be used in worker processes.
+
+        :param columns: columns of the resulting table, :code:`P61ANexusReader.columns` if None
+        :param merge_frames: if True all frames of a channel are summed up into one dataset
+        :param lazy_spectra: if True, DataY holds :code:`LazySpectrum` handles instead of arrays
+        :param cache_dir: directory of the decoded spectra cache, no caching if None
+        :param cache_size_mb: size limit of the decoded spectra cache
+        """
         self.logger = logging.getLogger(str(self.__class__))
 
+        if columns is not None:
+            self.columns = tuple(columns)
+        self.merge_frames = merge_frames
+        self.lazy_spectra = lazy_spectra
+        self.cache = DecodedCache(cache_dir, cache_size_mb * 2 ** 20) if cache_dir else None
         self._replace = True
 
     def validate(self, f_name):
+        # other HDF5 files, e.g. projects, are left to the other readers
         hists = False
         try:
             with h5py.File(f_name, 'r') as f:
@@ -35,82 +60,173 @@ class P61ANexusReader:
 
         return hists
 
-    def read(self, f_name, sum_frames=False):
-        # define resulting data frame
-        if self.q_app is not None:
-            result = pd.DataFrame(columns=self.q_app.data.columns)
-            sum_frames = self.q_app.get_merge_frames()
+    def get_kev(self, ii, n_bins):
+        """
+        Shared read-only energy axis of the channel :code:`ii` with :code:`n_bins` bins.
+        """
+        if ii < len(self.calib):
+            return energy_axis(ii, self.calib[ii], n_bins)
         else:
-            result = pd.DataFrame(columns=self.columns)
-        # process current nexus file
-        with h5py.File(f_name, 'r') as f:
-            # iterate over each channel
-            for ii, channel in enumerate((self.ch0, self.ch1)):
-                # if no frames existing
-                if '/'.join(channel + self.hist) not in f:
-                    continue
-                # determine frames of measured intensity
+            return energy_axis(ii, (5E-2, 0.), n_bins, offset=0.5)
+
+    def frame_columns(self, f_name, ii, channel, n_frames, sum_frames=False):
+        """
+        Columns of the resulting table that only depend on the file name, channel and number of frames.
+        """
+        return {
+            'DataID': [f_name + ':' + '/'.join(channel)] * n_frames,
+            'Channel': [ii] * n_frames,
+            'ScreenName': [os.path.basename(f_name) + ':' + '%02d' % ii + ('' if sum_frames else ':%03d' % fr_num)
+                           for fr_num in range(n_frames)],
+            'Active': [True] * n_frames,
+        }
+
+    def to_cache(self, ch_data):
+        """
+        Arrays of the decoded channel columns to be stored in the :code:`DecodedCache`.
+        """
+        ii = ch_data['Channel'][0]
+        arrays = {'ch%d_DataY' % ii: np.stack(ch_data['DataY'])}
+        for c in ('DeadTime', 'CountTime', 'Cps'):
+            if not isinstance(ch_data[c], list):
+                arrays['ch%d_%s' % (ii, c)] = np.asarray(ch_data[c])
+        return arrays
+
+    def from_cache(self, f_name, arrays, sum_frames=False):
+        """
+        Rebuilds the channel columns from the arrays stored by :code:`to_cache`.
+        """
+        result = []
+        for ii, channel in enumerate((self.ch0, self.ch1)):
+            if 'ch%d_DataY' % ii not in arrays:
+                continue
+            frames = arrays['ch%d_DataY' % ii]
+            n_frames = frames.shape[0]
+            ch_data = self.frame_columns(f_name, ii, channel, n_frames, sum_frames)
+            ch_data['DataX'] = [self.get_kev(ii, frames.shape[1])] * n_frames
+            ch_data['DataY'] = list(frames)
+            for c in ('DeadTime', 'CountTime', 'Cps'):
+                ch_data[c] = arrays.get('ch%d_%s' % (ii, c), [None] * n_frames)
+            result.append(ch_data)
+        return result
+
+    def read_channel(self, f, f_name, ii, channel, sum_frames=False, lazy=False):
+        """
+        Reads all frames of one channel with a single slice per dataset and returns the frame columns of the
+        resulting table as arrays / lists.
+
+        :param f: open h5py.File
+        :param f_name: file name used in the DataID and ScreenName columns
+        :param ii: channel number
+        :param channel: path to the channel group
+        :param sum_frames: if True all frames are summed up into one
+        :param lazy: if True, histograms are not read but referenced by :code:`LazySpectrum` handles
+        :return: dict column name -> list / array with one value per frame
+        """
+        hist = f['/'.join(channel + self.hist)]
+        # corrections to NIST Pb and W lines
+        # calculation of energies
+        kev = self.get_kev(ii, hist.shape[1])
+
+        if lazy and not sum_frames and self._replace:
+            # frames are read, cut and clipped on first access
+            n_frames, path, shape, dtype = hist.shape[0], hist.name, hist.shape[1:], hist.dtype
+            data_x = [kev] * n_frames
+            data_y = [LazySpectrum(f_name, path, fr_num, shape, dtype) for fr_num in range(n_frames)]
+        else:
+            # determine frames of measured intensity
+            frames = hist[()]
+            if sum_frames:
+                frames = np.sum(frames, axis=0, keepdims=True)
+            n_frames = frames.shape[0]
+
+            # reset intensities at low energies (noise) and at highest energy (unprocessed)
+            frames[:, :20] = 0.0
+            frames[:, -1] = 0.0
+            # only intensities >0 allowed
+            if self._replace:
+                frames[frames < 1.0] = 1.0
+                data_x = [kev] * n_frames
+                data_y = list(frames)
+            else:
+                self.logger.warning('NeXuS import filters out intensities <1 ct. '
+                                    'Not all imported datasets have the same shape, this might bring unexpected'
+                                    ' consequences!')
+                data_x = [kev[frame >= 1.0] for frame in frames]
+                data_y = [frame[frame >= 1.0] for frame in frames]
+
+        # scaler values, one per frame
+        scalers = dict()
+        for name, path in (('allevent', self.all_event), ('allgood', self.all_good), ('time', self.time)):
+            if '/'.join(channel + path) in f:
+                scalers[name] = f['/'.join(channel + path)][()]
                 if sum_frames:
-                    frames = [np.sum(f['/'.join(channel + self.hist)], axis=0)]
-                else:
-                    frames = f['/'.join(channel + self.hist)]
-                # determine all events and all good events
-                if ('/'.join(channel + self.all_event) in f) and ('/'.join(channel + self.all_good) in f):
-                    if sum_frames:
-                        allevent = np.sum(f['/'.join(channel + self.all_event)], axis=0)
-                        allgood = np.sum(f['/'.join(channel + self.all_good)], axis=0)
-                        time = np.sum(f['/'.join(channel + self.time)], axis=0)
-                    else:
-                        allevent = f['/'.join(channel + self.all_event)]
-                        allgood = f['/'.join(channel + self.all_good)]
-                        time = f['/'.join(channel + self.time)]
-                # iterate over frames
-                for fr_num, frame in enumerate(frames):
-                    # reset intensities at low energies (noise) and at highest energy (unprocessed)
-                    frame[:20] = 0.0
-                    frame[-1] = 0.0
-                    # corrections to NIST Pb and W lines
-                    # calculation of energies
-                    if ii == 0:
-                        kev = np.arange(frame.shape[0]) * 0.050494483569344 + 0.029899315869827  # old
-                        # kev = np.arange(frame.shape[0]) * 0.0502526643786186 + 0.0233578244744876  # 07.07.22
-                    elif ii == 1:
-                        kev = np.arange(frame.shape[0]) * 0.04995786201326 + 0.106286326963684  # old
-                        # kev = np.arange(frame.shape[0]) * 0.0499765125529105 + 0.02579913996599  # 07.07.22
-                    else:
-                        kev = (np.arange(frame.shape[0]) + 0.5) * 5E-2
-                    # only intensities >0 allowed
-                    if self._replace:
-                        frame[frame < 1.0] = 1.0
-                    else:
-                        self.logger.warning('NeXuS import filters out intensities <1 ct. '
-                                            'Not all imported datasets have the same shape, this might bring unexpected'
-                                            ' consequences!')
-                        kev, frame = kev[frame >= 1.0], frame[frame >= 1.0]
-                    # set values of row
-                    if self.q_app is not None:
-                        row = {c: None for c in self.q_app.data.columns}
-                    else:
-                        row = {c: None for c in self.columns}
-                    if ('/'.join(channel + self.all_event) in f) and ('/'.join(channel + self.all_good) in f):
-                        row.update({'DeadTime': 1. - allgood / allevent if sum_frames else 1. - allgood[fr_num] / allevent[fr_num]})
-                    if '/'.join(channel + self.time) in f:
-                        row.update({'CountTime': time * 1.25e-8 if sum_frames else time[fr_num] * 1.25e-8})
-                        if '/'.join(channel + self.all_good) in f:
-                            row.update({'Cps': allgood / (time * 1.25e-8) if sum_frames else allgood[fr_num] / (time[fr_num] * 1.25e-8)})
-
-                    row.update({
-                        'DataX': kev,
-                        'DataY': frame,
-                        'DataID': f_name + ':' + '/'.join(channel),
-                        'Channel': ii,
-                        'ScreenName': os.path.basename(f_name) + ':' + '%02d' % ii + ('' if sum_frames else ':%03d' % fr_num),
-                        'Active': True,
-                    })
-                    if self.q_app is not None:
-                        row.update({'Color': next(self.q_app.params['ColorWheel'])})
-                    result.loc[result.shape[0]] = row
-        # return result
-        result = result.astype('object')
+                    scalers[name] = np.sum(scalers[name], axis=0, keepdims=True)
+
+        result = self.frame_columns(f_name, ii, channel, n_frames, sum_frames)
+        result.update({
+            'DataX': data_x,
+            'DataY': data_y,
+            'DeadTime': [None] * n_frames,
+            'CountTime': [None] * n_frames,
+            'Cps': [None] * n_frames,
+        })
+        if 'allevent' in scalers and 'allgood' in scalers:
+            result['DeadTime'] = 1. - scalers['allgood'] / scalers['allevent']
+        if 'time' in scalers:
+            result['CountTime'] = scalers['time'] * self.tick
+            if 'allgood' in scalers:
+                result['Cps'] = scalers['allgood'] / result['CountTime']
+
+        return result
+
+    def read(self, f_name):
+        columns, sum_frames, lazy = self.columns, self.merge_frames, self.lazy_spectra
+
+        # lazy handles are not decoded and filtered frames differ in shape, everything else can be cached
+        cache_key, channels = None, None
+        if self.cache is not None and self._replace and (sum_frames or not lazy):
+            cache_key = self.cache.key(f_name, self.version, self.calib, self.tick, sum_frames)
+            arrays = self.cache.get(cache_key)
+            if arrays is not None:
+                channels = self.from_cache(f_name, arrays, sum_frames)
+
+        # process current nexus file
+        if channels is None:
+            channels = []
+            with h5py.File(f_name, 'r') as f:
+                # iterate over each channel
+                for ii, channel in enumerate((self.ch0, self.ch1)):
+                    # if no frames existing
+                    if '/'.join(channel + self.hist) not in f:
+                        continue
+                    channels.append(self.read_channel(f, f_name, ii, channel, sum_frames, lazy))
+
+            if cache_key is not None and channels:
+                arrays = dict()
+                for ch_data in channels:
+                    arrays.update(self.to_cache(ch_data))
+                self.cache.put(cache_key, arrays)
+
+        # collect the result column-wise
+        data = {c: [] for c in columns}
+        for ch_data in channels:
+            n_frames = len(ch_data['DataY'])
+            for c in columns:
+                data[c].extend(ch_data[c] if c in ch_data else [None] * n_frames)
+
+        if not data['DataY']:
+            raise ValueError('No histograms found in %s' % f_name)
+
+        # array-like cells are packed by hand, otherwise pandas would convert every LazySpectrum to an array
+        for c in ('DataX', 'DataY'):
+            if c in data:
+                cells = np.empty(len(data[c]), dtype=object)
+                for jj, val in enumerate(data[c]):
+                    cells[jj] = val
+                data[c] = cells
+
+        # build the table in a single constructor call
+        result = pd.DataFrame(data, columns=columns, dtype='object')
         result[pd.isna(result)] = None
         return result
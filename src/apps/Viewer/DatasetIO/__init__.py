@@ -1,3 +1,4 @@
+from .LazySpectrum import LazySpectrum
 from .P61ANexusReader import P61ANexusReader
 from .P61ANexusHandler import P61ANexusHandler
 from .XSpressCSVReader import XSpressCSVReader
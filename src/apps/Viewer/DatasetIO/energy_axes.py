@@ -0,0 +1,79 @@
+"""
+Registry of shared, read-only energy axes.
+
+All frames of a channel measured with the same calibration have the same :code:`DataX`, so instead of giving every
+row of :code:`P61App.data` its own copy, readers ask the registry for the axis and all rows reference one array.
+Axes that arrive from elsewhere (worker processes, project files) are deduplicated by content with
+:code:`intern_axis`. Shared axes are read-only: code that needs to change x values has to make a copy.
+"""
+import hashlib
+import threading
+import weakref
+import numpy as np
+
+
+# (channel, calibration, n_bins, offset) -> axis
+_axes = dict()
+# content digest -> axis, entries go away together with the last row referencing them
+_interned = weakref.WeakValueDictionary()
+_lock = threading.Lock()
+
+
+def _digest(axis):
+    return axis.dtype.str, axis.shape, hashlib.sha1(axis.tobytes()).hexdigest()
+
+
+def intern_axis(axis):
+    """
+    Returns the shared read-only array with the same content as :code:`axis`, registering a read-only copy of
+    :code:`axis` if there is none yet (read-only arrays are registered as they are). The array of the caller is not
+    changed. Anything that is not a one-dimensional numeric array is returned unchanged.
+    """
+    if not isinstance(axis, np.ndarray) or axis.ndim != 1 or axis.dtype == object:
+        return axis
+
+    key = _digest(axis)
+    with _lock:
+        result = _interned.get(key)
+        if result is None:
+            if axis.flags.writeable:
+                axis = axis.copy()
+                axis.flags.writeable = False
+            _interned[key] = result = axis
+    return result
+
+
+def energy_axis(channel, calib, n_bins, offset=0.):
+    """
+    Shared energy axis of :code:`channel`: the calibration polynomial :code:`calib` (highest power first, as in
+    :code:`np.polyval`) evaluated at the bin numbers :code:`np.arange(n_bins) + offset`.
+
+    :param channel: channel number, part of the key only
+    :param calib: polynomial coefficients
+    :param n_bins: number of bins
+    :param offset: number of the first bin
+    :return: read-only numpy array
+    """
+    key = (channel, tuple(float(c) for c in calib), int(n_bins), float(offset))
+    result = _axes.get(key)
+    if result is None:
+        result = intern_axis(np.polyval(key[1], np.arange(n_bins) + offset))
+        with _lock:
+            result = _axes.setdefault(key, result)
+    return result
+
+
+def intern_axes(axes):
+    """
+    Interns every axis in :code:`axes`, a sequence of :code:`DataX` values. Values that are already the same object
+    are hashed only once.
+
+    :return: object array of shared axes, can be assigned to a DataFrame column as is
+    """
+    seen = dict()
+    result = np.empty(len(axes), dtype=object)
+    for jj, axis in enumerate(axes):
+        if id(axis) not in seen:
+            seen[id(axis)] = intern_axis(axis)
+        result[jj] = seen[id(axis)]
+    return result
@@ -0,0 +1,99 @@
+"""
+Out-of-core reduction of frame stacks stored in HDF5 files.
+
+The histogram dataset (frames x bins) is read in blocks of whole HDF5 chunks that fit into a memory budget, and
+running sums / minima / maxima are updated block by block, so the full stack is never held in memory. Scalers (one
+value per frame) are reduced in the same pass. The median is exact: if the stack does not fit into the budget, the
+blocks are transposed into a temporary memory-mapped file in the same pass, which is then reduced strip by strip.
+"""
+import os
+import tempfile
+import numpy as np
+
+
+reductions = ('sum', 'mean', 'median', 'max', 'min')
+# default memory budget for one block of frames
+max_block_bytes = 64 * 2 ** 20
+
+
+def row_blocks(ds, max_bytes=max_block_bytes):
+    """
+    Splits the first axis of :code:`ds` into slices that hold whole HDF5 chunks and take at most :code:`max_bytes`
+    of memory (at least one chunk / row).
+    """
+    n_rows = ds.shape[0]
+    row_bytes = max(1, int(np.prod(ds.shape[1:])) * ds.dtype.itemsize)
+    step = max(1, max_bytes // row_bytes)
+    if ds.chunks is not None:
+        step = max(ds.chunks[0], step - step % ds.chunks[0])
+    return [slice(r0, min(r0 + step, n_rows)) for r0 in range(0, n_rows, step)]
+
+
+def _sum_dtype(dtype):
+    return np.sum(np.zeros(1, dtype=dtype)).dtype
+
+
+def reduce_frames(hist, scalers=None, how='sum', max_bytes=max_block_bytes):
+    """
+    Reduces a frame stack along the frame axis.
+
+    :param hist: h5py.Dataset or numpy array of shape (frames, bins)
+    :param scalers: dict name -> h5py.Dataset or numpy array with one value per frame
+    :param how: one of :code:`reductions`
+    :param max_bytes: memory budget for one block of frames
+    :return: (reduced histogram of shape (bins, ), dict name -> reduced scaler value)
+    """
+    if how not in reductions:
+        raise ValueError('Unknown reduction %s, expected one of %s' % (how, str(reductions)))
+    scalers = dict() if scalers is None else scalers
+
+    n_frames, n_bins = hist.shape[0], int(np.prod(hist.shape[1:]))
+    if n_frames == 0:
+        raise ValueError('No frames to reduce')
+    in_memory = n_frames * n_bins * hist.dtype.itemsize <= max_bytes
+    # scalers hold one value per frame and are small enough to be collected for the median
+    sc_blocks = {k: [] for k in scalers}
+
+    acc, tmp_name, tmp = None, None, None
+    if how == 'median' and not in_memory:
+        fd, tmp_name = tempfile.mkstemp(suffix='.npy')
+        os.close(fd)
+        tmp = np.lib.format.open_memmap(tmp_name, mode='w+', dtype=hist.dtype, shape=(n_bins, n_frames))
+
+    try:
+        for rows in row_blocks(hist, max_bytes):
+            block = np.asarray(hist[rows]).reshape((-1, n_bins))
+            if how in ('sum', 'mean'):
+                part = np.sum(block, axis=0, dtype=_sum_dtype(hist.dtype) if how == 'sum' else np.float64)
+                acc = part if acc is None else acc + part
+            elif how == 'max':
+                acc = block.max(axis=0) if acc is None else np.maximum(acc, block.max(axis=0))
+            elif how == 'min':
+                acc = block.min(axis=0) if acc is None else np.minimum(acc, block.min(axis=0))
+            elif tmp is not None:
+                tmp[:, rows] = block.T
+            else:
+                acc = block if acc is None else np.concatenate((acc, block))
+
+            for k in scalers:
+                sc_blocks[k].append(np.asarray(scalers[k][rows], dtype=np.float64))
+
+        if how == 'mean':
+            acc = acc / n_frames
+        elif how == 'median':
+            if tmp is None:
+                acc = np.median(acc, axis=0)
+            else:
+                tmp.flush()
+                step = max(1, max_bytes // max(1, n_frames * hist.dtype.itemsize))
+                acc = np.concatenate([np.median(tmp[b0:b0 + step], axis=1) for b0 in range(0, n_bins, step)])
+    finally:
+        if tmp is not None:
+            del tmp
+            os.remove(tmp_name)
+
+    # scalers are reduced like pandas does, skipping NaNs
+    sc_fns = {'sum': np.nansum, 'mean': np.nanmean, 'median': np.nanmedian, 'max': np.nanmax, 'min': np.nanmin}
+    sc_result = {k: sc_fns[how](np.concatenate(v)) if v else np.nan for k, v in sc_blocks.items()}
+
+    return acc.reshape(hist.shape[1:]), sc_result
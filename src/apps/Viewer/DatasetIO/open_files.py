@@ -0,0 +1,65 @@
+"""
+Module-level entry points for reading spectra files, used by :code:`FileOpenWorker` both in its own thread and in
+worker processes. Everything here has to stay picklable and must not touch :code:`P61App`.
+"""
+from utils import cancel
+
+
+# reader instances of the current process and what they were made from, see init_readers
+_readers = None
+_reader_args = None
+
+
+def init_readers(reader_types, settings):
+    """
+    Instantiates every reader once per process, again only if the arguments change.
+
+    :param reader_types: sequence of reader classes, tried in this order
+    :param settings: keyword arguments for the reader constructors (columns, merge_frames, lazy_spectra)
+    """
+    global _readers, _reader_args
+    if _reader_args != (tuple(reader_types), settings):
+        _readers = [reader(**settings) for reader in reader_types]
+        _reader_args = (tuple(reader_types), dict(settings))
+
+
+def open_file(f_name):
+    """
+    Reads :code:`f_name` with the first reader that validates it.
+
+    :param f_name:
+    :return: (DataFrame or None, error message or None)
+    """
+    try:
+        for reader in _readers:
+            if reader.validate(f_name):
+                return reader.read(f_name), None
+        return None, 'no suitable reader'
+    except Exception as e:
+        return None, str(e)
+
+
+def open_chunk(f_names, reader_types, settings):
+    """
+    :return: list of :code:`open_file` results for :code:`f_names`, read with the readers of the worker process
+    """
+    init_readers(reader_types, settings)
+    return [open_file(f_name) for f_name in f_names]
+
+
+def open_files(executor, f_names, reader_types, settings, chunk_size=1):
+    """
+    Reads :code:`f_names` on a pool made by :code:`utils.spawn_pool`. Every worker makes its own set of readers with
+    the first chunk it reads, so a pool can be kept for several calls. Files are sent to the workers in chunks of
+    :code:`chunk_size`; the results of :code:`open_file` are yielded in the order of :code:`f_names` as soon as they
+    are available. Closing the generator cancels the chunks that were not started yet.
+    """
+    chunk_size = max(1, chunk_size)
+    futures = [executor.submit(open_chunk, f_names[ii:ii + chunk_size], tuple(reader_types), dict(settings))
+               for ii in range(0, len(f_names), chunk_size)]
+    try:
+        for future in futures:
+            for result in future.result():
+                yield result
+    finally:
+        cancel(futures)
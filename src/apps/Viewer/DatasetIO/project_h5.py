@@ -0,0 +1,333 @@
+"""
+HDF5 project files.
+
+Layout of a project file:
+
+.. code-block:: text
+
+    /                         attrs: format, version
+    /rows                     one record per row of P61App.data: ScreenName, DataID, Channel, Active, DeadTime,
+                              CountTime, Cps, Chi2, HasMotors, and where its spectrum is (Group, Frame)
+    /spectra/g<k>/DataY       intensities of all rows with the same length and dtype, chunked and compressed 2D array
+    /spectra/g<k>/DataX       energy axis, 1D if all rows of the group share it, 2D otherwise
+    /motors                   motor positions (rows x motors), NaN where a row has no value, attrs: names
+    /peaks, /bckgs            one record per PeakData / BckgData with the row it belongs to and the range of its
+                              parameters in /peak_params, /bckg_params (and of its coefficients in /bckg_coefs)
+    /peak_params, /bckg_params
+                              one record per model parameter: value, std, bounds, refinement flag
+    /hkl_phases               one record per PhaseData
+    /hkl_peaks/p<k>           hkl peaks of one phase, attrs: name
+
+Spectra are not read on loading: :code:`read_project` returns :code:`LazySpectrum` handles into the file.
+"""
+import os
+import h5py
+import numpy as np
+
+from DatasetIO.LazySpectrum import LazySpectrum, forget
+from DatasetIO.energy_axes import intern_axis
+
+
+file_format = 'P61AViewer project'
+version = 1
+
+# target size of one HDF5 chunk of intensities, small enough for the default chunk cache of h5py
+chunk_bytes = 2 ** 18
+# memory budget for the intensities written at once
+max_block_bytes = 64 * 2 ** 20
+
+_str = h5py.string_dtype()
+row_dtype = np.dtype([('ScreenName', _str), ('DataID', _str), ('Channel', np.int64), ('Active', np.bool_),
+                      ('DeadTime', np.float64), ('CountTime', np.float64), ('Cps', np.float64),
+                      ('Chi2', np.float64), ('HasMotors', np.bool_), ('Group', np.int64), ('Frame', np.int64)])
+peak_dtype = np.dtype([('Row', np.int64), ('idx', np.int64), ('track', np.int64), ('l_bh', np.float64),
+                       ('r_bh', np.float64), ('md_name', _str), ('md_prefix', _str),
+                       ('p0', np.int64), ('p1', np.int64)])
+bckg_dtype = np.dtype([('Row', np.int64), ('md_name', _str), ('p0', np.int64), ('p1', np.int64),
+                       ('c0', np.int64), ('c1', np.int64)])
+# refine: -1 if the parameter has no refinement flag
+param_dtype = np.dtype([('name', _str), ('has_value', np.bool_), ('n', np.float64), ('s', np.float64),
+                        ('has_bounds', np.bool_), ('lb', np.float64), ('ub', np.float64), ('refine', np.int8)])
+
+
+def is_project(f_name):
+    """
+    :return: True if :code:`f_name` is an HDF5 project file
+    """
+    try:
+        if not h5py.is_hdf5(f_name):
+            return False
+        with h5py.File(f_name, 'r') as f:
+            return f.attrs.get('format') == file_format
+    except OSError:
+        return False
+
+
+def _float(val):
+    return np.nan if val is None else float(val)
+
+
+def _str_or_empty(val):
+    return '' if val is None else str(val)
+
+
+def _records(dicts):
+    """
+    Structured array from a list of dicts with the same keys, strings become variable length strings.
+    """
+    if not dicts:
+        return None
+    fields = []
+    for k, v in dicts[0].items():
+        if isinstance(v, str):
+            fields.append((k, _str))
+        elif isinstance(v, (bool, np.bool_)):
+            fields.append((k, np.bool_))
+        elif isinstance(v, (int, np.integer)):
+            fields.append((k, np.int64))
+        else:
+            fields.append((k, np.float64))
+    result = np.zeros(len(dicts), dtype=fields)
+    for ii, item in enumerate(dicts):
+        result[ii] = tuple(item[k] for k, _ in fields)
+    return result
+
+
+def _dicts(records):
+    return [{k: _item(rec[k]) for k in records.dtype.names} for rec in records]
+
+
+def _item(val):
+    if isinstance(val, bytes):
+        return val.decode('utf-8')
+    if isinstance(val, np.generic):
+        return val.item()
+    return val
+
+
+def _params(item, params):
+    """
+    Appends the parameters of a PeakData / BckgData dict (:code:`to_dict`) to :code:`params`.
+
+    :return: (first, last + 1) position of the parameters in :code:`params`
+    """
+    p0 = len(params)
+    for name in dict.fromkeys(list(item['md_params']) + list(item['md_p_bounds']) + list(item['md_p_refine'])):
+        n, s = item['md_params'].get(name, (np.nan, np.nan))
+        lb, ub = item['md_p_bounds'].get(name, (np.nan, np.nan))
+        params.append((name, name in item['md_params'], n, s, name in item['md_p_bounds'], lb, ub,
+                       int(item['md_p_refine'][name]) if name in item['md_p_refine'] else -1))
+    return p0, len(params)
+
+
+def _param_dicts(params):
+    """
+    :return: (md_params, md_p_bounds, md_p_refine) in the format of :code:`PeakData.to_dict`
+    """
+    md_params, md_p_bounds, md_p_refine = dict(), dict(), dict()
+    for name, has_value, n, s, has_bounds, lb, ub, refine in params.tolist():
+        name = _item(name)
+        if has_value:
+            md_params[name] = (n, s)
+        if has_bounds:
+            md_p_bounds[name] = (lb, ub)
+        if refine != -1:
+            md_p_refine[name] = bool(refine)
+    return md_params, md_p_bounds, md_p_refine
+
+
+def _write_spectra(f, spectra):
+    """
+    Writes the intensities and energy axes grouped by length and dtype.
+
+    :return: (group number, frame in the group) per row
+    """
+    n_rows = len(spectra)
+    group, frame = np.zeros(n_rows, dtype=np.int64), np.zeros(n_rows, dtype=np.int64)
+    keys = dict()
+    for row in range(n_rows):
+        cell = spectra.intensity(row)
+        key = (cell.shape[0], np.dtype(cell.dtype).str)
+        group[row] = keys.setdefault(key, len(keys))
+
+    spectra_grp = f.create_group('spectra')
+    for (n_bins, dtype), g_id in keys.items():
+        rows = np.flatnonzero(group == g_id)
+        frame[rows] = np.arange(rows.shape[0])
+        grp = spectra_grp.create_group('g%d' % g_id)
+
+        dtype = np.dtype(dtype)
+        row_bytes = max(1, n_bins * dtype.itemsize)
+        ds = grp.create_dataset('DataY', shape=(rows.shape[0], n_bins), dtype=dtype,
+                                chunks=(int(min(rows.shape[0], max(1, chunk_bytes // row_bytes))), n_bins),
+                                compression='gzip', compression_opts=1, shuffle=True)
+        step = max(1, max_block_bytes // row_bytes)
+        for r0 in range(0, rows.shape[0], step):
+            ds[r0:r0 + step] = spectra.matrix(rows[r0:r0 + step])
+
+        axes = spectra.axes[rows]
+        if all(xx is axes[0] or np.array_equal(xx, axes[0]) for xx in axes):
+            grp.create_dataset('DataX', data=np.asarray(axes[0]))
+        else:
+            grp.create_dataset('DataX', data=np.stack([np.asarray(xx) for xx in axes]),
+                               compression='gzip', compression_opts=1, shuffle=True)
+
+    return group, frame
+
+
+def write_project(f_name, data, spectra, motors, hkl_peaks=None, hkl_phases=None):
+    """
+    Writes a project file. The file is written next to :code:`f_name` first and moved into place, so the previous
+    version stays intact if writing fails.
+
+    :param f_name: project file
+    :param data: :code:`P61App.data`
+    :param spectra: :code:`P61App.spectra`
+    :param motors: :code:`P61App.motors`
+    :param hkl_peaks: dict phase name -> list of peak dicts
+    :param hkl_phases: list of :code:`PhaseData`
+    :return: list of :code:`LazySpectrum` per row pointing into the written file
+    """
+    tmp_name = f_name + '.%d.tmp' % os.getpid()
+    try:
+        with h5py.File(tmp_name, 'w') as f:
+            f.attrs['format'] = file_format
+            f.attrs['version'] = version
+
+            group, frame = _write_spectra(f, spectra)
+
+            rows = np.zeros(data.shape[0], dtype=row_dtype)
+            rows['ScreenName'] = [_str_or_empty(val) for val in data['ScreenName']]
+            rows['DataID'] = [_str_or_empty(val) for val in data['DataID']]
+            rows['Channel'] = [-1 if val is None else val for val in data['Channel']]
+            rows['Active'] = data['Active'].astype(bool)
+            for k in ('DeadTime', 'CountTime', 'Cps', 'Chi2'):
+                rows[k] = [_float(val) for val in data[k]]
+            rows['HasMotors'] = data['Motors'].notna()
+            rows['Group'], rows['Frame'] = group, frame
+            f.create_dataset('rows', data=rows)
+
+            ds = f.create_dataset('motors', data=motors.values)
+            ds.attrs['names'] = np.array(motors.names, dtype=_str)
+
+            peaks, peak_params, bckgs, bckg_params, bckg_coefs = [], [], [], [], []
+            for row, (peak_list, bckg_list) in enumerate(zip(data['PeakDataList'], data['BckgDataList'])):
+                for peak in (peak_list or []):
+                    peak = peak.to_dict()
+                    peaks.append((row, peak['idx'], -1 if peak['track'] is None else peak['track'],
+                                  _float(peak['bh'][0]), _float(peak['bh'][1]), peak['md_name'], peak['md_prefix']) +
+                                 _params(peak, peak_params))
+                for bckg in (bckg_list or []):
+                    bckg = bckg.to_dict()
+                    coefs = bckg.get('poly_coefs', [])
+                    bckgs.append((row, bckg['md_name']) + _params(bckg, bckg_params) +
+                                 (len(bckg_coefs), len(bckg_coefs) + len(coefs)))
+                    bckg_coefs.extend(coefs)
+
+            f.create_dataset('peaks', data=np.array(peaks, dtype=peak_dtype))
+            f.create_dataset('peak_params', data=np.array(peak_params, dtype=param_dtype))
+            f.create_dataset('bckgs', data=np.array(bckgs, dtype=bckg_dtype))
+            f.create_dataset('bckg_params', data=np.array(bckg_params, dtype=param_dtype))
+            f.create_dataset('bckg_coefs', data=np.array(bckg_coefs, dtype=np.float64))
+
+            if hkl_phases:
+                f.create_dataset('hkl_phases', data=_records([phase.to_dict() for phase in hkl_phases]))
+            if hkl_peaks is not None:
+                grp = f.create_group('hkl_peaks')
+                for ii, (name, peak_list) in enumerate(hkl_peaks.items()):
+                    ds = grp.create_dataset('p%d' % ii, data=_records(peak_list) if peak_list else h5py.Empty('f8'))
+                    ds.attrs['name'] = name
+
+            shapes = {g_id: f['spectra/g%d/DataY' % g_id].shape for g_id in np.unique(group)}
+            dtypes = {g_id: f['spectra/g%d/DataY' % g_id].dtype for g_id in shapes}
+
+        forget(f_name)
+        os.replace(tmp_name, f_name)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        raise
+
+    return [LazySpectrum(f_name, 'spectra/g%d/DataY' % g_id, int(fr), shapes[g_id][1:], dtypes[g_id],
+                         noise_cut=None, clip=None) for g_id, fr in zip(group, frame)]
+
+
+def read_project(f_name):
+    """
+    Reads a project file into the same structure as the pickled projects: dict with 'spectra' (list of row dicts with
+    the peaks and backgrounds as :code:`to_dict` dicts), 'hkl_peaks' and 'hkl_phases' (list of :code:`PhaseData`
+    dicts). Intensities are returned as :code:`LazySpectrum` handles and read when they are needed.
+    """
+    with h5py.File(f_name, 'r') as f:
+        if f.attrs.get('format') != file_format:
+            raise ValueError('%s is not a project file' % f_name)
+        if f.attrs['version'] > version:
+            raise ValueError('%s was written by a newer version (%d)' % (f_name, f.attrs['version']))
+
+        rows = f['rows'][()]
+        motors = f['motors'][()]
+        motor_names = [_item(name) for name in f['motors'].attrs['names']]
+
+        groups = dict()
+        for g_id in np.unique(rows['Group']):
+            grp = f['spectra/g%d' % g_id]
+            groups[g_id] = (grp['DataY'].shape, grp['DataY'].dtype, grp['DataX'][()])
+
+        peaks, peak_params = f['peaks'][()], f['peak_params'][()]
+        bckgs, bckg_params, bckg_coefs = f['bckgs'][()], f['bckg_params'][()], f['bckg_coefs'][()]
+
+        hkl_phases = _dicts(f['hkl_phases'][()]) if 'hkl_phases' in f else None
+        hkl_peaks = None
+        if 'hkl_peaks' in f:
+            hkl_peaks = dict()
+            for ds in f['hkl_peaks'].values():
+                hkl_peaks[_item(ds.attrs['name'])] = [] if ds.shape is None else _dicts(ds[()])
+
+    axes = {g_id: intern_axis(xx) for g_id, (_, _, xx) in groups.items() if xx.ndim == 1}
+
+    spectra = []
+    for row, rec in enumerate(rows):
+        g_id, fr = rec['Group'], int(rec['Frame'])
+        shape, dtype, xx = groups[g_id]
+        spectra.append({
+            'DataX': axes[g_id] if g_id in axes else intern_axis(xx[fr].copy()),
+            'DataY': LazySpectrum(f_name, 'spectra/g%d/DataY' % g_id, fr, shape[1:], dtype,
+                                  noise_cut=None, clip=None),
+            'ScreenName': _item(rec['ScreenName']),
+            'DataID': _item(rec['DataID']),
+            'Channel': int(rec['Channel']) if rec['Channel'] != -1 else None,
+            'Active': bool(rec['Active']),
+            'DeadTime': float(rec['DeadTime']),
+            'CountTime': float(rec['CountTime']),
+            'Cps': float(rec['Cps']),
+            'Chi2': None if np.isnan(rec['Chi2']) else float(rec['Chi2']),
+            'Motors': {name: val for name, val in zip(motor_names, motors[row].tolist()) if not np.isnan(val)}
+            if rec['HasMotors'] else None,
+            'PeakDataList': [],
+            'BckgDataList': [],
+        })
+
+    for peak in peaks:
+        md_params, md_p_bounds, md_p_refine = _param_dicts(peak_params[peak['p0']:peak['p1']])
+        spectra[peak['Row']]['PeakDataList'].append({
+            'bh': (float(peak['l_bh']), float(peak['r_bh'])),
+            'track': int(peak['track']) if peak['track'] != -1 else None,
+            'idx': int(peak['idx']),
+            'md_name': _item(peak['md_name']),
+            'md_prefix': _item(peak['md_prefix']),
+            'md_params': md_params,
+            'md_p_bounds': md_p_bounds,
+            'md_p_refine': md_p_refine,
+        })
+
+    for bckg in bckgs:
+        md_params, md_p_bounds, md_p_refine = _param_dicts(bckg_params[bckg['p0']:bckg['p1']])
+        spectra[bckg['Row']]['BckgDataList'].append({
+            'md_name': _item(bckg['md_name']),
+            'md_params': md_params,
+            'md_p_bounds': md_p_bounds,
+            'md_p_refine': md_p_refine,
+            'poly_coefs': bckg_coefs[bckg['c0']:bckg['c1']].tolist(),
+        })
+
+    return {'spectra': spectra, 'hkl_peaks': hkl_peaks, 'hkl_phases': hkl_phases}
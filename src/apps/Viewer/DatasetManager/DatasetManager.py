@@ -10,37 +10,102 @@ from .ExportPopUp import ExportPopUp
 from P61App import P61App
 from ThreadIO import Worker
 from DatasetIO import DatasetReaders
+from DatasetIO.DecodedCache import DecodedCache
+from DatasetIO.energy_axes import intern_axes
+from DatasetIO.open_files import init_readers, open_file, open_files
 
 
 class FileOpenWorker(Worker):
+    """
+    Opens a list of files. Files are read in the worker thread itself or, if :code:`config['open_processes']` is
+    above 1 and there are at least :code:`config['open_processes_min_files']` of them, in the session's pool of worker
+    processes (:code:`P61App.get_process_pool`).
+    Readers that can not run in a worker process (:code:`parallel = False`, e.g. the FIO reader asking for a
+    directory) are always run in the thread, before the others.
+
+    Spectra are emitted with :code:`foWorkerBatch` every :code:`config['open_batch_size']` files in the order of the
+    files. The final :code:`foWorkerResult` holds the failed files and the metadata tables (FIO), if any.
+    """
     def __init__(self, files):
-        def fn(fs):
-            failed, opened = [], pd.DataFrame(columns=self.q_app.data.columns)
-            for ii, file in enumerate(fs):
+        def read_all(fs):
+            in_pool = []
+            if n_processes > 1:
+                thread_only = [reader(**settings) for reader in DatasetReaders if not getattr(reader, 'parallel', True)]
+                in_pool = [ii for ii, file in enumerate(fs) if not any(r.validate(file) for r in thread_only)]
+                if len(in_pool) < self.q_app.config['open_processes_min_files']:
+                    in_pool = []
+            in_thread = sorted(set(range(len(fs))) - set(in_pool))
+
+            for ii in in_thread:
                 if self.stop:
-                    break
-                try:
-                    for reader in DatasetReaders:
-                        if reader().validate(file):
-                            opened = pd.concat((opened, reader().read(file)), ignore_index=True)
-                            break
-                    else:
-                        failed.append(file)
-                except Exception as e:
-                    self.logger.info(str(e))
+                    return
+                yield fs[ii], open_file(fs[ii])
+
+            if in_pool and not self.stop:
+                chunk_size = min(64, max(1, len(in_pool) // (4 * n_processes)))
+                executor = self.q_app.get_process_pool('open', n_processes)
+                pooled = open_files(executor, [fs[ii] for ii in in_pool], DatasetReaders, settings, chunk_size)
+                for ii, result in zip(in_pool, pooled):
+                    yield fs[ii], result
+                    if self.stop:
+                        # cancels the files that were not started yet
+                        pooled.close()
+                        return
+
+        def emit_batch(frames):
+            if not frames:
+                return
+            opened = pd.concat(frames, ignore_index=True)
+            # colors are handed out here, as the readers may run in other processes
+            opened['Color'] = [next(self.q_app.params['ColorWheel']) for _ in range(opened.shape[0])]
+            # axes read in worker processes or from single-spectrum files arrive as copies
+            opened['DataX'] = intern_axes(opened['DataX'])
+            self.logger.debug('fn: Emitting foWorkerBatch(%d rows)' % opened.shape[0])
+            self.threadWorkerBatch.emit(opened)
+
+        def fn(fs):
+            init_readers(DatasetReaders, settings)
+
+            failed, metadata, batch = [], [pd.DataFrame(columns=settings['columns'])], []
+            for n_done, (file, (frame, error)) in enumerate(read_all(fs), start=1):
+                if frame is None:
+                    self.logger.info('%s: %s' % (file, error))
                     failed.append(file)
+                elif 'DataY' in frame.columns:
+                    batch.append(frame)
+                else:
+                    metadata.append(frame)
 
-                self.threadWorkerStatus.emit(ii)
-            return failed, opened
+                if n_done % batch_size == 0:
+                    emit_batch(batch)
+                    batch = []
+                self.threadWorkerStatus.emit(n_done)
+            emit_batch(batch)
+
+            if settings['cache_dir'] is not None:
+                DecodedCache(settings['cache_dir'], settings['cache_size_mb'] * 2 ** 20).evict()
+
+            return failed, pd.concat(metadata, ignore_index=True)
 
         self.stop = False
 
         super(FileOpenWorker, self).__init__(fn, args=[files], kwargs={})
 
+        settings = {
+            'columns': tuple(self.q_app.data.columns),
+            'merge_frames': self.q_app.get_merge_frames(),
+            'lazy_spectra': self.q_app.config['lazy_spectra'],
+            'cache_dir': self.q_app.config['decoded_cache_dir'] if self.q_app.config['decoded_cache'] else None,
+            'cache_size_mb': self.q_app.config['decoded_cache_size_mb'],
+        }
+        n_processes = self.q_app.config['open_processes']
+        batch_size = max(1, self.q_app.config['open_batch_size'])
+
         self.threadWorkerException = self.q_app.foWorkerException
         self.threadWorkerResult = self.q_app.foWorkerResult
         self.threadWorkerFinished = self.q_app.foWorkerFinished
         self.threadWorkerStatus = self.q_app.foWorkerStatus
+        self.threadWorkerBatch = self.q_app.foWorkerBatch
 
     def halt(self):
         self.stop = True
@@ -53,6 +118,7 @@ class DatasetManager(QWidget):
         self.logger = logging.getLogger(str(self.__class__))
         self.progress = None
         self._hold_md = None
+        self._insert_pos = 0
 
         self.view = QTableView()
         self.view.setModel(self.q_app.data_model)
@@ -101,6 +167,7 @@ class DatasetManager(QWidget):
         self.q_app.dataActiveChanged.connect(self.on_data_ac)
         self.q_app.foWorkerException.connect(self.on_tw_exception)
         self.q_app.foWorkerResult.connect(self.on_tw_result)
+        self.q_app.foWorkerBatch.connect(self.on_tw_batch)
         self.q_app.foWorkerFinished.connect(self.on_tw_finished)
 
     def show_header_menu(self, point):
@@ -170,8 +237,9 @@ class DatasetManager(QWidget):
 
         self.q_app.data_dir = os.path.commonpath(files)
         if files[-1][-4:] == '.fio':
-            self.q_app.proj_f_name_hint = os.path.basename(files[-1]).replace('.fio', '.json')
+            self.q_app.proj_f_name_hint = os.path.basename(files[-1]).replace('.fio', '.h5')
 
+        self._insert_pos = 0
         self.progress = QProgressDialog("Opening files", "Cancel", 0, len(files))
         fw = FileOpenWorker(files)
         self.q_app.foWorkerStatus.connect(self.progress.setValue)
@@ -201,26 +269,41 @@ class DatasetManager(QWidget):
             self.progress.close()
             self.progress = None
 
+    def _insert_opened(self, opened, position):
+        """
+        Inserts the rows of :code:`opened` to :code:`self.q_app.data` at :code:`position`, attaching the motor
+        positions held from a FIO file if there are any.
+        """
+        if self._hold_md is not None:
+            opened['Motors'] = opened.apply(lambda rw: self._hold_md[':'.join(rw['DataID'].split(':')[:-1])], axis=1)
+
+        self.q_app.data_model.insert_data(position, opened)
+        self.q_app.data_model.dataChanged.emit(
+            self.q_app.data_model.index(position, 0),
+            self.q_app.data_model.index(position + opened.shape[0], self.q_app.data_model.columnCount())
+        )
+
+        self.logger.debug('_insert_opened: Emitting dataRowsInserted(%d, %d)' % (position, opened.shape[0]))
+        self.q_app.emit_rows_inserted(position, opened.shape[0])
+
+    def on_tw_batch(self, opened):
+        self.logger.debug('on_tw_batch: Handling FileOpenWorker.threadWorkerBatch')
+        if opened.shape[0] == 0 or set(opened.columns) != set(self.q_app.data.columns):
+            return
+
+        # batches keep the order of the files and are inserted one after another at the top of the list
+        self._insert_opened(opened, self._insert_pos)
+        self._insert_pos += opened.shape[0]
+        self.ch_cb_update()
+
     def on_tw_result(self, result):
         self.logger.debug('on_tw_result: Handling FileOpenWorker.threadWorkerResult')
         failed, opened = result
 
         if set(opened.columns) == set(self.q_app.data.columns):
-            if self._hold_md is not None:
-                opened['Motors'] = opened.apply(lambda rw: self._hold_md[':'.join(rw['DataID'].split(':')[:-1])], axis=1)
-                self._hold_md = None
-
-            self.q_app.data_model.insertRows(0, opened.shape[0])
-            self.q_app.data[0:opened.shape[0]] = opened
-            self.q_app.data_model.dataChanged.emit(
-                self.q_app.data_model.index(0, 0),
-                self.q_app.data_model.index(opened.shape[0], self.q_app.data_model.columnCount())
-            )
-
-            self.logger.debug('on_tw_result: Emitting dataRowsInserted(%d, %d)' % (0, opened.shape[0]))
-            self.q_app.dataRowsInserted.emit(0, opened.shape[0])
-
-            self.ch_cb_update()
+            if opened.shape[0] > 0:
+                self.on_tw_batch(opened)
+            self._hold_md = None
 
             if failed:
                 msg = QErrorMessage()
@@ -236,28 +319,6 @@ class DatasetManager(QWidget):
         else:
             self._hold_md = None
 
-    @staticmethod
-    def to_consecutive(lst):
-        """
-        Transforms a list of indices to a list of pairs (index, amount of consecutive indices after it)
-        :param lst:
-        :return:
-        """
-        if len(lst) == 1:
-            return [(lst[0], 1), ]
-
-        i1, i2 = 0, 1
-        result = []
-        while i2 < len(lst):
-            if lst[i2] - lst[i1] == i2 - i1:
-                i2 += 1
-            else:
-                result.append((lst[i1], i2 - i1))
-                i1 = i2
-                i2 += 1
-        result.append((lst[i1], i2 - i1))
-        return reversed(result)
-
     def bminus_onclick(self):
         if self.progress is not None:
             return
@@ -265,8 +326,7 @@ class DatasetManager(QWidget):
         if len(rows) == 0:
             return
 
-        for position, amount in self.to_consecutive(sorted(rows)):
-            self.q_app.data_model.removeRows(position, amount)
+        self.q_app.data_model.remove_data(rows)
         self.logger.debug('bminus_onclick: Emitting dataRowsRemoved(%s)' % (str(rows), ))
         self.q_app.dataRowsRemoved.emit(rows)
 
@@ -294,7 +354,7 @@ class DatasetManager(QWidget):
         )
 
         self.logger.debug('checkbox_onclick: Emitting dataActiveChanged(%s)' % (str(rows),))
-        self.q_app.dataActiveChanged.emit(rows)
+        self.q_app.emit_rows('dataActiveChanged', rows)
 
     def ch0_cb_onclick(self, *args, **kwargs):
         self.ch_cb_onclick(self.ch0_checkbox, 0)
@@ -318,7 +378,7 @@ class DatasetManager(QWidget):
         )
 
         self.logger.debug('ch_cb_onclick: Emitting dataActiveChanged(%s)' % (str(rows),))
-        self.q_app.dataActiveChanged.emit(rows)
+        self.q_app.emit_rows('dataActiveChanged', rows)
 
     def checkbox_update(self):
         rows = [idx.row() for idx in self.view.selectedIndexes()]
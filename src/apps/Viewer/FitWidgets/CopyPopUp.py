@@ -39,7 +39,7 @@ class CopyPopUp(QDialog):
             bckg_list = self.q_app.get_bckg_data_list(self.q_app.get_selected_idx())
             for idx in idx_to:
                 self.q_app.set_bckg_data_list(idx, copy.deepcopy(bckg_list), emit=False)
-            self.q_app.bckgListChanged.emit(idx_to)
+            self.q_app.emit_rows('bckgListChanged', idx_to)
         self.close()
 
 
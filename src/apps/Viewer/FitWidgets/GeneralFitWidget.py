@@ -1,6 +1,7 @@
 from PyQt5.QtWidgets import QWidget, QGridLayout, QPushButton, QFileDialog
 from PyQt5.QtCore import Qt
 import logging
+import numpy as np
 
 from P61App import P61App
 from DatasetManager import DatasetViewer
@@ -14,13 +15,19 @@ from peak_fit_utils import fit_peaks as fit_peaks2, fit_bckg as fit_bckg2, fit_t
 
 class FitWorker(Worker):
     def __init__(self, x, y, peak_list, bckg_list, fit_type):
+        config = P61App.instance().config
+        varpro_min_peaks, residuals = config['fit_varpro_min_peaks'], config['fit_residuals']
         if fit_type == 'peaks':
-            super(FitWorker, self).__init__(fit_peaks2, args=[], kwargs={'xx': x, 'yy': y, 'peak_list': peak_list, 'bckg_list': bckg_list})
+            super(FitWorker, self).__init__(fit_peaks2, args=[], kwargs={'xx': x, 'yy': y, 'peak_list': peak_list, 'bckg_list': bckg_list,
+                                                                         'varpro_min_peaks': varpro_min_peaks,
+                                                                         'residuals': residuals})
         elif fit_type == 'bckg':
-            super(FitWorker, self).__init__(fit_bckg2, args=[], kwargs={'xx': x, 'yy': y, 'peak_list': peak_list, 'bckg_list': bckg_list})
+            super(FitWorker, self).__init__(fit_bckg2, args=[], kwargs={'xx': x, 'yy': y, 'peak_list': peak_list, 'bckg_list': bckg_list,
+                                                                        'residuals': residuals})
         elif fit_type == 'prec':
             super(FitWorker, self).__init__(fit_to_precision2, args=[],
-                                            kwargs={'xx': x, 'yy': y, 'peak_list': peak_list, 'bckg_list': bckg_list})
+                                            kwargs={'xx': x, 'yy': y, 'peak_list': peak_list, 'bckg_list': bckg_list,
+                                                    'varpro_min_peaks': varpro_min_peaks, 'residuals': residuals})
         else:
             raise ValueError('fit_type argument should be \'peaks\' or \'bckg\'')
 
@@ -83,7 +90,7 @@ class GeneralFitWidget(QWidget):
         self.logger.debug('on_tw_result: Handling FitWorker.threadWorkerResult')
         chi2, bckg_list, peak_list = result
 
-        self.q_app.data.loc[self.fit_idx, 'Chi2'] = chi2
+        self.q_app.set_chi2(self.fit_idx, chi2)
         self.q_app.set_bckg_data_list(self.fit_idx, bckg_list)
         self.q_app.set_peak_data_list(self.fit_idx, peak_list)
 
@@ -111,7 +118,7 @@ class GeneralFitWidget(QWidget):
         if bckg_list is None:
             bckg_list = []
 
-        xx, yy = self.q_app.data.loc[idx, 'DataX'], self.q_app.data.loc[idx, 'DataY']
+        xx, yy = self.q_app.data.loc[idx, 'DataX'], np.asarray(self.q_app.data.loc[idx, 'DataY'])
 
         fw = FitWorker(xx, yy, peak_list, bckg_list, fit_type='peaks')
         self.fit_idx = idx
@@ -137,7 +144,7 @@ class GeneralFitWidget(QWidget):
         if bckg_list is None:
             return
 
-        xx, yy = self.q_app.data.loc[idx, 'DataX'], self.q_app.data.loc[idx, 'DataY']
+        xx, yy = self.q_app.data.loc[idx, 'DataX'], np.asarray(self.q_app.data.loc[idx, 'DataY'])
 
         fw = FitWorker(xx, yy, peak_list, bckg_list, fit_type='bckg')
         self.fit_idx = idx
@@ -163,7 +170,7 @@ class GeneralFitWidget(QWidget):
         if bckg_list is None:
             bckg_list = []
 
-        xx, yy = self.q_app.data.loc[idx, 'DataX'], self.q_app.data.loc[idx, 'DataY']
+        xx, yy = self.q_app.data.loc[idx, 'DataX'], np.asarray(self.q_app.data.loc[idx, 'DataY'])
 
         fw = FitWorker(xx, yy, peak_list, bckg_list, fit_type='prec')
         self.fit_idx = idx
@@ -29,7 +29,7 @@ class InitPopUp(QDialog):
         ids = self.list_to.get_selected()
         for idx in ids:
             self.parent().init_from_peaklist(idx, emit=False)
-        self.q_app.genFitResChanged.emit(ids)
+        self.q_app.emit_rows('genFitResChanged', ids)
         self.close()
 
 
@@ -1,10 +1,81 @@
 from PyQt5.QtWidgets import QDialog, QGridLayout, QPushButton, QLabel, QComboBox, QProgressDialog, QCheckBox
 from PyQt5.Qt import Qt
+import numpy as np
 import copy
 import logging
 
 from P61App import P61App
 from DatasetManager import DatasetSelector
+from ThreadIO import Worker
+from peak_fit_utils.batch_refinement import make_task, fit_spectrum, fit_spectra, apply_result
+
+
+class BatchFitWorker(Worker):
+    """
+    Fits a list of spectra independently of each other. Spectra are fitted in the worker thread itself or, if
+    :code:`config['fit_processes']` is above 1 and there are at least :code:`config['fit_processes_min_spectra']` of
+    them, in the session pool of worker processes, see :code:`P61App.get_process_pool`.
+
+    Results are emitted with :code:`bfWorkerBatch` every :code:`config['fit_batch_size']` spectra in the order they
+    are finished, as lists of (idx, result) with result as returned by :code:`batch_refinement.fit_spectrum`. The
+    final :code:`bfWorkerResult` holds the rows that could not be fitted.
+
+    :param tasks: list of :code:`batch_refinement.make_task` tasks
+    """
+    def __init__(self, tasks):
+        def fit_all(ts):
+            if n_processes > 1 and len(ts) >= self.q_app.config['fit_processes_min_spectra']:
+                executor = self.q_app.get_process_pool('fit', n_processes)
+                results = fit_spectra(executor, ts)
+                for result in results:
+                    yield result
+                    if self.stop:
+                        # cancels the tasks that were not started yet
+                        results.close()
+                        return
+            else:
+                for task in ts:
+                    if self.stop:
+                        return
+                    yield fit_spectrum(task)
+
+        def emit_batch(batch):
+            if not batch:
+                return
+            self.logger.debug('fn: Emitting bfWorkerBatch(%d rows)' % len(batch))
+            self.threadWorkerBatch.emit(batch)
+
+        def fn(ts):
+            failed, batch = [], []
+            for n_done, (idx, result, error) in enumerate(fit_all(ts), start=1):
+                if result is None:
+                    self.logger.info('fn: Could not fit row %d: %s' % (idx, error))
+                    failed.append(idx)
+                else:
+                    batch.append((idx, result))
+
+                if n_done % batch_size == 0:
+                    emit_batch(batch)
+                    batch = []
+                self.threadWorkerStatus.emit(n_done)
+            emit_batch(batch)
+            return failed
+
+        self.stop = False
+
+        super(BatchFitWorker, self).__init__(fn, args=[tasks], kwargs={})
+
+        n_processes = self.q_app.config['fit_processes']
+        batch_size = max(1, self.q_app.config['fit_batch_size'])
+
+        self.threadWorkerException = self.q_app.bfWorkerException
+        self.threadWorkerResult = self.q_app.bfWorkerResult
+        self.threadWorkerFinished = self.q_app.bfWorkerFinished
+        self.threadWorkerStatus = self.q_app.bfWorkerStatus
+        self.threadWorkerBatch = self.q_app.bfWorkerBatch
+
+    def halt(self):
+        self.stop = True
 
 
 class SeqFitPopUp(QDialog):
@@ -15,7 +86,8 @@ class SeqFitPopUp(QDialog):
         self.logger = logging.getLogger(str(self.__class__))
 
         self.progress = None
-        self.sequence = None
+        # row -> peak list the task of the row was made from, see on_tw_batch
+        self._peak_lists = dict()
 
         self.current_name = QLabel(parent=self)
         self.combo = QComboBox(parent=self)
@@ -45,7 +117,6 @@ class SeqFitPopUp(QDialog):
         self.cb_peaks.clicked.connect(self.upd_cb_prec)
         self.cb_bckg.clicked.connect(self.upd_cb_prec)
         self.combo.currentIndexChanged.connect(self.on_combo_index_change)
-        self.q_app.fitWorkerFinished.connect(self.on_tw_finished, Qt.QueuedConnection)
 
     def upd_cb_prec(self):
         if self.cb_bckg.isChecked() and self.cb_peaks.isChecked():
@@ -78,14 +149,14 @@ class SeqFitPopUp(QDialog):
             bckg_list = self.q_app.get_bckg_data_list(start_idx)
             for idx in fit_ids:
                 self.q_app.set_bckg_data_list(idx, copy.deepcopy(bckg_list), emit=False)
-            self.q_app.bckgListChanged.emit(fit_ids)
+            self.q_app.emit_rows('bckgListChanged', fit_ids)
 
             # copying peaks
             tracks = self.q_app.get_pd_tracks()
             for fit_idx in fit_ids:
                 peak_list = self.q_app.get_peak_data_list(fit_idx)
                 for track in tracks:
-                    if fit_idx in track.ids and start_idx in track.ids:
+                    if fit_idx in track and start_idx in track:
                         track[fit_idx].cx = track[start_idx].cx
                         track[fit_idx].cx_bounds = track[start_idx].cx_bounds
                         track[fit_idx].amplitude = track[start_idx].amplitude
@@ -94,58 +165,101 @@ class SeqFitPopUp(QDialog):
                         track[fit_idx].sigma_bounds = track[start_idx].sigma_bounds
                         track[fit_idx].base = track[start_idx].base
                         track[fit_idx].overlap_base = track[start_idx].overlap_base
-                    elif fit_idx in track.ids:
+                    elif fit_idx in track:
                         pass
-                    elif start_idx in track.ids:
+                    elif start_idx in track:
                         pass
                     else:
                         pass
 
-            self.q_app.peakListChanged.emit(fit_ids)
+            self.q_app.emit_rows('peakListChanged', fit_ids)
             self.q_app.peakTracksChanged.emit()
 
+        if fit_type == 2:
+            raise NotImplementedError('Sequential from current is not supported')
+
         if self.q_app.get_selected_idx() in fit_ids:
             fit_ids.remove(self.q_app.get_selected_idx())
-        fit_ids = [self.q_app.get_selected_idx(), self.q_app.get_selected_idx()] + fit_ids
+        fit_ids = [self.q_app.get_selected_idx()] + fit_ids
 
-        self.logger.debug('on_btn_ok: Launching sequential refinement type %d on ids %s' % (fit_type, str(fit_ids[1:])))
+        tasks = self.make_tasks(fit_ids)
+        self.logger.debug('on_btn_ok: Launching batch refinement type %d on ids %s' %
+                          (fit_type, str([task[0] for task in tasks])))
 
-        self.progress = QProgressDialog("Sequential refinement", "Cancel", 0, len(fit_ids))
+        self.progress = QProgressDialog("Sequential refinement", "Cancel", 0, len(tasks))
         self.progress.setWindowModality(Qt.ApplicationModal)
+        fw = BatchFitWorker(tasks)
+        self.q_app.bfWorkerStatus.connect(self.progress.setValue)
+        self.q_app.bfWorkerBatch.connect(self.on_tw_batch)
+        self.q_app.bfWorkerResult.connect(self.on_tw_result)
+        self.q_app.bfWorkerException.connect(self.on_tw_exception)
+        self.q_app.bfWorkerFinished.connect(self.on_tw_finished)
         cb = QPushButton('Cancel')
-        cb.clicked.connect(self.on_cancel)
+        cb.clicked.connect(lambda *args: fw.halt())
         self.progress.setCancelButton(cb)
         self.progress.show()
 
-        self.sequence = enumerate(zip(fit_ids[:-1], fit_ids[1:]))
-        self.on_tw_finished()
+        if self.q_app.config['use_threads']:
+            self.q_app.thread_pool.start(fw)
+        else:
+            fw.run()
 
-    def on_cancel(self):
-        self.sequence = None
+    def make_tasks(self, fit_ids):
+        """
+        :return: tasks for the spectra of :code:`fit_ids` that have what the chosen refinement needs
+        """
+        config = self.q_app.config
+        kwargs = {'residuals': config['fit_residuals']}
+        if self.cb_peaks.isChecked() and not self.cb_bckg.isChecked():
+            fit_type, kwargs['varpro_min_peaks'] = 'peaks', config['fit_varpro_min_peaks']
+        elif self.cb_bckg.isChecked() and not self.cb_peaks.isChecked():
+            fit_type = 'bckg'
+        elif self.cb_peaks.isChecked() and self.cb_bckg.isChecked():
+            fit_type, kwargs['varpro_min_peaks'] = 'prec', config['fit_varpro_min_peaks']
+            if self.cb_prec.isChecked():
+                kwargs['max_cycles'] = 1
+        else:
+            return []
 
-    def on_tw_finished(self):
-        if self.parent().fit_idx is not None:
-            self.parent().fit_idx = None
+        tasks = []
+        self._peak_lists = dict()
+        for idx in fit_ids:
+            peak_list, bckg_list = self.q_app.get_peak_data_list(idx), self.q_app.get_bckg_data_list(idx)
+            if (fit_type == 'peaks' and peak_list is None) or (fit_type == 'bckg' and bckg_list is None):
+                continue
+            peak_list = peak_list if peak_list is not None else []
+            bckg_list = bckg_list if bckg_list is not None else []
 
-        try:
-            ii, (prev_idx, idx) = next(self.sequence)
-        except (StopIteration, TypeError):
-            self.progress.close()
-            self.close()
-            return
+            xx, yy = self.q_app.data.loc[idx, 'DataX'], np.asarray(self.q_app.data.loc[idx, 'DataY'])
+            tasks.append(make_task(idx, fit_type, xx, yy, peak_list, bckg_list, **kwargs))
+            self._peak_lists[idx] = peak_list
+        return tasks
 
-        if self.combo.currentIndex() == 2:
-            raise NotImplementedError('Sequential from current is not supported')
-            # self.q_app.data.loc[idx, 'GeneralFitResult'] = \
-            #     copy.deepcopy(self.q_app.data.loc[prev_idx, 'GeneralFitResult'])
+    def on_tw_batch(self, batch):
+        self.logger.debug('on_tw_batch: Handling BatchFitWorker.threadWorkerBatch')
+        with self.q_app.batch():
+            for idx, result in batch:
+                chi2, bckg_list, peak_list = apply_result(self._peak_lists.pop(idx), result)
+                self.q_app.set_chi2(idx, chi2)
+                self.q_app.set_bckg_data_list(idx, bckg_list)
+                self.q_app.set_peak_data_list(idx, peak_list)
 
-        if self.cb_peaks.isChecked() and not self.cb_bckg.isChecked():
-            self.parent().on_peak_fit_btn(idx=idx)
-        elif self.cb_bckg.isChecked() and not self.cb_peaks.isChecked():
-            self.parent().on_bckg_fit_btn(idx=idx)
-        elif self.cb_peaks.isChecked() and self.cb_bckg.isChecked() and self.cb_prec.isChecked():
-            self.parent().on_fit_to_prec_btn(idx=idx, max_cycles=1)
-        elif self.cb_peaks.isChecked() and self.cb_bckg.isChecked() and not self.cb_prec.isChecked():
-            self.parent().on_fit_to_prec_btn(idx=idx)
+    def on_tw_result(self, failed):
+        self.logger.debug('on_tw_result: Handling BatchFitWorker.threadWorkerResult')
+        if failed:
+            self.logger.warning('on_tw_result: Could not fit rows %s' % str(failed))
+
+    def on_tw_exception(self, e):
+        self.logger.error('on_tw_exception: Batch refinement failed: %s' % str(e))
 
-        self.progress.setValue(ii)
+    def on_tw_finished(self):
+        self.logger.debug('on_tw_finished: Handling BatchFitWorker.threadWorkerFinished')
+        for signal, slot in ((self.q_app.bfWorkerBatch, self.on_tw_batch),
+                             (self.q_app.bfWorkerResult, self.on_tw_result),
+                             (self.q_app.bfWorkerException, self.on_tw_exception),
+                             (self.q_app.bfWorkerFinished, self.on_tw_finished),
+                             (self.q_app.bfWorkerStatus, self.progress.setValue)):
+            signal.disconnect(slot)
+        self._peak_lists = dict()
+        self.progress.close()
+        self.close()
@@ -0,0 +1,87 @@
+import numpy as np
+
+
+class MotorTable:
+    """
+    Motor positions of the rows of :code:`P61App.data` as a float matrix (rows x known motors), NaN where a row has
+    no value for a motor. Rows are kept in the same order as the table, like in :code:`SpectrumStore`; a column is
+    added for every motor name that shows up, the matrix doubles its number of columns when it runs full.
+
+    The :code:`'Motors'` column of the table keeps the original per-row dicts for saving projects.
+    """
+    def __init__(self):
+        self.names = []
+        self._cols = dict()
+        self._values = np.empty((0, 8), dtype=np.float64)
+
+    def __len__(self):
+        return self._values.shape[0]
+
+    def __contains__(self, name):
+        return name in self._cols
+
+    @property
+    def values(self):
+        """
+        Matrix of motor positions, columns in the order of :code:`self.names`.
+        """
+        return self._values[:, :len(self.names)]
+
+    def column(self, name):
+        """
+        Positions of the motor :code:`name` for all rows, NaN everywhere if the motor is unknown.
+        """
+        if name not in self._cols:
+            return np.full(len(self), np.nan)
+        return self._values[:, self._cols[name]]
+
+    def _add_motor(self, name):
+        if len(self.names) == self._values.shape[1]:
+            values = np.full((self._values.shape[0], 2 * self._values.shape[1]), np.nan)
+            values[:, :len(self.names)] = self._values[:, :len(self.names)]
+            self._values = values
+        self._cols[name] = len(self.names)
+        self.names.append(name)
+
+    @staticmethod
+    def _to_float(val):
+        try:
+            return float(val)
+        except (TypeError, ValueError):
+            return np.nan
+
+    def insert(self, position, motors):
+        """
+        Inserts one row per item of :code:`motors` at :code:`position`.
+
+        :param motors: sequence of dicts motor name -> position or None
+        """
+        rows = np.full((len(motors), self._values.shape[1]), np.nan)
+        for ii, md in enumerate(motors):
+            if md is None:
+                continue
+            for name, val in md.items():
+                if name not in self._cols:
+                    self._add_motor(name)
+                    if self._values.shape[1] > rows.shape[1]:
+                        rows = np.hstack((rows, np.full((rows.shape[0], self._values.shape[1] - rows.shape[1]),
+                                                        np.nan)))
+                rows[ii, self._cols[name]] = self._to_float(val)
+        self._values = np.concatenate((self._values[:position], rows, self._values[position:]))
+
+    def remove(self, rows):
+        """
+        Removes the rows at the positions :code:`rows`.
+        """
+        keep = np.ones(len(self), dtype=bool)
+        keep[np.asarray(rows, dtype=np.int64)] = False
+        self._values = self._values[keep]
+
+    def permute(self, order):
+        """
+        Reorders the rows, row :code:`ii` after the call is the row :code:`order[ii]` before it.
+        """
+        self._values = self._values[np.asarray(order, dtype=np.int64)]
+
+    def clear(self):
+        self.__init__()
@@ -4,16 +4,22 @@ src/P61App.py
 
 """
 from PyQt5.QtWidgets import QApplication, QFileDialog, QMessageBox
-from PyQt5.QtCore import pyqtSignal, QThreadPool
+from PyQt5.QtCore import pyqtSignal, QThreadPool, QThread, QTimer
 import pandas as pd
 import numpy as np
 import os
+import time
 import logging
+import threading
 
 import pickle
 from collections import defaultdict
-from utils import log_ex_time
+from contextlib import contextmanager
+from utils import log_ex_time, spawn_pool
 from DataSetStorageModel import DataSetStorageModel
+from SpectrumStore import SpectrumStore
+from MotorTable import MotorTable
+from ProjectJournal import ProjectJournal
 from utils import PhaseData
 from peak_fit_utils import PeakData, PeakDataTrack, BckgData
 
@@ -46,8 +52,12 @@ class P61App(QApplication):
     represents a dataset read from a .nxs file. At the moment .nxs files hold two datasets at
     :code:`'entry/instrument/xspress3/channel00/histogram'` and :code:`'entry/instrument/xspress3/channel01/histogram'`.
 
-    - :code:`'DataX'`: numpy array representing x values on the spectra;
-    - :code:`'DataY'`: numpy array representing y values on the spectra;
+    - :code:`'DataX'`: numpy array representing x values on the spectra. Rows with the same energy axis share one
+      read-only array (:code:`DatasetIO.energy_axes`), copy it before changing the values;
+    - :code:`'DataY'`: numpy array representing y values on the spectra, or a :code:`LazySpectrum` handle that reads
+      them from the file on first access (:code:`config['lazy_spectra']`). Use :code:`np.asarray` where an actual
+      array is needed. Arrays are read-only views of the intensity matrices in :code:`P61App.instance().spectra`
+      (:code:`SpectrumStore`), which should be used for operations over many rows;
     - :code:`'DataID'`: unique ID of the dataset built from .nxs file name and field (channel00 / channel01);
     - :code:`'ScreenName'`: name of the dataset shown by the list widgets
     - :code:`'Active'`: boolean status. False means the dataset is not shown on the plot and in the list for fitting.
@@ -71,6 +81,11 @@ class P61App(QApplication):
     Three signals above do not just notify the receivers, but also hold the lists of indices of the rows that were
     changed, added or deleted.
 
+    :code:`dataRowsInserted`, :code:`dataActiveChanged`, :code:`peakListChanged`, :code:`bckgListChanged` and
+    :code:`genFitResChanged` should be sent with :code:`emit_rows_inserted` / :code:`emit_rows`. These collect the
+    rows over one event loop turn (or a :code:`with P61App.instance().batch():` block) and emit every signal once
+    with the merged rows, so bulk changes cause one redraw per view.
+
     - :code:`selectedIndexChanged`: when the :code:`ActiveListWidget` selection changes (also sends the new
       selected index);
     - :code:`lmFitModelUpdated`: when the :code:`self.params['LmFitModel']` is updated;
@@ -97,23 +112,36 @@ class P61App(QApplication):
     foWorkerResult = pyqtSignal(object)
     foWorkerFinished = pyqtSignal()
     foWorkerStatus = pyqtSignal(int)
+    foWorkerBatch = pyqtSignal(object)
 
     fitWorkerException = pyqtSignal(object)
     fitWorkerResult = pyqtSignal(object)
     fitWorkerFinished = pyqtSignal()
     fitWorkerStatus = pyqtSignal(int)
 
+    bfWorkerException = pyqtSignal(object)
+    bfWorkerResult = pyqtSignal(object)
+    bfWorkerFinished = pyqtSignal()
+    bfWorkerStatus = pyqtSignal(int)
+    bfWorkerBatch = pyqtSignal(object)
+
     def __init__(self, *args, **kwargs):
         QApplication.__init__(self, *args, **kwargs)
 
         # data storage for one-per-dataset items
         self.data = pd.DataFrame(columns=('DataX', 'DataY', 'DeadTime', 'CountTime', 'Cps', 'Channel', 'DataID',
                                           'ScreenName', 'Active', 'Color', 'PeakDataList', 'BckgDataList', 'Chi2', 'Motors'))
+        # intensity matrices behind the DataY column, row by row aligned with self.data
+        self.spectra = SpectrumStore()
+        # motor positions of the rows as a float matrix, row by row aligned with self.data
+        self.motors = MotorTable()
         self.data_model = DataSetStorageModel(instance=self)
         self.motors_cols = ('eu.chi', 'eu.phi', 'eu.bet', 'eu.alp', 'eu.x', 'eu.y', 'eu.z')
         self.motors_all = set(self.motors_cols)
 
         self.peak_tracks = None
+        # track id -> track of self.peak_tracks
+        self._tracks_by_id = dict()
         self.hkl_phases = None
         self.hkl_peaks = None
 
@@ -123,12 +151,56 @@ class P61App(QApplication):
 
         self.merge_frames = False
 
+        # rows of coalesced signals waiting to be emitted, see emit_rows
+        self._pending_rows = dict()
+        self._pending_inserted = None
+        self._batch_depth = 0
+        self._flush_scheduled = False
+
+        # journal of the project file and the changes made since the last autosave, see autosave
+        self._journal = None
+        self._journal_dirty = dict()
+        self._journal_compacted = time.monotonic()
+        self._journal_compactor = None
+
         self.logger = logging.getLogger(str(self.__class__))
         self.thread_pool = QThreadPool(parent=self)
+        self._process_pools = dict()
+        self._process_pools_lock = threading.Lock()
 
         self.config = {
             'use_threads': True,
-            'downsample_3d': True
+            'downsample_3d': True,
+            'lazy_spectra': True,
+            # worker processes used to open files, 0 or 1 opens them in a single thread. Off by default: with
+            # lazy_spectra the readers only read metadata, see P61App.get_process_pool
+            'open_processes': 1,
+            'open_processes_min_files': 32,
+            # opened spectra are handed over to the UI every open_batch_size files
+            'open_batch_size': 50,
+            # on-disk cache of decoded spectra, used whenever frames are actually decoded on opening
+            'decoded_cache': True,
+            'decoded_cache_dir': os.path.join(os.path.expanduser('~'), '.cache', 'P61AViewer', 'decoded'),
+            'decoded_cache_size_mb': 2048,
+            # changes are appended to the journal of the project every autosave_interval_s seconds, 0 switches it off
+            'autosave_interval_s': 30,
+            # the journal is compacted in the background when it gets larger than journal_compact_mb, but not more
+            # often than every journal_compact_interval_s seconds, see ProjectJournal.compact
+            'journal_compact_mb': 16,
+            'journal_compact_interval_s': 600,
+            # in intervals with at least fit_varpro_min_peaks peaks, peak amplitudes are found by a linear solve for every
+            # step of the other parameters (variable projection). Faster from about 8 overlapping peaks, None switches
+            # it off
+            'fit_varpro_min_peaks': 8,
+            # objective of the peak and background fits: 'poisson', 'raw' or 'legacy', see metrics.residual_modes
+            'fit_residuals': 'poisson',
+            # worker processes used to fit multiple spectra, 0 or 1 fits them in a single thread. Off by default: a
+            # running pool only pays off with more than one core, and starting it takes about as long as 30 fits,
+            # see P61App.get_process_pool and benchmarks/batch_fit.py
+            'fit_processes': 1,
+            'fit_processes_min_spectra': 32,
+            # fitted spectra are handed over to the UI every fit_batch_size spectra
+            'fit_batch_size': 20,
         }
 
         # data storage for one-per application items
@@ -156,6 +228,40 @@ class P61App(QApplication):
         self.dataRowsRemoved.connect(self.on_data_rows_removed)
         self.dataActiveChanged.connect(self.on_data_ac)
         # self.dataSorted.connect(self.on_data_sorted)
+        self.aboutToQuit.connect(self.shutdown_process_pools)
+        # the changes made since the last autosave go to the journal, the project file is left as it is
+        self.aboutToQuit.connect(self.autosave)
+
+        self._autosave_timer = QTimer(self)
+        self._autosave_timer.timeout.connect(self.autosave)
+        if self.config['autosave_interval_s'] > 0:
+            self._autosave_timer.start(int(1E3 * self.config['autosave_interval_s']))
+
+    def get_process_pool(self, name, n_processes):
+        """
+        Spawned workers import the main module again, which takes about a second each, so process pools are started
+        on first use and kept for the whole session. A pool is replaced if the number of workers changes or one of
+        its workers died.
+
+        :param name: what the pool is used for, e.g. 'open' or 'fit'
+        :param n_processes: number of worker processes
+        :return: ProcessPoolExecutor
+        """
+        with self._process_pools_lock:
+            n_pool, pool = self._process_pools.get(name, (None, None))
+            # _broken is set by the executor when a worker process died
+            if pool is None or n_pool != n_processes or pool._broken:
+                if pool is not None:
+                    pool.shutdown(wait=False)
+                pool = spawn_pool(n_processes)
+                self._process_pools[name] = (n_processes, pool)
+            return pool
+
+    def shutdown_process_pools(self):
+        with self._process_pools_lock:
+            for _, pool in self._process_pools.values():
+                pool.shutdown()
+            self._process_pools.clear()
 
     def apply_cmap(self, vals, cmap :str, log_scale=False):
         if cmap not in self.cmaps:
@@ -179,19 +285,124 @@ class P61App(QApplication):
     def on_data_ac(self):
         self.logger.debug('on_data_ac: handling dataActiveChanged')
 
-    def insert_rows(self, position, rows):
-        d1, d2 = self.data[:position], self.data[position:]
-        insert = pd.DataFrame({col: [None] * rows for col in self.data.columns},
-                              index=np.arange(position, position + rows).astype(np.int))
-        self.data = pd.concat((d1, insert, d2.set_index(d2.index + rows)))
+    def emit_rows(self, signal, rows):
+        """
+        Emits :code:`signal` (name of a signal with a list of rows) at the end of the current event loop turn or
+        :code:`batch()`. Rows of all calls in between are merged and the signal is emitted once.
+        """
+        self._pending_rows.setdefault(signal, set()).update(rows)
+        self._schedule_flush()
+
+    def emit_rows_inserted(self, position, rows):
+        """
+        Emits :code:`dataRowsInserted(position, rows)` like :code:`emit_rows`. Insertions into or right after the
+        pending range are merged into it, anything else flushes the pending signals first.
+        """
+        if self._merges_insert(position):
+            self._pending_inserted = (self._pending_inserted[0], self._pending_inserted[1] + rows)
+            return
+        self.flush_signals()
+        self._pending_inserted = (position, rows)
+        self._schedule_flush()
+
+    def _merges_insert(self, position):
+        if self._pending_inserted is None or self._pending_rows:
+            return False
+        p0, n0 = self._pending_inserted
+        return p0 <= position <= p0 + n0
+
+    def _schedule_flush(self):
+        if QThread.currentThread() is not self.thread():
+            # only the GUI thread has an event loop to defer to
+            self.flush_signals()
+        elif self._batch_depth == 0 and not self._flush_scheduled:
+            self._flush_scheduled = True
+            QTimer.singleShot(0, self.flush_signals)
+
+    def flush_signals(self):
+        """
+        Emits all pending coalesced signals now. Called before the rows of :code:`self.data` are inserted, removed
+        or reordered, as the pending rows refer to the positions before the change.
+        """
+        self._flush_scheduled = False
+        if self._pending_inserted is not None:
+            position, rows = self._pending_inserted
+            self._pending_inserted = None
+            self.logger.debug('flush_signals: Emitting dataRowsInserted(%d, %d)' % (position, rows))
+            self.dataRowsInserted.emit(position, rows)
+
+        pending, self._pending_rows = self._pending_rows, dict()
+        for signal, rows in pending.items():
+            self.logger.debug('flush_signals: Emitting %s(%d rows)' % (signal, len(rows)))
+            getattr(self, signal).emit(sorted(rows))
+
+    @contextmanager
+    def batch(self):
+        """
+        Holds back the coalesced signals until the end of the block, e.g. for scripts:
+
+        .. code-block:: python
+
+            with app.batch():
+                for idx in ids:
+                    app.set_active_status(idx, False)
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self.flush_signals()
 
-        self.logger.debug('insert_rows: Inserted %d rows to position %d' % (rows, position))
+    def insert_rows(self, position, rows):
+        self.insert_data(position, pd.DataFrame({col: [None] * rows for col in self.data.columns}))
 
     def remove_rows(self, position, rows):
-        self.data.drop(index=np.arange(position, position + rows).astype(np.int), inplace=True)
-        self.data.set_index(np.arange(self.data.shape[0]), inplace=True)
-
-        self.logger.debug('remove_rows: Removed %d rows from position %d' % (rows, position))
+        self.remove_data(range(position, position + rows))
+
+    def insert_data(self, position, frame):
+        """
+        Inserts the rows of :code:`frame` at :code:`position` with a single copy of the table and hands their spectra
+        to :code:`self.spectra`. Use :code:`DataSetStorageModel.insert_data`, which notifies the views.
+        """
+        if not self._merges_insert(position):
+            self.flush_signals()
+        frame = frame[list(self.data.columns)]
+        self.data = pd.concat((self.data[:position], frame, self.data[position:]), ignore_index=True)
+        self.spectra.insert(position, frame.shape[0])
+        self.store_spectra(position, frame.shape[0])
+        self.motors.insert(position, frame['Motors'].tolist())
+        # the rows are written to the journal as they are at the next autosave
+        for data_id, screen_name in zip(frame['DataID'], frame['ScreenName']):
+            self._journal_mark_row('add', data_id, screen_name, None)
+
+        self.logger.debug('insert_data: Inserted %d rows to position %d' % (frame.shape[0], position))
+
+    def remove_data(self, rows):
+        """
+        Removes the rows at the positions :code:`rows` (in any order) with a single copy of the table. Use
+        :code:`DataSetStorageModel.remove_data`, which notifies the views.
+        """
+        self.flush_signals()
+        keep = np.ones(self.data.shape[0], dtype=bool)
+        keep[list(rows)] = False
+        for data_id, screen_name in zip(self.data.loc[~keep, 'DataID'], self.data.loc[~keep, 'ScreenName']):
+            self._journal_mark_row('remove', data_id, screen_name, None)
+        self.data = self.data[keep].reset_index(drop=True)
+        self.spectra.remove(np.flatnonzero(~keep))
+        self.motors.remove(np.flatnonzero(~keep))
+
+        self.logger.debug('remove_data: Removed %d rows' % (keep.shape[0] - self.data.shape[0]))
+
+    def store_spectra(self, position, rows):
+        """
+        Moves the intensities of the rows :code:`position ... position + rows - 1` into :code:`self.spectra` after
+        they were written to :code:`self.data`. The 'DataY' cells are replaced by views of the intensity matrices.
+        """
+        idx = np.arange(position, position + rows)
+        changed, cells = self.spectra.set(idx, self.data.loc[idx, 'DataX'], self.data.loc[idx, 'DataY'])
+        self.data.loc[changed, 'DataY'] = pd.Series(cells, index=changed, dtype=object)
 
     def _color_wheel(self, key):
         ii = 0
@@ -238,9 +449,9 @@ class P61App(QApplication):
 
     def set_active_status(self, idx, status, emit=True):
         self.data.loc[idx, 'Active'] = bool(status)
+        self._journal_mark('active', idx, bool(status))
         if emit:
-            self.logger.debug('set_active_status: Emitting dataActiveChanged([%d])' % (idx, ))
-            self.dataActiveChanged.emit([idx])
+            self.emit_rows('dataActiveChanged', [idx])
 
     def get_selected_screen_name(self):
         if self.params['SelectedActiveIdx'] != -1:
@@ -253,26 +464,25 @@ class P61App(QApplication):
 
     def set_peak_data_list(self, idx, result, emit=True):
         self.data.loc[idx, 'PeakDataList'] = result
+        self._journal_mark('peaks', idx, result)
         if emit:
-            self.logger.debug('set_peak_list: Emitting peakListChanged([%d])' % (idx, ))
-            self.peakListChanged.emit([idx])
+            self.emit_rows('peakListChanged', [idx])
+
+    def set_chi2(self, idx, chi2):
+        self.data.loc[idx, 'Chi2'] = chi2
+        self._journal_mark('chi2', idx, chi2)
 
     def get_bckg_data_list(self, idx):
         return self.data.loc[idx, 'BckgDataList']
 
     def set_bckg_data_list(self, idx, result, emit=True):
         self.data.loc[idx, 'BckgDataList'] = result
+        self._journal_mark('bckg', idx, result)
         if emit:
-            self.logger.debug('set_bckg_data_list: Emitting bckgListChanged([%d])' % (idx, ))
-            self.bckgListChanged.emit([idx])
+            self.emit_rows('bckgListChanged', [idx])
 
     def get_pd_track(self, idx):
-        if self.peak_tracks is None:
-            return None
-        for track in self.peak_tracks:
-            if track.get_track_idx() == idx:
-                return track
-        return None
+        return self._tracks_by_id.get(idx)
 
     def get_pd_tracks(self):
         if self.peak_tracks is None:
@@ -281,7 +491,14 @@ class P61App(QApplication):
             return self.peak_tracks
 
     def set_pd_tracks(self, result, emit=True):
+        if self._journal is not None:
+            # peaks of the old and the new tracks change their track ids
+            for track in list(self.peak_tracks or []) + list(result or []):
+                for idx in track.ids:
+                    if 0 <= idx < self.data.shape[0]:
+                        self._journal_mark('peaks', idx, self.data.loc[idx, 'PeakDataList'])
         self.peak_tracks = result
+        self._tracks_by_id = {track.get_track_idx(): track for track in (result or [])}
         if emit:
             self.logger.debug('set_pd_tracks: Emitting peakTracksChanged')
             self.peakTracksChanged.emit()
@@ -315,25 +532,24 @@ class P61App(QApplication):
 
     @log_ex_time()
     def sort_data(self, **kwargs):
+        self.flush_signals()
         if kwargs['by'] not in self.data.columns:
-            self.data['_tmp'] = self.data['Motors'].apply(
-                lambda x: 0 if x is None else (0 if x[kwargs['by']] is None else x[kwargs['by']])
-            )
-            kwargs['by'] = '_tmp'
-
-        self.data.sort_values(**kwargs)
-
-        if kwargs['by'] == '_tmp':
-            self.data.drop(['_tmp'], axis=1, inplace=True)
+            # motor positions, rows without a value are sorted as 0
+            vals = np.nan_to_num(self.motors.column(kwargs['by']), nan=0.)
+            order = np.argsort(vals if kwargs.get('ascending', True) else -vals, kind='stable')
+            self.data = self.data.take(order)
+        else:
+            self.data.sort_values(**kwargs)
+            order = self.data.index.to_numpy()
 
+        self.spectra.permute(order)
+        self.motors.permute(order)
         self.data.reset_index(drop=True, inplace=True)
 
-        def reindex_peaks(row):
-            if row['PeakDataList'] is not None:
-                for pd in row['PeakDataList']:
-                    pd.idx = row.name
-
-        self.data.apply(reindex_peaks, axis=1)
+        for idx, peak_list in enumerate(self.data['PeakDataList']):
+            if peak_list is not None:
+                for pd in peak_list:
+                    pd.idx = idx
 
         if self.peak_tracks is not None:
             for pt in self.peak_tracks:
@@ -342,13 +558,125 @@ class P61App(QApplication):
         self.logger.debug('sort_data: Emitting dataSorted')
         self.dataSorted.emit()
 
+    def _journal_mark(self, kind, idx, items):
+        self._journal_mark_row(kind, self.data.loc[idx, 'DataID'], self.data.loc[idx, 'ScreenName'], items)
+
+    def _journal_mark_row(self, kind, data_id, screen_name, items):
+        if self._journal is None:
+            return
+        ProjectJournal.mark(self._journal_dirty, kind, data_id, screen_name, items)
+
+    def _journal_row(self, idx):
+        """
+        :return: row :code:`idx` as a dict like the rows of a project file, for the 'add' records of the journal
+        """
+        # DatasetIO imports P61App, so it can not be imported on module level
+        from DatasetIO import LazySpectrum
+
+        row = {k: self.data.loc[idx, k] for k in
+               ('DeadTime', 'Channel', 'DataID', 'ScreenName', 'Chi2', 'Active', 'CountTime', 'Cps')}
+        row['DataX'] = np.asarray(self.data.loc[idx, 'DataX'])
+        # lazy handles only keep the file and frame
+        intensity = self.spectra.intensity(idx)
+        row['DataY'] = intensity if isinstance(intensity, LazySpectrum) else np.array(intensity)
+        row['Motors'] = dict(self.data.loc[idx, 'Motors']) if self.data.loc[idx, 'Motors'] is not None else None
+        for k in ('PeakDataList', 'BckgDataList'):
+            row[k] = [item.to_dict() for item in (self.data.loc[idx, k] or [])]
+        return row
+
+    def _reset_journal(self):
+        self._journal = ProjectJournal(self.proj_f_name)
+        self._journal.clear()
+        self._journal_dirty = dict()
+        self._journal_compacted = time.monotonic()
+
+    def autosave(self):
+        """
+        Appends the changes made since the last call to the journal of the project (:code:`ProjectJournal`): peak and
+        background lists, Chi2 values and active states that were set, rows that were added (as a whole) or removed.
+        The cost depends on the number of changed rows only. The journal is replayed by :code:`load_proj_from`.
+        Nothing is done before the project was saved or loaded once.
+
+        The project file itself is only written by an explicit save. When the journal gets larger than
+        :code:`config['journal_compact_mb']`, it is compacted in a background thread, at most every
+        :code:`config['journal_compact_interval_s']` seconds.
+        """
+        if self._journal is None:
+            return
+
+        if self._journal_dirty:
+            dirty, self._journal_dirty = self._journal_dirty, dict()
+            if any(kind == 'add' for kind, _, _ in dirty):
+                positions = {key: idx for idx, key in enumerate(zip(self.data['DataID'], self.data['ScreenName']))}
+            records = []
+            for (kind, data_id, screen_name), items in dirty.items():
+                if kind in ('peaks', 'bckg'):
+                    items = [item.to_dict() for item in (items or [])]
+                elif kind == 'add':
+                    if (data_id, screen_name) not in positions:
+                        continue
+                    items = self._journal_row(positions[(data_id, screen_name)])
+                records.append((kind, data_id, screen_name, items))
+            try:
+                self._journal.append(records)
+            except OSError as e:
+                self.logger.error('autosave: could not write %s: %s' % (self._journal.path, str(e)))
+                for key, items in self._journal_dirty.items():
+                    ProjectJournal.mark(dirty, *key, items)
+                self._journal_dirty = dirty
+                return
+            self.logger.debug('autosave: %d records appended to %s' % (len(records), self._journal.path))
+
+        if self._journal.size > self.config['journal_compact_mb'] * 2 ** 20 and \
+                time.monotonic() - self._journal_compacted > self.config['journal_compact_interval_s'] and \
+                (self._journal_compactor is None or not self._journal_compactor.is_alive()):
+            self._journal_compacted = time.monotonic()
+            self._journal_compactor = threading.Thread(target=self._journal.compact)
+            self._journal_compactor.start()
+
     def save_proj_as(self, f_name=None):
+        """
+        Saves the project as an HDF5 project file (see :code:`DatasetIO.project_h5`), or in the old pickled format
+        if the file name ends with .pickle. Both formats are recognized by :code:`load_proj_from`.
+        """
         if f_name is not None:
             self.proj_f_name = f_name
 
         if self.proj_f_name is None:
             return
 
+        if os.path.splitext(self.proj_f_name)[1] == '.pickle':
+            if not self._save_proj_pickle():
+                return
+        elif not self._save_proj_h5():
+            return
+
+        # the saved file holds everything the journal had
+        self._reset_journal()
+        self.logger.debug('save_proj_as: saved as %s' % str(self.proj_f_name))
+
+    def _save_proj_h5(self):
+        # DatasetIO imports P61App, so it can not be imported on module level
+        from DatasetIO import LazySpectrum
+        from DatasetIO.project_h5 import write_project
+
+        try:
+            handles = write_project(self.proj_f_name, self.data, self.spectra, self.motors,
+                                    self.hkl_peaks, self.hkl_phases)
+        except (OSError, ValueError, TypeError) as e:
+            self.logger.error('save_proj_as: could not save file: %s' % str(e))
+            return False
+
+        # rows read lazily from the previous version of the file have to point into the new one
+        f_name = os.path.abspath(self.proj_f_name)
+        moved = [row for row in range(len(self.spectra)) if isinstance(self.spectra.intensity(row), LazySpectrum)
+                 and os.path.abspath(self.spectra.intensity(row).f_name) == f_name]
+        if moved:
+            changed, cells = self.spectra.set(moved, self.spectra.axes[moved], [handles[row] for row in moved])
+            self.data.loc[changed, 'DataY'] = pd.Series(cells, index=changed, dtype=object)
+        return True
+
+    def _save_proj_pickle(self):
         spectra = []
         for idx in self.data.index:
             row_data = dict()
@@ -377,11 +705,20 @@ class P61App(QApplication):
             all_data = pickle.dumps(all_data)
         except Exception as e:
             self.logger.error('save_proj_as: could not save file, pickle failed with exception: %s' % str(e))
+            return False
 
-        with open(self.proj_f_name, 'wb') as f:
-            f.write(all_data)
-
-        self.logger.debug('save_proj_as: saved as %s' % str(self.proj_f_name))
+        # written next to the project first, so the previous version stays intact if writing fails
+        tmp_name = self.proj_f_name + '.%d.tmp' % os.getpid()
+        try:
+            with open(tmp_name, 'wb') as f:
+                f.write(all_data)
+            os.replace(tmp_name, self.proj_f_name)
+        except OSError as e:
+            self.logger.error('save_proj_as: could not save file: %s' % str(e))
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            return False
+        return True
 
     def load_proj_from(self, f_name=None):
         if f_name is not None:
@@ -390,18 +727,37 @@ class P61App(QApplication):
         if self.proj_f_name is None:
             return
 
+        # the changes to the previous project stay in its journal, nothing is journaled until the new one is loaded
+        self.autosave()
+        self._journal = None
+        self._journal_dirty = dict()
+
         rows = list(self.data.index)
-        self.data_model.removeRows(0, len(rows))
+        self.data_model.remove_data(rows)
         self.dataRowsRemoved.emit(rows)
         self.peak_tracks = None
+        self._tracks_by_id = dict()
         self.hkl_phases = None
         self.hkl_peaks = None
 
+        # DatasetIO imports P61App, so it can not be imported on module level
+        from DatasetIO.energy_axes import intern_axes
+        from DatasetIO.project_h5 import is_project, read_project
+
         # raw_data = json.load(open(self.proj_f_name, 'r'))
-        with open(self.proj_f_name, 'rb') as f:
-            raw_data = pickle.loads(f.read())
+        if is_project(self.proj_f_name):
+            raw_data = read_project(self.proj_f_name)
+        else:
+            with open(self.proj_f_name, 'rb') as f:
+                raw_data = pickle.loads(f.read())
+
+        # changes made after the last save
+        journal = ProjectJournal(self.proj_f_name)
+        replayed = journal.replay(journal.open(), raw_data['spectra'])
+        if replayed:
+            self.logger.info('load_proj_from: %d changes replayed from %s' % (replayed, journal.path))
 
-        pr_data = pd.DataFrame(columns=self.data.columns)
+        pr_rows = []
         self.peak_tracks = dict()
 
         # process the data
@@ -411,20 +767,21 @@ class P61App(QApplication):
         raw_data = raw_data['spectra']
 
         for row in raw_data:
-            pr_row = {c: None for c in pr_data.columns}
+            pr_row = {c: None for c in self.data.columns}
 
             peak_list = [PeakData.from_dict(peak) for peak in row['PeakDataList']]
             for peak in peak_list:
                 if peak.track_id is not None:
                     if peak.track_id not in self.peak_tracks:
-                        self.peak_tracks[peak.track_id] = PeakDataTrack(peak)
+                        self.peak_tracks[peak.track_id] = PeakDataTrack(peak, idx=peak.track_id)
                     else:
                         self.peak_tracks[peak.track_id].append(peak)
                 del peak.track_id
 
             pr_row.update({
-                'DataX': np.array(row['DataX']),
-                'DataY': np.array(row['DataY']),
+                'DataX': np.asarray(row['DataX']),
+                # intensities from HDF5 projects are lazy handles
+                'DataY': np.array(row['DataY']) if isinstance(row['DataY'], list) else row['DataY'],
                 'Motors': defaultdict(lambda *args: None, row['Motors']) if row['Motors'] is not None else None,
                 'Color': next(self.params['ColorWheel']),
                 'Active': True,
@@ -437,10 +794,12 @@ class P61App(QApplication):
             if row['Motors'] is not None:
                 self.motors_all.update(row['Motors'].keys())
 
-            pr_data.loc[pr_data.shape[0]] = pr_row
+            pr_rows.append(pr_row)
 
-        self.data_model.insertRows(0, len(raw_data))
-        self.data[0:len(raw_data)] = pr_data
+        pr_data = pd.DataFrame(pr_rows, columns=self.data.columns, dtype=object)
+        pr_data['DataX'] = intern_axes(pr_data['DataX'])
+        self.data_model.insert_data(0, pr_data)
+        self._tracks_by_id = self.peak_tracks
         self.peak_tracks = list(sorted(self.peak_tracks.values(), key=lambda x: np.mean(x.cxs)))
 
         self.dataRowsInserted.emit(0, len(raw_data))
@@ -455,6 +814,8 @@ class P61App(QApplication):
         self.hklPhasesChanged.emit()
         self.hklPeaksChanged.emit()
         self.motorListUpdated.emit()
+        self._journal = journal
+        self._journal_compacted = time.monotonic()
 
     def export_spectra_csv(self, ids):
         fd = QFileDialog()
@@ -481,7 +842,7 @@ class P61App(QApplication):
             for ii in ids:
                 data = self.data.loc[ii, ['DataX', 'DataY', 'ScreenName']]
                 f_name = data['ScreenName'].replace(':', '_').replace('.', '_') + '.csv'
-                data = pd.DataFrame(data={'eV': 1E3 * data['DataX'], 'counts': data['DataY']})
+                data = pd.DataFrame(data={'eV': 1E3 * data['DataX'], 'counts': np.asarray(data['DataY'])})
                 data = data[['eV', 'counts']]
                 data.to_csv(os.path.join(dirname, f_name), header=True, index=False)
 
@@ -493,22 +854,13 @@ class P61App(QApplication):
             return row.drop(labels=['PeakDataList'])
         else:
             for track, prefix in zip(tracks, prefixes):
-                if row.name in track.ids:
+                if row.name in track:
                     name = row.name
                     row = row.append(pd.Series({'_'.join((prefix, k)): val
                                                 for (k, val) in track[row.name].export_ref_params().items()}))
                     row.name = name
             return row.drop(labels=['PeakDataList'])
 
-    def expand_motors(self, row):
-        if row['Motors'] is None:
-            for motor in self.motors_all:
-                row[motor] = None
-        else:
-            for motor in self.motors_all:
-                row[motor] = row['Motors'][motor]
-        return row.drop(labels=['Motors'])
-
     def add_phase_data(self, df):
         peak_centers = df.filter(regex='center$', axis=1)
         peak_centers = peak_centers.mean()
@@ -533,7 +885,10 @@ class P61App(QApplication):
                                              ['ScreenName', 'Channel', 'DeadTime',
                                               'PeakDataList', 'Motors', 'Chi2', 'CountTime', 'Cps']])
         result = result.apply(self.expand_peaks, axis=1)
-        result = result.apply(self.expand_motors, axis=1)
+        active = self.data['Active'].to_numpy(dtype=bool)
+        motors = pd.DataFrame({motor: self.motors.column(motor)[active] for motor in self.motors_all},
+                              index=result.index)
+        result = pd.concat((result.drop(columns=['Motors']), motors), axis=1)
         result = self.add_phase_data(result)
 
         columns = list(sorted(result.columns))
@@ -566,9 +921,7 @@ class P61App(QApplication):
     def get_data_by_name(self, var):
         if var in self.motors_all:
             # motor values
-            mds = self.data.loc[self.data['Active'], 'Motors'].to_list()
-            xx = [md[var] if md is not None else None for md in mds]
-            xx = np.array([np.nan if x is None else x for x in xx])
+            xx = self.motors.column(var)[self.data['Active'].to_numpy(dtype=bool)]
             return xx, np.array([np.nan] * xx.size), np.array([np.nan] * xx.size)
         elif var[:5] == 'Track' and len(self.peak_tracks) > 0:
             # track values
@@ -590,11 +943,9 @@ class P61App(QApplication):
                 return np.array([]), np.array([]), np.array([])
 
             xx = pd.DataFrame({'xx': xx, 'xx_min': xx_min, 'xx_max': xx_max}, index=xx_ids)
-
-            xx_min = np.array([xx.loc[idx, 'xx_min'] if idx in xx_ids else np.nan for idx in active_ids])
-            xx_max = np.array([xx.loc[idx, 'xx_max'] if idx in xx_ids else np.nan for idx in active_ids])
-            xx = np.array([xx.loc[idx, 'xx'] if idx in xx_ids else np.nan for idx in active_ids])
-            return xx, xx_min, xx_max
+            # first peak of every spectrum like track[idx], NaN for active spectra without a peak in the track
+            xx = xx[~xx.index.duplicated()].reindex(active_ids)
+            return xx['xx'].to_numpy(), xx['xx_min'].to_numpy(), xx['xx_max'].to_numpy()
         elif var in ('CountTime', 'Cps', u'χ²'):
             # spectra values
             if var == u'χ²':
@@ -164,7 +164,7 @@ class P61Viewer(QMainWindow):
             self,
             'Open project',
             def_path,
-            'Python3 pickled files (*.pickle);;All Files (*)',
+            'P61A Viewer projects (*.h5);;Python3 pickled files (*.pickle);;All Files (*)',
             options=QFileDialog.Options()
         )
 
@@ -192,7 +192,7 @@ class P61Viewer(QMainWindow):
             self,
             'Save project as',
             def_path,
-            'Python3 pickled files (*.pickle);;All Files (*)',
+            'P61A Viewer projects (*.h5);;Python3 pickled files (*.pickle);;All Files (*)',
             options=QFileDialog.Options(),
         )
         if f_name != '':
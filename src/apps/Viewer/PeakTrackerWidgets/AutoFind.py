@@ -38,7 +38,7 @@ class AutoFindPopUp(QDialog):
             self.parent().on_btn_this(idx=ii, emit=False)
             progress.setValue(ii)
 
-        self.q_app.peakListChanged.emit(fit_ids)
+        self.q_app.emit_rows('peakListChanged', fit_ids)
         progress.setValue(len(fit_ids))
 
         self.close()
@@ -155,7 +155,7 @@ class AutoFindWidget(QWidget):
             idx = self.q_app.get_selected_idx()
 
         if idx != -1:
-            yy = self.q_app.data.loc[idx, 'DataY']
+            yy = np.asarray(self.q_app.data.loc[idx, 'DataY'])
             xx = self.q_app.data.loc[idx, 'DataX']
 
             if params['distance'] is not None:
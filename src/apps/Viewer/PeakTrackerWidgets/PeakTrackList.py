@@ -119,7 +119,7 @@ class PeakTrackList(QWidget):
                 else:
                     ii += 1
             self.q_app.set_peak_data_list(idx, peaks, emit=False)
-        self.q_app.peakListChanged.emit(ids)
+        self.q_app.emit_rows('peakListChanged', ids)
 
     def upd_list(self):
         self.lst.clear()
@@ -123,7 +123,7 @@ class TrackCopyPopUp(QDialog):
             all_spectra_ids.extend(new_track.ids)
 
         self._tracks = list(sorted(self._tracks, key=lambda x: np.mean(x.cxs)))
-        self.q_app.peakListChanged.emit(list(set(all_spectra_ids)))
+        self.q_app.emit_rows('peakListChanged', list(set(all_spectra_ids)))
         self.q_app.set_pd_tracks(self._tracks)
         self.close()
 
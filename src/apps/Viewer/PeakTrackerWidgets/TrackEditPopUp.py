@@ -218,20 +218,21 @@ class TrackEditPopUp(QDialog):
                 peak_list = []
 
             for track_idx in self._track_ids:
-                if spectra_idx not in self._tracks[track_idx].ids:
+                if spectra_idx not in self._tracks[track_idx]:
                     new_peak = self._tracks[track_idx].predict_by_average(
                         spectra_idx,
                         self.q_app.data.loc[spectra_idx, 'DataX'],
-                        self.q_app.data.loc[spectra_idx, 'DataY']
+                        np.asarray(self.q_app.data.loc[spectra_idx, 'DataY'])
                     )
                     self._tracks[track_idx].append(new_peak)
                     peak_list.append(new_peak)
 
             self.q_app.set_peak_data_list(spectra_idx, peak_list, emit=False)
 
+        selected = set(spectra_ids)
         for track_idx in self._track_ids:
             for spectra_idx in self._tracks[track_idx].ids:
-                if spectra_idx not in spectra_ids:
+                if spectra_idx not in selected:
                     self._tracks[track_idx].pop(spectra_idx)
                     peak_list = self.q_app.get_peak_data_list(spectra_idx)
                     peak_list = [peak for peak in peak_list if peak.idx != spectra_idx]
@@ -308,7 +309,7 @@ class TrackEditPopUp(QDialog):
             peak_list = list(sorted(peak_list, key=lambda item: item.md_params['center']))
             self.q_app.set_peak_data_list(spectra_idx, peak_list, emit=False)
 
-        self.q_app.peakListChanged.emit(spectra_ids)
+        self.q_app.emit_rows('peakListChanged', spectra_ids)
 
         self._tracks = list(sorted(self._tracks, key=lambda x: np.mean(x.cxs)))
         self.q_app.set_pd_tracks(self._tracks)
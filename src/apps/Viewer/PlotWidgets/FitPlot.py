@@ -5,7 +5,7 @@ import logging
 
 from P61App import P61App
 from utils import log_ex_time
-from peak_fit_utils import peak_models, background_models
+from peak_fit_utils import CompositeModel, background_models
 
 
 class FitPlot(pg.GraphicsLayoutWidget):
@@ -80,10 +80,10 @@ class FitPlot(pg.GraphicsLayoutWidget):
             self._line_ax.setTitle('Fit: ' + self.q_app.data.loc[idx, 'ScreenName'])
             data = self.q_app.data.loc[idx, ['DataX', 'DataY', 'Color', 'PeakDataList', 'BckgDataList']]
 
-            self._line_ax.plot(1E3 * data['DataX'], data['DataY'],
+            self._line_ax.plot(1E3 * data['DataX'], np.asarray(data['DataY']),
                                pen=pg.mkPen(color='#000000', style=Qt.DotLine), name='Data')
             xx = data['DataX']
-            yy = data['DataY']
+            yy = np.asarray(data['DataY'])
             yy_calc = np.zeros(yy.shape)
 
             if data['BckgDataList'] is not None:
@@ -97,13 +97,13 @@ class FitPlot(pg.GraphicsLayoutWidget):
                                        bc_md.md_params['xmin'].n, bc_md.md_params['xmax'].n, bc_md.md_name))
 
             if data['PeakDataList'] is not None:
-                for peak in data['PeakDataList']:
-                    yy_peak = peak_models[peak.md_name](xx, **{name: peak.md_params[name].n for name in peak.md_params})
-                    yy_calc += yy_peak
+                peaks = CompositeModel(data['PeakDataList'], xx).peaks()
+                yy_calc += peaks.sum(axis=0)
+                for peak, yy_peak in zip(data['PeakDataList'], peaks):
                     self._line_ax.plot(1E3 * xx, yy_peak,
                                        pen=pg.mkPen(
                                            color=str(hex(next(self.q_app.params['ColorWheel2']))).replace('0x', '#')),
-                                       name='%.01f' % peak.md_params['center'].n)
+                                       name='%.01f' % peak.cx)
 
             self._diff = yy - yy_calc
             self._line_ax.plot(1E3 * xx, yy_calc, pen=pg.mkPen(color='#d62728'), name='Fit')
@@ -187,7 +187,7 @@ class MainPlot2D(pg.GraphicsLayoutWidget):
 
     def line_init(self, ii):
         data = self.q_app.data.loc[ii, ['DataX', 'DataY', 'Color']]
-        self._lines[ii] = self._line_ax.plot(1E3 * data['DataX'], data['DataY'],
+        self._lines[ii] = self._line_ax.plot(1E3 * data['DataX'], np.asarray(data['DataY']),
                                              pen=str(hex(data['Color'])).replace('0x', '#'))
 
     def line_set_visibility(self, ii):
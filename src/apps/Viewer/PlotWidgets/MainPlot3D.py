@@ -33,9 +33,11 @@ class MainPlot3DWidget(GlPlot3DWidget):
 
     def autoscale(self):
         if len(self.q_app.get_active_ids()) > 0:
-            emin = self.q_app.data.loc[self.q_app.get_active_ids(), 'DataX'].apply(np.min).min()
-            emax = self.q_app.data.loc[self.q_app.get_active_ids(), 'DataX'].apply(np.max).max()
-            imax = self.q_app.data.loc[self.q_app.get_active_ids(), 'DataY'].apply(np.max).max()
+            # one reduction per energy axis instead of one per row
+            groups = self.q_app.spectra.groups(self.q_app.get_active_ids())
+            emin = min(np.min(xx) for xx, _, _ in groups)
+            emax = max(np.max(xx) for xx, _, _ in groups)
+            imax = max(np.max(yy) for _, _, yy in groups)
         else:
             emin, emax, imax = None, None, None
         self._scale_to(emin, emax, imax)
@@ -191,7 +193,7 @@ class MainPlot3D(GlPlot3D):
 
             for idx in ymap:
                 data = self.q_app.data.loc[idx, ['DataX', 'DataY']]
-                pos = self.transform_xyz(data['DataX'], intensity=data['DataY'])
+                pos = self.transform_xyz(data['DataX'], intensity=np.asarray(data['DataY']))
                 surf_xx.append(pos[:, 0].copy())
                 surf_zz.append(pos[:, 2].copy())
                 surf_yy.append(np.array([ymap[idx]] * surf_zz[-1].shape[0]))
@@ -351,7 +353,7 @@ class MainPlot3D(GlPlot3D):
 
     def _init_line(self, idx):
         data = self.q_app.data.loc[idx, ['DataX', 'DataY', 'Color', 'Active']]
-        pos = self.transform_xyz(data['DataX'], intensity=data['DataY'])
+        pos = self.transform_xyz(data['DataX'], intensity=np.asarray(data['DataY']))
         if self._colored:
             result = gl.GLLinePlotItem(pos=pos,
                                        color=str(hex(data['Color'])).replace('0x', '#'),
@@ -246,7 +246,7 @@ class MainPlotAvg(pg.GraphicsLayoutWidget):
 
     def line_init(self, ii):
         data = self.q_app.data.loc[ii, ['DataX', 'DataY', 'Color']]
-        self._lines[ii] = self._line_ax.plot(1E3 * data['DataX'], data['DataY'],
+        self._lines[ii] = self._line_ax.plot(1E3 * data['DataX'], np.asarray(data['DataY']),
                                              pen=str(hex(data['Color'])).replace('0x', '#'))
 
     def line_set_visibility(self, ii):
@@ -258,19 +258,26 @@ class MainPlotAvg(pg.GraphicsLayoutWidget):
     def plot_data(self):
         self.logger.debug('plot_data: Handling MainPlotAvg.plot_data - ' + self._plot_type)
 
-        data = self.q_app.data.loc[self.q_app.get_active_ids(), ['DataX', 'DataY', 'Channel']]
+        channels = self.q_app.data.loc[self.q_app.get_active_ids(), 'Channel']
 
         e_ticks = np.linspace(0, 200, 4096)
 
-        def interp_ydata(row):
-            row['ydata'] = np.interp(e_ticks, row['DataX'], row['DataY'])
-            return row
+        def interp_ydata(rows):
+            # rows sharing an energy axis are interpolated together with the same indices and weights
+            i_values = []
+            for xx, _, yys in self.q_app.spectra.groups(rows):
+                if len(xx) < 2:
+                    i_values.extend(np.interp(e_ticks, xx, yy) for yy in yys)
+                    continue
+                idx = np.clip(np.searchsorted(xx, e_ticks, side='right') - 1, 0, len(xx) - 2)
+                ww = np.clip((e_ticks - xx[idx]) / (xx[idx + 1] - xx[idx]), 0., 1.)
+                i_values.append(yys[:, idx] * (1. - ww) + yys[:, idx + 1] * ww)
+            return np.vstack(i_values)
 
         for ch, color in zip((0, 1), (0xff0000, 0x0000ff)):
-            dd = data[data['Channel'] == ch]
-            dd = dd.apply(interp_ydata, axis=1)
-            if 'ydata' in dd.columns:
-                i_values = np.stack(dd['ydata'].to_numpy())
+            rows = channels.index[channels == ch]
+            if rows.shape[0] > 0:
+                i_values = interp_ydata(rows)
                 if self._plot_type == 'mean':
                     i_vals = np.mean(i_values, axis=0)
                 elif self._plot_type == 'median':
@@ -0,0 +1,189 @@
+import os
+import zlib
+import struct
+import pickle
+import logging
+import threading
+
+
+class ProjectJournal:
+    """
+    Append-only journal of the changes made to a project since it was last saved, kept next to the project file.
+
+    The journal is a sequence of frames, every frame is one autosave: a header (payload length, crc32 of the payload)
+    followed by the pickled list of records. A record is :code:`(kind, DataID, ScreenName, value)` with kind
+    :code:`'peaks'` or :code:`'bckg'` and value the :code:`to_dict()` dicts of the row's PeakDataList /
+    BckgDataList, kind :code:`'chi2'` / :code:`'active'` and value the row's Chi2 / Active, kind :code:`'add'` and
+    value the whole row as in a project file, or kind :code:`'remove'` and value None. Later records for the same row
+    replace earlier ones.
+
+    A frame that was not written completely (crash during an autosave) fails the length or checksum test, reading
+    stops there and :code:`open` cuts it off before anything new is appended.
+
+    :code:`compact` rewrites the journal with only the records that still matter and can run in a background thread
+    while autosaves go on, the file operations of all journals share one lock.
+    """
+    suffix = '.journal'
+    header = struct.Struct('<II')
+    kinds = ('peaks', 'bckg', 'chi2', 'active', 'add', 'remove')
+
+    _lock = threading.Lock()
+    # bumped by clear, so a compaction that started before does not bring the old records back
+    _generations = dict()
+
+    def __init__(self, proj_f_name):
+        self.path = proj_f_name + self.suffix
+        self.logger = logging.getLogger(str(self.__class__))
+
+    @property
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def _read(self, end=None):
+        """
+        :param end: stop reading at this offset, a frame boundary
+        :return: (records, length of the valid part of the file)
+        """
+        records, valid = [], 0
+        try:
+            with open(self.path, 'rb') as f:
+                while end is None or valid < end:
+                    head = f.read(self.header.size)
+                    if len(head) < self.header.size:
+                        break
+                    length, crc = self.header.unpack(head)
+                    payload = f.read(length)
+                    if len(payload) < length or zlib.crc32(payload) != crc:
+                        break
+                    records.extend(pickle.loads(payload))
+                    valid += self.header.size + length
+        except FileNotFoundError:
+            pass
+        return records, valid
+
+    def open(self):
+        """
+        Reads the journal and drops an incomplete last frame.
+
+        :return: list of records in the order they were written
+        """
+        with self._lock:
+            records, valid = self._read()
+            if valid < self.size:
+                self.logger.info('open: Dropping %d bytes of an incomplete autosave from %s' %
+                                 (self.size - valid, self.path))
+                with open(self.path, 'r+b') as f:
+                    f.truncate(valid)
+        return records
+
+    def _write(self, f, records):
+        payload = pickle.dumps(records, protocol=pickle.HIGHEST_PROTOCOL)
+        f.write(self.header.pack(len(payload), zlib.crc32(payload)) + payload)
+        f.flush()
+        os.fsync(f.fileno())
+
+    def append(self, records):
+        """
+        Writes :code:`records` as one frame and syncs it to disk.
+        """
+        with self._lock:
+            with open(self.path, 'ab') as f:
+                self._write(f, records)
+
+    def clear(self):
+        with self._lock:
+            self._generations[self.path] = self._generations.get(self.path, 0) + 1
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def compact(self):
+        """
+        Replaces the journal by one frame with the merged records (see :code:`merge`). Frames appended while the
+        records are merged are copied over before the new file is moved into place.
+        """
+        with self._lock:
+            end, generation = self.size, self._generations.get(self.path, 0)
+
+        records, _ = self._read(end)
+        merged = self.merge(records)
+        tmp_name = self.path + '.%d.tmp' % os.getpid()
+        try:
+            with open(tmp_name, 'wb') as f:
+                self._write(f, merged)
+            with self._lock:
+                if self._generations.get(self.path, 0) != generation:
+                    # the project was saved in the meantime
+                    os.remove(tmp_name)
+                    return
+                with open(self.path, 'rb') as src, open(tmp_name, 'ab') as f:
+                    src.seek(end)
+                    f.write(src.read())
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_name, self.path)
+        except OSError as e:
+            self.logger.error('compact: could not compact %s: %s' % (self.path, str(e)))
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            return
+        self.logger.info('compact: %d records of %s merged into %d' % (len(records), self.path, len(merged)))
+
+    @classmethod
+    def mark(cls, pending, kind, data_id, screen_name, value):
+        """
+        Adds a record to :code:`pending`, a dict :code:`(kind, DataID, ScreenName) -> value`. The record replaces an
+        earlier one of the same kind and row and goes to the end, a removal also drops all earlier records of the
+        row, so the order of :code:`pending` stays valid for :code:`replay`.
+        """
+        if kind == 'remove':
+            for other in cls.kinds:
+                pending.pop((other, data_id, screen_name), None)
+        pending.pop((kind, data_id, screen_name), None)
+        pending[(kind, data_id, screen_name)] = value
+
+    @classmethod
+    def merge(cls, records):
+        """
+        :return: the records that :code:`replay` needs to get the same result as from :code:`records`
+        """
+        pending = dict()
+        for kind, data_id, screen_name, value in records:
+            cls.mark(pending, kind, data_id, screen_name, value)
+        return [key + (value, ) for key, value in pending.items()]
+
+    @staticmethod
+    def replay(records, rows):
+        """
+        Applies the journal :code:`records` to the rows of a project as read from the project file (dicts with
+        'DataID', 'ScreenName', 'PeakDataList', 'BckgDataList', 'Chi2' and 'Active'). Added rows are appended to
+        :code:`rows`, removed rows are taken out of it.
+
+        :return: number of records applied
+        """
+        by_key = {(row['DataID'], row['ScreenName']): row for row in rows}
+        columns = {'peaks': 'PeakDataList', 'bckg': 'BckgDataList', 'chi2': 'Chi2', 'active': 'Active'}
+        added, removed, applied = [], set(), 0
+        for kind, data_id, screen_name, items in records:
+            if kind == 'add':
+                by_key[(data_id, screen_name)] = items
+                added.append(items)
+            elif kind == 'remove':
+                row = by_key.pop((data_id, screen_name), None)
+                if row is None:
+                    continue
+                removed.add(id(row))
+            else:
+                row = by_key.get((data_id, screen_name))
+                if row is None or kind not in columns:
+                    continue
+                row[columns[kind]] = items
+            applied += 1
+
+        if added or removed:
+            rows[:] = [row for row in rows + added if id(row) not in removed]
+        return applied
@@ -1,5 +1,6 @@
 from PyQt5.QtWidgets import QWidget, QGridLayout, QPushButton, QMenu, QAction
 import logging
+import numpy as np
 
 from P61App import P61App
 from PlotWidgets import FitPlot
@@ -67,7 +68,7 @@ class PhasesAndElementsWidget(QWidget):
 
     def line_init(self, ii):
         data = self.q_app.data.loc[ii, ['DataX', 'DataY', 'Color']]
-        self._lines[ii] = self._line_ax.plot(1E3 * data['DataX'], data['DataY'],
+        self._lines[ii] = self._line_ax.plot(1E3 * data['DataX'], np.asarray(data['DataY']),
             pen=str(hex(data['Color'])).replace('0x', '#'))
 
     def line_remove(self, ii):
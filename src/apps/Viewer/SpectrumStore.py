@@ -0,0 +1,177 @@
+import numpy as np
+
+
+class _Block:
+    """
+    Contiguous intensity matrix for all spectra of one length and dtype. Spectra are appended to the matrix, which
+    is reallocated with double the size of its live rows when it runs full. Slots of removed spectra are never
+    overwritten (somebody might still hold a view of them), they are dropped on reallocation.
+    """
+    def __init__(self, n_bins, dtype, capacity=64):
+        self.matrix = np.empty((capacity, n_bins), dtype=dtype)
+        self.n_used = 0
+
+    def view(self, slot):
+        result = self.matrix[slot]
+        result.flags.writeable = False
+        return result
+
+
+class SpectrumStore:
+    """
+    Columnar storage of the spectra of :code:`P61App.data`, one entry per row of the table and in the same order.
+
+    Intensities that were read into memory are kept in contiguous 2D matrices, one per spectrum length and dtype,
+    and the :code:`'DataY'` cells of the table hold read-only views of the matrix rows, so :code:`data.loc[idx,
+    'DataY']` keeps working without a copy. Lazy spectra (:code:`LazySpectrum`) stay in the table as they are and are
+    only read when an aggregate needs them. Every row also references its (shared) energy axis.
+
+    Aggregates over many rows are single numpy operations on the matrix, see :code:`groups`.
+    """
+    def __init__(self):
+        self._blocks = []
+        self._block_keys = dict()
+        # per row: block number and slot in it, -1 if the intensities are not in a matrix
+        self.block_ids = np.empty(0, dtype=np.int64)
+        self.slots = np.empty(0, dtype=np.int64)
+        # per row: energy axis and intensities as stored in the table (views or lazy handles)
+        self.axes = np.empty(0, dtype=object)
+        self.cells = np.empty(0, dtype=object)
+
+    def __len__(self):
+        return self.block_ids.shape[0]
+
+    def insert(self, position, rows):
+        """
+        Inserts :code:`rows` empty rows at :code:`position`, same as :code:`P61App.insert_data`.
+        """
+        self.block_ids = np.insert(self.block_ids, position, np.full(rows, -1))
+        self.slots = np.insert(self.slots, position, np.full(rows, -1))
+        self.axes = np.insert(self.axes, position, np.full(rows, None))
+        self.cells = np.insert(self.cells, position, np.full(rows, None))
+
+    def remove(self, rows):
+        """
+        Removes the rows at the positions :code:`rows`, same as :code:`P61App.remove_data`.
+        """
+        keep = np.ones(len(self), dtype=bool)
+        keep[np.asarray(rows, dtype=np.int64)] = False
+        self.block_ids = self.block_ids[keep]
+        self.slots = self.slots[keep]
+        self.axes = self.axes[keep]
+        self.cells = self.cells[keep]
+
+        # matrices without live rows are given back
+        n_live = np.bincount(self.block_ids[self.block_ids != -1], minlength=len(self._blocks))
+        for b_id in np.flatnonzero(n_live == 0):
+            block = self._blocks[b_id]
+            if block.n_used > 0:
+                self._blocks[b_id] = _Block(block.matrix.shape[1], block.matrix.dtype)
+
+    def permute(self, order):
+        """
+        Reorders the rows, row :code:`ii` after the call is the row :code:`order[ii]` before it.
+        """
+        order = np.asarray(order, dtype=np.int64)
+        self.block_ids = self.block_ids[order]
+        self.slots = self.slots[order]
+        self.axes = self.axes[order]
+        self.cells = self.cells[order]
+
+    def clear(self):
+        self.__init__()
+
+    def _block(self, n_bins, dtype):
+        key = (n_bins, np.dtype(dtype).str)
+        if key not in self._block_keys:
+            self._block_keys[key] = len(self._blocks)
+            self._blocks.append(_Block(n_bins, dtype))
+        return self._block_keys[key]
+
+    def _alloc(self, b_id):
+        """
+        :return: (free slot in the block, True if the block was reallocated)
+        """
+        block = self._blocks[b_id]
+        grown = block.n_used == block.matrix.shape[0]
+        if grown:
+            live = np.flatnonzero(self.block_ids == b_id)
+            matrix = np.empty((max(64, 2 * (live.shape[0] + 1)), block.matrix.shape[1]), dtype=block.matrix.dtype)
+            matrix[:live.shape[0]] = block.matrix[self.slots[live]]
+            self.slots[live] = np.arange(live.shape[0])
+            block.matrix, block.n_used = matrix, live.shape[0]
+        block.n_used += 1
+        return block.n_used - 1, grown
+
+    def set(self, rows, axes, intensities):
+        """
+        Stores the spectra of :code:`rows`. One-dimensional numeric arrays are copied into the matrices, anything else
+        (lazy handles) is kept as is.
+
+        As a matrix can be reallocated while growing, views held by other rows of the same matrix can change, too.
+        The caller has to write the returned cells back into the :code:`'DataY'` column of the table.
+
+        :param rows: row positions
+        :param axes: energy axis per row
+        :param intensities: intensities per row
+        :return: (row positions, cells) that changed
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        grown = set()
+        for row, xx, yy in zip(rows, axes, intensities):
+            self.block_ids[row], self.slots[row] = -1, -1
+            self.axes[row] = xx
+            if isinstance(yy, np.ndarray) and yy.ndim == 1 and yy.dtype != object:
+                b_id = self._block(yy.shape[0], yy.dtype)
+                slot, is_grown = self._alloc(b_id)
+                if is_grown:
+                    grown.add(b_id)
+                self._blocks[b_id].matrix[slot] = yy
+                self.block_ids[row], self.slots[row] = b_id, slot
+                self.cells[row] = self._blocks[b_id].view(slot)
+            else:
+                self.cells[row] = yy
+
+        if grown:
+            moved = np.flatnonzero(np.isin(self.block_ids, list(grown)))
+            for row in moved:
+                self.cells[row] = self._blocks[self.block_ids[row]].view(self.slots[row])
+            rows = np.union1d(rows, moved)
+
+        return rows, self.cells[rows]
+
+    def intensity(self, row):
+        """
+        Intensities of one row: a read-only view of the matrix or the lazy handle.
+        """
+        return self.cells[row]
+
+    def axis(self, row):
+        return self.axes[row]
+
+    def matrix(self, rows):
+        """
+        Intensities of :code:`rows` as one 2D array. All rows have to have the same length; rows in the same matrix
+        are taken with a single indexing operation, lazy spectra are read.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if rows.shape[0] == 0:
+            return np.empty((0, 0))
+
+        b_ids = self.block_ids[rows]
+        if b_ids[0] != -1 and np.all(b_ids == b_ids[0]):
+            return self._blocks[b_ids[0]].matrix[self.slots[rows]]
+
+        return np.stack([np.asarray(self.cells[row]) for row in rows])
+
+    def groups(self, rows):
+        """
+        Splits :code:`rows` by energy axis.
+
+        :return: list of (energy axis, row positions, intensity matrix of the rows)
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        by_axis = dict()
+        for row in rows:
+            by_axis.setdefault(id(self.axes[row]), (self.axes[row], []))[1].append(row)
+        return [(xx, np.array(rr), self.matrix(rr)) for xx, rr in by_axis.values()]
@@ -1,7 +1,9 @@
 import numpy as np
 import pandas as pd
 import copy
-from uncertainties import ufloat
+from bisect import bisect_left, bisect_right
+
+from peak_fit_utils.param_records import ParamLayout, ParamValues, ParamBounds, ParamRefine
 
 
 prefixes = {'Gaussian': 'gau',
@@ -12,8 +14,21 @@ prefixes = {'Gaussian': 'gau',
             'Interpolation': 'int',
             'Chebyshev': 'che'}
 
+# parameter order of the models, parameters that are set later are appended
+model_params = {'PseudoVoigt': ('width', 'sigma', 'center', 'height', 'amplitude', 'fraction', 'base',
+                                'overlap_base', 'rwp2', 'chi2')}
+
 
 class PeakData:
+    """
+    Peak model of one spectrum.
+
+    Parameters, bounds and refinement flags are stored in one structured array (:code:`param_records`) with the
+    layout of the model; :code:`md_params`, :code:`md_p_bounds` and :code:`md_p_refine` are dict-like views of it.
+    :code:`md_values` gives the nominal values as a plain dict for evaluating the model.
+    """
+    __slots__ = ('_l_bh', '_r_bh', '_track', '_idx', 'md_name', 'md_prefix', '_layout', '_rec', 'track_id')
+
     def __init__(self, idx, cx, cy, l_ip, r_ip, l_b, r_b, l_bh, r_bh, model='PseudoVoigt'):
         """
 
@@ -36,90 +51,144 @@ class PeakData:
 
         self.md_name = model
         self.md_prefix = prefixes[model]
-        self.md_params = dict()
-        self.md_p_bounds = dict()
-        self.md_p_refine = dict()
+        self._layout = ParamLayout.of(model, model_params.get(model, ()))
+        self._rec = self._layout.empty()
 
         self.make_md_params(cx, cy, l_ip, r_ip)
 
-    def make_md_params(self, _cx, _cy, _l_ip, _r_ip):
+    def _record(self, name):
         """
-        Initiates the model parameters and bounds from the peak search results
-
-        :param _cx:
-        :param _cy:
-        :param _l_ip:
-        :param _r_ip:
-        :return:
+        :return: (parameter records, position of :code:`name` in them), adds the parameter to the layout if needed
         """
-        self.md_params, self.md_p_bounds = dict(), dict()
+        ii = self._layout.slot(name, add=True)
+        if ii >= self._rec.shape[0]:
+            rec = self._layout.empty()
+            rec[:self._rec.shape[0]] = self._rec
+            self._rec = rec
+        return self._rec, ii
 
-        if self.md_name == 'PseudoVoigt':
-            self.md_params['width'] = ufloat(_r_ip - _l_ip, np.NAN)
-            self.md_params['sigma'] = self.md_params['width'] / (2. * np.sqrt(2. * np.log(2)))
+    def _value(self, name):
+        ii = self._layout.slots.get(name)
+        if ii is None or ii >= self._rec.shape[0] or not self._rec['has_value'][ii]:
+            raise KeyError(name)
+        return self._rec['n'][ii].item()
 
-            self.md_params['center'] = ufloat(_cx, np.NAN)
+    def _set_value(self, name, n, s=np.nan):
+        rec, ii = self._record(name)
+        rec['n'][ii], rec['s'][ii], rec['has_value'][ii] = n, s, True
 
-            # this amplitude-height relationship is only correct at fraction = 0
-            self.md_params['height'] = ufloat(np.abs(_cy - self.bckg_height), np.NAN)
-            self.md_params['amplitude'] = self.md_params['height'] * self.md_params['sigma'] * \
-                                          (np.sqrt(2. * np.pi) / np.sqrt(2. * np.log(2)))
+    def _set_bounds(self, name, lb, ub):
+        rec, ii = self._record(name)
+        rec['lb'][ii], rec['ub'][ii], rec['has_bounds'][ii] = lb, ub, True
+
+    @property
+    def md_params(self):
+        return ParamValues(self)
+
+    @md_params.setter
+    def md_params(self, val):
+        view = ParamValues(self)
+        view.clear()
+        view.update(val)
 
-            self.md_params['fraction'] = ufloat(0., np.NAN)
+    @property
+    def md_p_bounds(self):
+        return ParamBounds(self)
 
-            self.md_params['base'] = ufloat(5., np.NAN)
-            self.md_params['overlap_base'] = ufloat(1e-2, np.NAN)
-            self.md_params['rwp2'] = ufloat(np.NAN, np.NAN)
-            self.md_params['chi2'] = ufloat(np.NAN, np.NAN)
+    @md_p_bounds.setter
+    def md_p_bounds(self, val):
+        view = ParamBounds(self)
+        view.clear()
+        view.update(val)
 
-            self.md_p_bounds['width'] = (0., np.inf)
-            self.md_p_bounds['sigma'] = (0.1 * self.md_params['sigma'].n, 2. * self.md_params['sigma'].n)
+    @property
+    def md_p_refine(self):
+        return ParamRefine(self)
 
-            self.md_p_bounds['center'] = (self.md_params['center'].n - .5 * self.md_params['width'].n,
-                                          self.md_params['center'].n + .5 * self.md_params['width'].n)
+    @md_p_refine.setter
+    def md_p_refine(self, val):
+        view = ParamRefine(self)
+        view.clear()
+        view.update(val)
 
-            self.md_p_bounds['amplitude'] = (0., 1e7)
-            self.md_p_bounds['height'] = (0., np.inf)
+    @property
+    def md_values(self):
+        """
+        Nominal values of the parameters as a dict name -> float, e.g. for :code:`peak_models[md_name](xx,
+        **peak.md_values)`.
+        """
+        return {k: n for k, n, present in zip(self._layout.names, self._rec['n'].tolist(),
+                                              self._rec['has_value'].tolist()) if present}
 
-            self.md_p_bounds['fraction'] = (0., 1.)
+    def make_md_params(self, _cx, _cy, _l_ip, _r_ip):
+        """
+        Initiates the model parameters and bounds from the peak search results
 
-            self.md_p_bounds['base'] = (0., np.inf)
-            self.md_p_bounds['overlap_base'] = (0., np.inf)
-            self.md_p_bounds['rwp2'] = (0., np.inf)
-            self.md_p_bounds['chi2'] = (0., np.inf)
+        :param _cx:
+        :param _cy:
+        :param _l_ip:
+        :param _r_ip:
+        :return:
+        """
+        self._rec = self._layout.empty()
 
-            self.md_p_refine['sigma'] = True
-            self.md_p_refine['center'] = True
-            self.md_p_refine['amplitude'] = True
-            self.md_p_refine['fraction'] = True
+        if self.md_name == 'PseudoVoigt':
+            width = _r_ip - _l_ip
+            sigma = width / (2. * np.sqrt(2. * np.log(2)))
+            # this amplitude-height relationship is only correct at fraction = 0
+            height = np.abs(_cy - self.bckg_height)
+
+            self._set_value('width', width)
+            self._set_value('sigma', sigma)
+            self._set_value('center', _cx)
+            self._set_value('height', height)
+            self._set_value('amplitude', height * sigma * (np.sqrt(2. * np.pi) / np.sqrt(2. * np.log(2))))
+            self._set_value('fraction', 0.)
+            self._set_value('base', 5.)
+            self._set_value('overlap_base', 1e-2)
+            self._set_value('rwp2', np.nan)
+            self._set_value('chi2', np.nan)
+
+            self._set_bounds('width', 0., np.inf)
+            self._set_bounds('sigma', 0.1 * sigma, 2. * sigma)
+            self._set_bounds('center', _cx - .5 * width, _cx + .5 * width)
+            self._set_bounds('amplitude', 0., 1e7)
+            self._set_bounds('height', 0., np.inf)
+            self._set_bounds('fraction', 0., 1.)
+            self._set_bounds('base', 0., np.inf)
+            self._set_bounds('overlap_base', 0., np.inf)
+            self._set_bounds('rwp2', 0., np.inf)
+            self._set_bounds('chi2', 0., np.inf)
+
+            for name in ('sigma', 'center', 'amplitude', 'fraction'):
+                self._rec['refine'][self._layout.slots[name]] = True
 
     def upd_nref_params(self, lr_bh=None):
         """
-        Update values of the parameters that are not refined
+        Update values of the parameters that are not refined. Uncertainties are propagated to first order like
+        :code:`uncertainties` does for independent parameters.
         :return:
         """
         if self.md_name == 'PseudoVoigt':
-            self.md_params['width'] = self.md_params['sigma'] * (2. * np.sqrt(2. * np.log(2)))
-            self.md_params['height'] = (((1 - self.md_params['fraction']) * self.md_params['amplitude']) / (
-            (self.md_params['sigma'] * np.sqrt(np.pi / np.log(2.)))) + (
-                                                    self.md_params['fraction'] * self.md_params['amplitude']) / (
-                                        (np.pi * self.md_params['sigma'])))
-
-            self.md_p_bounds['width'] = (
-                self.md_p_bounds['sigma'][0] * (2. * np.sqrt(2. * np.log(2))),
-                self.md_p_bounds['sigma'][1] * (2. * np.sqrt(2. * np.log(2)))
-            )
-
-            self.md_p_bounds['height'] = (
-                (((1 - self.md_params['fraction'].n) * self.md_p_bounds['amplitude'][0]) / (
-                    (self.md_params['sigma'].n * np.sqrt(np.pi / np.log(2.)))) + (
-                         self.md_params['fraction'].n * self.md_p_bounds['amplitude'][0]) / (
-                     (np.pi * self.md_params['sigma'].n))),
-                (((1 - self.md_params['fraction'].n) * self.md_p_bounds['amplitude'][1]) / (
-                    (self.md_params['sigma'].n * np.sqrt(np.pi / np.log(2.)))) + (
-                         self.md_params['fraction'].n * self.md_p_bounds['amplitude'][1]) / (
-                     (np.pi * self.md_params['sigma'].n)))
-            )
+            rec, slots = self._rec, self._layout.slots
+            sigma, s_sigma = rec['n'][slots['sigma']], rec['s'][slots['sigma']]
+            frac, s_frac = rec['n'][slots['fraction']], rec['s'][slots['fraction']]
+            amp, s_amp = rec['n'][slots['amplitude']], rec['s'][slots['amplitude']]
+
+            k_width = 2. * np.sqrt(2. * np.log(2))
+            self._set_value('width', sigma * k_width, s_sigma * k_width)
+
+            # height = amplitude / sigma * ((1 - fraction) * c_g + fraction * c_l)
+            c_g, c_l = 1. / np.sqrt(np.pi / np.log(2.)), 1. / np.pi
+            shape = (1. - frac) * c_g + frac * c_l
+            height = amp * shape / sigma
+            s_height = np.sqrt((shape / sigma * s_amp) ** 2 + (height / sigma * s_sigma) ** 2 +
+                               (amp / sigma * (c_l - c_g) * s_frac) ** 2)
+            self._set_value('height', height, s_height)
+
+            self._set_bounds('width', rec['lb'][slots['sigma']] * k_width, rec['ub'][slots['sigma']] * k_width)
+            self._set_bounds('height', rec['lb'][slots['amplitude']] * shape / sigma,
+                             rec['ub'][slots['amplitude']] * shape / sigma)
 
             if lr_bh is not None:
                 self._l_bh = lr_bh[0]
@@ -133,11 +202,12 @@ class PeakData:
     def export_ref_params(self):
         result = dict()
         if self.md_name == 'PseudoVoigt':
+            rec, slots = self._rec, self._layout.slots
             for k in ('center', 'sigma', 'width', 'height', 'fraction', 'amplitude'):
-                result[k] = self.md_params[k].n
-                result['_'.join((k, 'std'))] = self.md_params[k].s
+                result[k] = rec['n'][slots[k]].item()
+                result['_'.join((k, 'std'))] = rec['s'][slots[k]].item()
             for k in ('chi2', 'rwp2'):
-                result[k] = self.md_params[k].n
+                result[k] = rec['n'][slots[k]].item()
         else:
             pass
 
@@ -151,21 +221,39 @@ class PeakData:
         result['idx'] = self._idx
         result['md_name'] = self.md_name
         result['md_prefix'] = self.md_prefix
-        result['md_params'] = {k: (self.md_params[k].n, self.md_params[k].s) for k in self.md_params.keys()}
-        result['md_p_bounds'] = self.md_p_bounds
-        result['md_p_refine'] = self.md_p_refine
+        result['md_params'] = {k: (n, s) for k, n, s in
+                               zip(self.md_params, self._rec['n'][self._rec['has_value']].tolist(),
+                                   self._rec['s'][self._rec['has_value']].tolist())}
+        result['md_p_bounds'] = dict(self.md_p_bounds)
+        result['md_p_refine'] = dict(self.md_p_refine)
         return result
 
     @classmethod
     def from_dict(cls, data):
         result = cls(idx=data['idx'], cx=0, cy=0, l_ip=0, r_ip=0, l_b=0, r_b=0, l_bh=0, r_bh=0, model=data['md_name'])
         result.md_prefix = data['md_prefix']
-        result.md_params = {k: ufloat(*data['md_params'][k]) for k in data['md_params'].keys()}
-        result.md_p_bounds = data['md_p_bounds']
-        result.md_p_refine = data['md_p_refine']
+        result._load_params(data)
         result.track_id = data['track']
         return result
 
+    def update_from_dict(self, data):
+        """
+        Takes over the parameters, bounds, refinement flags and background heights of :code:`data` (a
+        :code:`to_dict()` of a copy of this peak, e.g. refined in another process). Track and index are kept.
+        """
+        self._l_bh, self._r_bh = data['bh']
+        self._load_params(data)
+
+    def _load_params(self, data):
+        self._rec = self._layout.empty()
+        for k, (n, s) in data['md_params'].items():
+            self._set_value(k, n, s)
+        for k, (lb, ub) in data['md_p_bounds'].items():
+            self._set_bounds(k, lb, ub)
+        for k, val in data['md_p_refine'].items():
+            rec, ii = self._record(k)
+            rec['refine'][ii] = bool(val)
+
     def __copy__(self):
         return PeakData(self._idx, self.cx, self.cy,
                         self.l_ip, self.r_ip,
@@ -174,14 +262,14 @@ class PeakData:
     @property
     def cx(self):
         if self.md_name == 'PseudoVoigt':
-            return self.md_params['center'].n
+            return self._value('center')
         else:
             raise NotImplementedError('Property cx is not implemented for peak model %s' % self.md_name)
 
     @cx.setter
     def cx(self, val):
         if self.md_name == 'PseudoVoigt':
-            self.md_params['center'] = ufloat(val, np.nan)
+            self._set_value('center', val)
         else:
             raise NotImplementedError('Property cx.setter is not implemented for peak model %s' % self.md_name)
 
@@ -202,21 +290,21 @@ class PeakData:
     @property
     def cy(self):
         if self.md_name == 'PseudoVoigt':
-            return self.md_params['height'].n + np.mean([self._l_bh, self._l_bh])
+            return self._value('height') + np.mean([self._l_bh, self._l_bh])
         else:
             raise NotImplementedError('Property cy is not implemented for peak model %s' % self.md_name)
 
     @property
     def amplitude(self):
         if self.md_name == 'PseudoVoigt':
-            return self.md_params['amplitude'].n
+            return self._value('amplitude')
         else:
             raise NotImplementedError('Property amplitude is not implemented for peak model %s' % self.md_name)
 
     @amplitude.setter
     def amplitude(self, val):
         if self.md_name == 'PseudoVoigt':
-            self.md_params['amplitude'] = ufloat(val, np.nan)
+            self._set_value('amplitude', val)
             self.upd_nref_params()
         else:
             raise NotImplementedError('Property amplitude.setter is not implemented for peak model %s' % self.md_name)
@@ -239,14 +327,14 @@ class PeakData:
     @property
     def sigma(self):
         if self.md_name == 'PseudoVoigt':
-            return self.md_params['sigma'].n
+            return self._value('sigma')
         else:
             raise NotImplementedError('Property sigma is not implemented for peak model %s' % self.md_name)
 
     @sigma.setter
     def sigma(self, val):
         if self.md_name == 'PseudoVoigt':
-            self.md_params['sigma'] = ufloat(val, np.nan)
+            self._set_value('sigma', val)
             self.upd_nref_params()
         else:
             raise NotImplementedError('Property sigma.setter is not implemented for peak model %s' % self.md_name)
@@ -269,28 +357,28 @@ class PeakData:
     @property
     def base(self):
         if self.md_name == 'PseudoVoigt':
-            return self.md_params['base'].n
+            return self._value('base')
         else:
             raise NotImplementedError('Property base is not implemented for peak model %s' % self.md_name)
 
     @base.setter
     def base(self, val):
         if self.md_name == 'PseudoVoigt':
-            self.md_params['base'] = ufloat(val, np.nan)
+            self._set_value('base', val)
         else:
             raise NotImplementedError('Property base.setter is not implemented for peak model %s' % self.md_name)
 
     @property
     def overlap_base(self):
         if self.md_name == 'PseudoVoigt':
-            return self.md_params['overlap_base'].n
+            return self._value('overlap_base')
         else:
             raise NotImplementedError('Property overlap_base is not implemented for peak model %s' % self.md_name)
 
     @overlap_base.setter
     def overlap_base(self, val):
         if self.md_name == 'PseudoVoigt':
-            self.md_params['overlap_base'] = ufloat(val, np.nan)
+            self._set_value('overlap_base', val)
         else:
             raise NotImplementedError('Property overlap_base.setter is not implemented for peak model %s' % self.md_name)
 
@@ -309,7 +397,7 @@ class PeakData:
     @property
     def l_b(self):
         if self.md_name == 'PseudoVoigt':
-            return self.md_params['center'].n - self.md_params['sigma'].n * self.md_params['base'].n
+            return self._value('center') - self._value('sigma') * self._value('base')
         else:
             raise NotImplementedError('Property cy is not implemented for peak model %s' % self.md_name)
 
@@ -324,7 +412,7 @@ class PeakData:
     @property
     def r_b(self):
         if self.md_name == 'PseudoVoigt':
-            return self.md_params['center'].n + self.md_params['sigma'].n * self.md_params['base'].n
+            return self._value('center') + self._value('sigma') * self._value('base')
         else:
             raise NotImplementedError('Property cy is not implemented for peak model %s' % self.md_name)
 
@@ -339,14 +427,14 @@ class PeakData:
     @property
     def l_ip(self):
         if self.md_name == 'PseudoVoigt':
-            return self.md_params['center'].n - 0.5 * self.md_params['width'].n
+            return self._value('center') - 0.5 * self._value('width')
         else:
             raise NotImplementedError('Property cy is not implemented for peak model %s' % self.md_name)
 
     @property
     def r_ip(self):
         if self.md_name == 'PseudoVoigt':
-            return self.md_params['center'].n + 0.5 * self.md_params['width'].n
+            return self._value('center') + 0.5 * self._value('width')
         else:
             raise NotImplementedError('Property cy is not implemented for peak model %s' % self.md_name)
 
@@ -364,14 +452,26 @@ class PeakData:
 class PeakDataTrack:
     """
     Stores peaks that are in the same position across all spectra
+
+    Peaks are kept sorted by spectrum index (:code:`PeakData.idx`) with a parallel list of the indices for bisection,
+    and a dict spectrum index -> peak makes :code:`track[idx]` and :code:`idx in track` O(1). If a peak's :code:`idx`
+    is changed from outside, :code:`sort_ids` has to be called.
     """
     track_idx = 0
 
-    def __init__(self, pd: PeakData):
+    def __init__(self, pd: PeakData, idx=None):
+        """
+        :param pd: first peak of the track
+        :param idx: track id to restore (e.g. from a project file), a new one is assigned if None
+        """
         self._peaks = []
+        self._ids = []
+        self._by_idx = dict()
         self.append(pd)
-        self._idx = PeakDataTrack.track_idx
-        PeakDataTrack.track_idx += 1
+        if idx is None:
+            idx = PeakDataTrack.track_idx
+        self._idx = idx
+        PeakDataTrack.track_idx = max(PeakDataTrack.track_idx, idx + 1)
 
     def get_track_idx(self):
         return self._idx
@@ -390,27 +490,39 @@ class PeakDataTrack:
         self.cleanup()
 
     def cleanup(self):
-        while self._peaks:
-            self._peaks[0].track = None
-            del self._peaks[0]
+        for peak in self._peaks:
+            peak.track = None
+        self._peaks, self._ids, self._by_idx = [], [], dict()
 
     def pop(self, spectra_idx):
-        for ii in range(len(self._peaks)):
-            if self._peaks[ii].idx == spectra_idx:
-                self._peaks[ii].track = None
-                del self._peaks[ii]
-                return
+        peak = self._by_idx.pop(spectra_idx, None)
+        if peak is None:
+            return
+
+        lo, hi = bisect_left(self._ids, spectra_idx), bisect_right(self._ids, spectra_idx)
+        ii = next(ii for ii in range(lo, hi) if self._peaks[ii] is peak)
+        peak.track = None
+        del self._peaks[ii], self._ids[ii]
+        # a spectrum can have more than one peak in the track
+        if hi - lo > 1:
+            self._by_idx[spectra_idx] = self._peaks[lo]
 
     def dist(self, pd: PeakData):
         return np.abs(self._peaks[-1].cx - pd.cx)
 
     def append(self, pd: PeakData):
-        self._peaks.append(pd)
-        self._peaks[-1].track = self
-        self.sort_ids()
+        ii = bisect_right(self._ids, pd.idx)
+        self._peaks.insert(ii, pd)
+        self._ids.insert(ii, pd.idx)
+        self._by_idx.setdefault(pd.idx, pd)
+        pd.track = self
 
     def sort_ids(self):
         self._peaks = list(sorted(self._peaks, key=lambda x: x.idx))
+        self._ids = [peak.idx for peak in self._peaks]
+        self._by_idx = dict()
+        for peak in self._peaks:
+            self._by_idx.setdefault(peak.idx, peak)
 
     @property
     def export_ref_params(self):
@@ -456,7 +568,7 @@ class PeakDataTrack:
 
     @property
     def ids(self):
-        return [peak.idx for peak in self._peaks]
+        return list(self._ids)
 
     @property
     def cxs(self):
@@ -533,12 +645,14 @@ class PeakDataTrack:
             peak.overlap_base = val
 
     def __getitem__(self, item):
-        for peak in self._peaks:
-            if peak.idx == item:
-                return peak
-        else:
+        try:
+            return self._by_idx[item]
+        except KeyError:
             raise KeyError('Key %s not found' % str(item))
 
+    def __contains__(self, item):
+        return item in self._by_idx
+
     def __lt__(self, other):
         return np.mean(self.cxs).__lt__(np.mean(other.cxs))
 
@@ -1,5 +1,6 @@
 from .PeakTrack import PeakDataTrack, PeakData
 from .models import peak_models, background_models
+from .composite import CompositeModel
 from .peak_refinement import fit_peaks
 from .full_refinement import fit_to_precision
 from .bckg_refinement import BckgData, fit_bckg
@@ -0,0 +1,76 @@
+"""
+Module-level entry points for refining many spectra independently of each other, used by :code:`BatchFitWorker`
+both in its own thread and in worker processes. Everything here has to stay picklable and must not touch
+:code:`P61App`.
+
+A task is :code:`(idx, fit_type, xx, yy, peaks, bckg_list, kwargs)` with :code:`peaks` the :code:`to_dict()` dicts of
+the peaks, as :code:`PeakData` objects belong to tracks spanning all spectra. The peaks are refined as copies and only
+their parameters travel back; :code:`apply_result` writes them to the original objects, which keeps the tracks valid.
+"""
+from concurrent.futures import as_completed
+
+from utils import cancel
+from peak_fit_utils.PeakTrack import PeakData
+from peak_fit_utils.peak_refinement import fit_peaks
+from peak_fit_utils.bckg_refinement import fit_bckg
+from peak_fit_utils.full_refinement import fit_to_precision
+
+
+fit_functions = {'peaks': fit_peaks, 'bckg': fit_bckg, 'prec': fit_to_precision}
+
+
+def make_task(idx, fit_type, xx, yy, peak_list, bckg_list, **kwargs):
+    """
+    :param idx: row of the spectrum, handed back with the result
+    :param fit_type: one of :code:`fit_functions`
+    :param kwargs: keyword arguments of the fit function, e.g. :code:`residuals`, :code:`max_cycles`
+    """
+    if fit_type not in fit_functions:
+        raise ValueError('fit_type should be one of %s, got %s' % (str(tuple(fit_functions)), fit_type))
+    return idx, fit_type, xx, yy, [peak.to_dict() for peak in peak_list], bckg_list, kwargs
+
+
+def fit_spectrum(task):
+    """
+    Refines one spectrum.
+
+    :param task: see :code:`make_task`
+    :return: (idx, (chi2, bckg_list, peak order, peak dicts) or None, error message or None). Peak dicts are in the
+    order of the task, peak order gives the positions of the peaks in the refined (sorted) list.
+    """
+    idx, fit_type, xx, yy, peaks, bckg_list, kwargs = task
+    try:
+        peak_list = [PeakData.from_dict(peak) for peak in peaks]
+        positions = {id(peak): ii for ii, peak in enumerate(peak_list)}
+        chi2, bckg_list, result = fit_functions[fit_type](peak_list=list(peak_list), bckg_list=bckg_list,
+                                                          xx=xx, yy=yy, **kwargs)
+        return idx, (chi2, bckg_list, [positions[id(peak)] for peak in result],
+                     [peak.to_dict() for peak in peak_list]), None
+    except Exception as e:
+        return idx, None, str(e)
+
+
+def apply_result(peak_list, result):
+    """
+    Writes the refined peak parameters of a :code:`fit_spectrum` result to the peaks the task was made from.
+
+    :return: (chi2, bckg_list, peak_list) like the fit functions, with the original peak objects in refined order
+    """
+    chi2, bckg_list, order, peaks = result
+    for peak, data in zip(peak_list, peaks):
+        peak.update_from_dict(data)
+    return chi2, bckg_list, [peak_list[ii] for ii in order]
+
+
+def fit_spectra(executor, tasks):
+    """
+    Refines :code:`tasks` on a process pool, e.g. :code:`P61App.get_process_pool`. The results of :code:`fit_spectrum`
+    are yielded as soon as they are available, not in the order of the tasks. Closing the generator cancels the tasks
+    that were not started yet.
+    """
+    futures = [executor.submit(fit_spectrum, task) for task in tasks]
+    try:
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        cancel(futures)
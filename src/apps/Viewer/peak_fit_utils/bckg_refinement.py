@@ -2,16 +2,23 @@ import numpy as np
 from uncertainties import ufloat
 from scipy.optimize import least_squares
 import copy
+import weakref
+import threading
 
 import logging
 
-from peak_fit_utils.models import peak_models, background_models
-from peak_fit_utils.metrics import upd_metrics
+from peak_fit_utils.models import background_models, background_jacobians
+from peak_fit_utils.composite import CompositeModel
+from peak_fit_utils.metrics import upd_metrics, residual_weights
 from peak_fit_utils.peak_refinement import get_peak_intervals
 from utils import log_ex_time
 
 logger = logging.getLogger('peak_fit_utils')
 
+# (id(axis), xmin, xmax, number of coefficients) -> (weakref(axis), mask, basis), see chebyshev_design
+_design_cache = dict()
+_design_lock = threading.Lock()
+
 
 class BckgData:
     def __init__(self, model):
@@ -22,7 +29,8 @@ class BckgData:
         self.md_p_refine = dict()
 
         self._poly_coefs = np.zeros(100) + 1
-        self._interp_fn = lambda x: np.zeros(x.shape)
+        # module-level function rather than a lambda, so that the background can be pickled for worker processes
+        self._interp_fn = zero_bckg
         self.make_md_params()
 
     def make_md_params(self):
@@ -88,6 +96,10 @@ class BckgData:
         return result
 
 
+def zero_bckg(x):
+    return np.zeros(x.shape)
+
+
 class InterpFunc:
     def __init__(self, ixs, iys):
         self.ixs = ixs
@@ -100,33 +112,138 @@ class InterpFunc:
         return result
 
 
+def chebyshev_design(xx, xmin, xmax, n_coefs):
+    """
+    Design matrix of the Chebyshev background: the basis polynomials T_0..T_(n_coefs - 1) of :code:`polynomial`
+    evaluated at the points of :code:`xx` inside (xmin, xmax).
+
+    Matrices of read-only axes (the shared :code:`DataX` arrays, see :code:`DatasetIO.energy_axes`) are cached, so all
+    spectra on the same axis and background interval use one matrix. Writeable axes are not cached.
+
+    :return: (boolean mask of the points of :code:`xx` inside the interval, read-only basis matrix of shape
+    (mask.sum(), n_coefs))
+    """
+    cacheable = isinstance(xx, np.ndarray) and not xx.flags.writeable
+    key = (id(xx), float(xmin), float(xmax), int(n_coefs))
+    if cacheable:
+        with _design_lock:
+            entry = _design_cache.get(key)
+        if entry is not None and entry[0]() is xx:
+            return entry[1], entry[2]
+
+    mask = (xx > xmin) & (xx < xmax)
+    if n_coefs > 0:
+        basis = np.polynomial.chebyshev.chebvander((xx[mask] - xmin) / (xmax - xmin), n_coefs - 1)
+    else:
+        basis = np.zeros((np.count_nonzero(mask), 0))
+    mask.flags.writeable = False
+    basis.flags.writeable = False
+
+    if cacheable:
+        with _design_lock:
+            if len(_design_cache) >= 64:
+                _design_cache.clear()
+            _design_cache[key] = (weakref.ref(xx), mask, basis)
+    return mask, basis
+
+
+def solve_linear_bckg(basis, iy, weights=None, non_negative=True, max_iter=10):
+    """
+    Linear least squares fit of the background coefficients: minimizes sum((weights * (iy - basis @ coefs)) ** 2).
+
+    :param basis: design matrix from :code:`chebyshev_design`
+    :param iy: data to fit
+    :param weights: per-point weights, None for an unweighted fit
+    :param non_negative: the background model is cut off at 0, so points where the fitted curve is negative do not
+    depend on the coefficients. If True the fit is repeated without these points until the set of cut off points stops
+    changing (at most :code:`max_iter` times).
+    :return: coefficients
+    """
+    if basis.shape[1] == 0:
+        return np.zeros(0)
+
+    a, b = (basis, iy) if weights is None else (basis * weights[:, np.newaxis], iy * weights)
+    coefs = np.linalg.lstsq(a, b, rcond=None)[0]
+
+    if non_negative:
+        active = np.ones(iy.shape, dtype=bool)
+        for _ in range(max_iter):
+            new_active = basis @ coefs > 0.
+            if np.array_equal(new_active, active) or np.count_nonzero(new_active) < basis.shape[1]:
+                break
+            active = new_active
+            coefs = np.linalg.lstsq(a[active], b[active], rcond=None)[0]
+    return coefs
+
+
 @log_ex_time(logger=logger)
-def fit_bckg(peak_list, bckg_list, xx, yy):
-    y_calc_peaks = np.zeros(yy.shape)
+def fit_bckg(peak_list, bckg_list, xx, yy, analytic_jac=True, linear=True, non_negative=True, residuals='poisson'):
+    """
+    Refines the background models of one spectrum with the peaks fixed.
+
+    :param analytic_jac: use the analytic Jacobian in nonlinear fits
+    :param linear: fit Chebyshev backgrounds with one linear least squares solve (:code:`solve_linear_bckg`) instead
+    of the nonlinear :code:`least_squares`
+    :param non_negative: see :code:`solve_linear_bckg`
+    :param residuals: objective, one of :code:`metrics.residual_modes`. 'legacy' is the nonlinear fit of the squared
+    residuals normalised by the maximum of the data, regardless of :code:`linear`.
+    """
+    y_calc_peaks = CompositeModel(peak_list, xx)()
 
-    for peak in peak_list:
-        y_calc_peaks += peak_models[peak.md_name](xx, **{name: peak.md_params[name].n for name in peak.md_params})
+    weights = residual_weights(yy, residuals)
 
     for bc_md in bckg_list:
-        if bc_md.md_name != 'Interpolation':
+        if bc_md.md_name == 'Chebyshev' and linear and residuals != 'legacy':
+            xmin, xmax = bc_md.md_params['xmin'].n, bc_md.md_params['xmax'].n
+            logger.info('fit_bckg: solving for background on [%d, %d]' % (xmin, xmax))
+
+            n_coefs = len(bc_md.func_params) - 2
+            mask, basis = chebyshev_design(xx, xmin, xmax, n_coefs)
+            bc_md.set_poly_coefs(solve_linear_bckg(basis, (yy - y_calc_peaks)[mask], weights=weights[mask],
+                                                   non_negative=non_negative))
+        elif bc_md.md_name != 'Interpolation':
             iy = (yy - y_calc_peaks)[(xx > bc_md.md_params['xmin'].n) & (xx < bc_md.md_params['xmax'].n)]
             ix = xx[(xx > bc_md.md_params['xmin'].n) & (xx < bc_md.md_params['xmax'].n)]
+            iw = weights[(xx > bc_md.md_params['xmin'].n) & (xx < bc_md.md_params['xmax'].n)]
 
             logger.info('fit_bckg: refining background on [%d, %d]' % (bc_md.md_params['xmin'].n,
                                                                                          bc_md.md_params['xmax'].n))
 
-            def residuals(x, *args, **kwargs):
-                y_calc = background_models[bc_md.md_name](ix, xmin=bc_md.md_params['xmin'].n,
+            last = {'x': None, 'ycalc': None}
+
+            def calc(x):
+                # least_squares evaluates the Jacobian at the point it has just evaluated the residuals at
+                if last['x'] is not None and np.array_equal(last['x'], x):
+                    return last['ycalc']
+                last['x'], last['ycalc'] = np.copy(x), background_models[bc_md.md_name](
+                    ix, xmin=bc_md.md_params['xmin'].n, xmax=bc_md.md_params['xmax'].n,
+                    **{'c%d' % ii: val for ii, val in enumerate(x)})
+                return last['ycalc']
+
+            def fun(x, *args, **kwargs):
+                if residuals == 'legacy':
+                    return ((iy - calc(x)) / np.max(iy)) ** 2
+                return iw * (iy - calc(x))
+
+            def jacobian(x, *args, **kwargs):
+                jac = background_jacobians[bc_md.md_name](ix, xmin=bc_md.md_params['xmin'].n,
                                                           xmax=bc_md.md_params['xmax'].n,
                                                           **{'c%d' % ii: val for ii, val in enumerate(x)})
-                return ((iy - y_calc) / np.max(iy)) ** 2
+                jac = np.stack([jac['c%d' % ii] for ii in range(len(x))], axis=1)
+                if residuals == 'legacy':
+                    # d/dx ((iy - ycalc) / max(iy))**2
+                    return (-2. * (iy - calc(x)) / np.max(iy) ** 2)[:, np.newaxis] * jac
+                return -iw[:, np.newaxis] * jac
 
             x0 = bc_md.func_params
             x0.pop('xmin')
             x0.pop('xmax')
             x0 = [x0[k] for k in sorted(x0.keys())]
 
-            opt_result = least_squares(residuals, x0=x0, ftol=1e-12, xtol=1e-12, gtol=1e-12, max_nfev=1000)
+            opt_kwargs = dict() if residuals == 'legacy' else {'x_scale': 'jac'}
+            if analytic_jac and bc_md.md_name in background_jacobians:
+                opt_kwargs['jac'] = jacobian
+            opt_result = least_squares(fun, x0=x0, ftol=1e-12, xtol=1e-12, gtol=1e-12, max_nfev=1000, **opt_kwargs)
             bc_md.set_poly_coefs(opt_result.x)
         else:
             interp_xs = xx.copy()
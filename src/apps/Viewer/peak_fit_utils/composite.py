@@ -0,0 +1,214 @@
+"""
+Vectorized evaluation of a sum of peaks.
+
+:code:`CompositeModel` evaluates all peaks of a list at once on a (peaks x points) grid instead of calling the
+functions of :code:`models.peak_models` peak by peak. Gaussian, Lorentzian and pseudo-Voigt peaks are all written as
+pseudo-Voigt peaks: a Gaussian is one with fraction 0 and the Gaussian sigma not rescaled, a Lorentzian one with
+fraction 1. Parameters are kept in a (4 x peaks) table with the rows amplitude, center, sigma, fraction; the refined
+ones are read from and written to one flat vector. Work buffers are allocated once, so the number of numpy calls per
+evaluation does not depend on the number of peaks.
+"""
+import numpy as np
+
+
+param_names = ('amplitude', 'center', 'sigma', 'fraction')
+param_defaults = (1.0, 0.0, 1.0, 0.5)
+
+# model -> (scale of the Gaussian sigma, fixed fraction or None if the model has one)
+_shapes = {
+    'Gaussian': (1., 0.),
+    'Lorentzian': (1., 1.),
+    'PseudoVoigt': (1. / np.sqrt(2. * np.log(2.)), None),
+}
+
+
+class CompositeModel:
+    def __init__(self, peak_list, xx, refine=None):
+        """
+        :param peak_list: list of :code:`PeakData`
+        :param xx: points to evaluate the peaks at
+        :param refine: per peak, the names of the parameters in the flat vector. By default the parameters that have
+        their refinement flag set, in the order of :code:`md_p_refine`.
+        """
+        for peak in peak_list:
+            if peak.md_name not in _shapes:
+                raise ValueError('CompositeModel does not support peak model %s' % peak.md_name)
+
+        self.peak_list = peak_list
+        self.xx = np.asarray(xx, dtype=np.float64)
+        n_peaks, n_points = len(peak_list), self.xx.shape[0]
+
+        self.params = np.empty((len(param_names), n_peaks))
+        self.k_g = np.empty((n_peaks, 1))
+        for jj, peak in enumerate(peak_list):
+            # read from the parameter records in one go, not through the dict views
+            values = dict(zip(peak._layout.names, zip(peak._rec['n'].tolist(), peak._rec['has_value'].tolist())))
+            k_g, fraction = _shapes[peak.md_name]
+            self.k_g[jj] = k_g
+            for ii, (name, default) in enumerate(zip(param_names, param_defaults)):
+                value, present = values.get(name, (default, False))
+                self.params[ii, jj] = value if present else default
+            if fraction is not None:
+                self.params[3, jj] = fraction
+
+        if refine is None:
+            refine = [[name for name, flag in zip(peak._layout.names, peak._rec['refine'].tolist()) if flag > 0]
+                      for peak in peak_list]
+        # (peak position, parameter name) for every item of the flat vector
+        self.refined = [(jj, name) for jj, names in enumerate(refine) for name in names]
+        for jj, name in self.refined:
+            if name not in param_names or (name == 'fraction' and _shapes[peak_list[jj].md_name][1] is not None):
+                raise ValueError('Parameter %s of peak model %s can not be refined by CompositeModel' %
+                                 (name, peak_list[jj].md_name))
+        rows = np.array([param_names.index(name) for _, name in self.refined], dtype=np.int64)
+        cols = np.array([jj for jj, _ in self.refined], dtype=np.int64)
+        self._flat_ids = rows * n_peaks + cols
+        # parameter row -> (positions in the flat vector, peaks)
+        self._jac_ids = {ii: (np.flatnonzero(rows == ii), cols[rows == ii]) for ii in range(len(param_names))
+                         if np.any(rows == ii)}
+
+        # work buffers: unit amplitude peak shapes and their derivatives, recomputed when the parameters change
+        self._x = None
+        self._dx = np.empty((n_peaks, n_points))
+        self._g = np.empty((n_peaks, n_points))
+        self._l = np.empty((n_peaks, n_points))
+        self._shape = np.empty((n_peaks, n_points))
+        self._tmp = np.empty((n_peaks, n_points))
+        self._d_shape = {ii: np.empty((n_peaks, n_points)) for ii in (1, 2, 3)}
+        self._d_valid = False
+        self._peaks = np.empty((n_peaks, n_points))
+        self._sum = np.empty(n_points)
+        # transposed, so that the derivatives are written as contiguous rows
+        self._jac = np.empty((len(self.refined), n_points))
+
+    @property
+    def x0(self):
+        """
+        Current values of the refined parameters as a flat vector
+        """
+        return self.params.flat[self._flat_ids].copy()
+
+    @property
+    def bounds(self):
+        """
+        (lower, upper) bounds of the refined parameters, shape (2, len(x0)), as :code:`least_squares` takes them
+        """
+        return np.array([self.peak_list[jj].md_p_bounds[name] for jj, name in self.refined],
+                        dtype=np.float64).reshape(-1, 2).T
+
+    def set_x(self, x):
+        if self._x is not None and np.array_equal(self._x, x):
+            return
+        self.params.flat[self._flat_ids] = x
+        self._x = np.array(x, dtype=np.float64)
+        self._update_shapes()
+
+    def set_amplitudes(self, ids, amplitudes):
+        """
+        Sets the amplitudes of the peaks at positions :code:`ids` without recomputing the peak shapes.
+        """
+        self.params[0, ids] = amplitudes
+
+    def _update_shapes(self):
+        _, center, sigma, fraction = (row[:, np.newaxis] for row in self.params)
+        sigma_g = sigma * self.k_g
+        dx, g, l, tmp = self._dx, self._g, self._l, self._tmp
+
+        np.subtract(self.xx[np.newaxis, :], center, out=dx)
+        # Gaussian: exp(-dx^2 / (2 sigma_g^2)) / (sqrt(2 pi) sigma_g)
+        np.square(dx, out=g)
+        np.multiply(g, -0.5 / sigma_g ** 2, out=g)
+        np.exp(g, out=g)
+        np.multiply(g, 1. / (np.sqrt(2. * np.pi) * sigma_g), out=g)
+        # Lorentzian: 1 / ((1 + (dx / sigma)^2) pi sigma)
+        np.multiply(dx, 1. / sigma, out=tmp)
+        np.square(tmp, out=tmp)
+        np.add(tmp, 1., out=tmp)
+        np.multiply(tmp, np.pi * sigma, out=l)
+        np.reciprocal(l, out=l)
+        # (1 - fraction) * g + fraction * l
+        np.multiply(g, 1. - fraction, out=self._shape)
+        self._shape += fraction * l
+
+        self._d_valid = False
+
+    def _update_derivatives(self):
+        _, center, sigma, fraction = (row[:, np.newaxis] for row in self.params)
+        sigma_g = sigma * self.k_g
+        dx, g, l, tmp = self._dx, self._g, self._l, self._tmp
+        d_c, d_s, d_f = self._d_shape[1], self._d_shape[2], self._d_shape[3]
+
+        # d/dcenter: (1 - f) g dx / sigma_g^2 + f l 2 dx / (sigma^2 (1 + u^2)), 1 / (1 + u^2) = pi sigma l
+        np.multiply(g, dx, out=d_c)
+        np.multiply(d_c, (1. - fraction) / sigma_g ** 2, out=d_c)
+        np.multiply(l, l, out=tmp)
+        np.multiply(tmp, dx, out=tmp)
+        d_c += tmp * (fraction * 2. * np.pi / sigma)
+
+        # d/dsigma: (1 - f) k_g g (dx^2 / sigma_g^3 - 1 / sigma_g) + f l (u^2 - 1) / (sigma (1 + u^2))
+        np.square(dx, out=d_s)
+        np.multiply(d_s, 1. / sigma_g ** 3, out=d_s)
+        d_s -= 1. / sigma_g
+        np.multiply(d_s, g, out=d_s)
+        np.multiply(d_s, (1. - fraction) * self.k_g, out=d_s)
+        # (u^2 - 1) / (1 + u^2) = 1 - 2 / (1 + u^2) = 1 - 2 pi sigma l
+        np.multiply(l, -2. * np.pi * sigma, out=tmp)
+        tmp += 1.
+        np.multiply(tmp, l, out=tmp)
+        d_s += tmp * (fraction / sigma)
+
+        np.subtract(l, g, out=d_f)
+
+        self._d_valid = True
+
+    def peaks(self, x=None):
+        """
+        :return: (peaks x points) grid of the peak functions. The array is a work buffer, overwritten by the next call.
+        """
+        if x is not None:
+            self.set_x(x)
+        elif self._x is None:
+            self._x = self.x0
+            self._update_shapes()
+        np.multiply(self._shape, self.params[0][:, np.newaxis], out=self._peaks)
+        return self._peaks
+
+    def shapes(self, x=None):
+        """
+        :return: (peaks x points) grid of the peak functions with amplitude 1, a work buffer
+        """
+        if x is not None:
+            self.set_x(x)
+        elif self._x is None:
+            self._x = self.x0
+            self._update_shapes()
+        return self._shape
+
+    def __call__(self, x=None):
+        """
+        :return: sum of the peaks, a work buffer
+        """
+        return np.dot(self.params[0], self.shapes(x), out=self._sum)
+
+    def jacobian(self, x=None):
+        """
+        :return: (points x refined parameters) derivatives of the sum of the peaks, a transposed view of a work buffer
+        """
+        self.shapes(x)
+        if not self._d_valid:
+            self._update_derivatives()
+
+        amplitude = self.params[0]
+        for ii, (pos, cols) in self._jac_ids.items():
+            if ii == 0:
+                self._jac[pos] = self._shape[cols]
+            else:
+                self._jac[pos] = self._d_shape[ii][cols] * amplitude[cols, np.newaxis]
+        return self._jac.T
+
+    def write_back(self, x, std):
+        """
+        Sets the refined parameters of the peaks to :code:`x` with uncertainties :code:`std`.
+        """
+        for (jj, name), val, err in zip(self.refined, x, std):
+            self.peak_list[jj]._set_value(name, val, err)
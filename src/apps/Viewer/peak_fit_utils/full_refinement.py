@@ -8,13 +8,15 @@ from peak_fit_utils.peak_refinement import fit_peaks
 logger = logging.getLogger('peak_fit_utils')
 
 
-def fit_to_precision(peak_list, bckg_list, xx, yy, max_cycles=10, min_chi_change=0.1):
+def fit_to_precision(peak_list, bckg_list, xx, yy, max_cycles=10, min_chi_change=0.1, varpro_min_peaks=None,
+                     residuals='poisson'):
     chi2, peak_list = upd_metrics(peak_list, bckg_list, xx, yy)
     cond, ii = True, 1
 
     while cond:
-        chi2_, bckg_list, peak_list = fit_bckg(peak_list, bckg_list, xx, yy)
-        chi2_, bckg_list, peak_list = fit_peaks(peak_list, bckg_list, xx, yy)
+        chi2_, bckg_list, peak_list = fit_bckg(peak_list, bckg_list, xx, yy, residuals=residuals)
+        chi2_, bckg_list, peak_list = fit_peaks(peak_list, bckg_list, xx, yy, varpro_min_peaks=varpro_min_peaks,
+                                                residuals=residuals)
 
         if 0 < (chi2 - chi2_) / chi2_ < min_chi_change:
             cond = False
@@ -1,7 +1,41 @@
 import numpy as np
 from uncertainties import ufloat
 
-from peak_fit_utils.models import peak_models, background_models
+from peak_fit_utils.models import background_models
+from peak_fit_utils.composite import CompositeModel
+
+
+# objectives of the peak and background fits:
+# legacy: squared residuals (yy_o - yy_c) ** 2 are handed to least_squares, which squares them again
+# raw: residuals yy_o - yy_c
+# poisson: residuals (yy_o - yy_c) / sqrt(yy_o)
+residual_modes = ('legacy', 'raw', 'poisson')
+
+
+def residual_weights(yy, mode):
+    """
+    :param yy: measured counts
+    :param mode: one of :code:`residual_modes`
+    :return: weights of the residuals yy_o - yy_c, 1 / sqrt(yy) with counts below 1 taken as 1 for 'poisson', ones
+    otherwise
+    """
+    if mode not in residual_modes:
+        raise ValueError('Residual mode should be one of %s, got %s' % (str(residual_modes), mode))
+    if mode == 'poisson':
+        return 1. / np.sqrt(np.maximum(yy, 1.))
+    return np.ones(yy.shape)
+
+
+def param_std(jac, res, mode):
+    """
+    Standard deviations of the refined parameters from the Jacobian of the weighted residuals :code:`res` at the
+    optimum. With 'poisson' weights are 1 / sigma of the data, otherwise the covariance is scaled by the residual
+    variance.
+    """
+    cov = np.linalg.pinv(jac.T @ jac)
+    if mode != 'poisson':
+        cov *= np.sum(res ** 2) / max(res.shape[0] - jac.shape[1], 1)
+    return np.sqrt(np.abs(np.diagonal(cov)))
 
 
 def metrics(yy_o, yy_c):
@@ -15,13 +49,10 @@ def upd_metrics(peak_list, bckg_list, xx, yy):
     for bc_md in bckg_list:
         yy_calc_bckg += background_models[bc_md.md_name](xx, **bc_md.func_params)
 
-    y_calc_peaks = np.zeros(yy.shape)
-    for peak in peak_list:
-        y_calc_peaks += peak_models[peak.md_name](xx, **{name: peak.md_params[name].n for name in peak.md_params})
+    y_calc_peaks = CompositeModel(peak_list, xx)()
 
     for peak in peak_list:
-        xmin, xmax = peak.md_params['center'].n - peak.md_params['base'].n * peak.md_params['sigma'].n, \
-                     peak.md_params['center'].n + peak.md_params['base'].n * peak.md_params['sigma'].n
+        xmin, xmax = peak.l_b, peak.r_b
 
         mcs = metrics(
             yy[(xx > xmin) & (xx < xmax)],
@@ -38,8 +69,8 @@ def upd_metrics(peak_list, bckg_list, xx, yy):
         y_o_w_bg = np.array([])
         for bc_md in bckg_list:
             y_c_w_bg = np.concatenate([y_c_w_bg, (y_calc_peaks + yy_calc_bckg)[
-                (xx > bc_md.md_params['xmin']) & (xx < bc_md.md_params['xmax'])]])
+                (xx > bc_md.md_params['xmin'].n) & (xx < bc_md.md_params['xmax'].n)]])
             y_o_w_bg = np.concatenate([y_o_w_bg, yy[
-                (xx > bc_md.md_params['xmin']) & (xx < bc_md.md_params['xmax'])]])
+                (xx > bc_md.md_params['xmin'].n) & (xx < bc_md.md_params['xmax'].n)]])
         total_chi2 = metrics(y_o_w_bg, y_c_w_bg)['chi2']
     return total_chi2, peak_list
\ No newline at end of file
@@ -15,6 +15,43 @@ def pseudo_voigt(x, amplitude=1.0, center=0.0, sigma=1.0, fraction=0.5, **kwargs
             fraction * lorentzian(x, amplitude, center, sigma))
 
 
+def gaussian_jac(x, amplitude=1.0, center=0.0, sigma=1.0, **kwargs):
+    """
+    :return: dict parameter name -> partial derivative of :code:`gaussian` over x
+    """
+    dx = x - center
+    shape = np.exp(-dx ** 2 / (2. * sigma ** 2)) / (np.sqrt(2 * np.pi) * sigma)
+    y = amplitude * shape
+    return {'amplitude': shape,
+            'center': y * dx / sigma ** 2,
+            'sigma': y * (dx ** 2 / sigma ** 3 - 1. / sigma)}
+
+
+def lorentzian_jac(x, amplitude=1.0, center=0.0, sigma=1.0, **kwargs):
+    """
+    :return: dict parameter name -> partial derivative of :code:`lorentzian` over x
+    """
+    u = (x - center) / sigma
+    shape = 1. / ((1 + u ** 2) * np.pi * sigma)
+    y = amplitude * shape
+    return {'amplitude': shape,
+            'center': y * 2. * u / (sigma * (1 + u ** 2)),
+            'sigma': y * (u ** 2 - 1.) / (sigma * (1 + u ** 2))}
+
+
+def pseudo_voigt_jac(x, amplitude=1.0, center=0.0, sigma=1.0, fraction=0.5, **kwargs):
+    """
+    :return: dict parameter name -> partial derivative of :code:`pseudo_voigt` over x
+    """
+    k_g = 1. / np.sqrt(2. * np.log(2.))
+    jac_g = gaussian_jac(x, amplitude, center, sigma * k_g)
+    jac_l = lorentzian_jac(x, amplitude, center, sigma)
+    return {'amplitude': (1 - fraction) * jac_g['amplitude'] + fraction * jac_l['amplitude'],
+            'center': (1 - fraction) * jac_g['center'] + fraction * jac_l['center'],
+            'sigma': (1 - fraction) * k_g * jac_g['sigma'] + fraction * jac_l['sigma'],
+            'fraction': amplitude * (jac_l['amplitude'] - jac_g['amplitude'])}
+
+
 def ch_polyval(args, x):
     return args[0] + x * args[1] + \
            (2. * x ** 2 - 1) * args[2] + \
@@ -39,14 +76,35 @@ def polynomial(x, xmin=0, xmax=200, c0=0, c1=0, c2=0, c3=0, c4=0, c5=0, c6=0, c7
     return y
 
 
+def polynomial_jac(x, xmin=0, xmax=200, c0=0, c1=0, c2=0, c3=0, c4=0, c5=0, c6=0, c7=0, c8=0, c9=0, c10=0, c11=0):
+    """
+    :return: dict parameter name -> partial derivative of :code:`polynomial` over x for the coefficients c0..c11, zero
+    where the polynomial is cut off
+    """
+    x2 = (x - xmin) / (xmax - xmin)
+    basis = np.polynomial.chebyshev.chebvander(x2, 11)
+    basis[(x2 <= 0.) | (x2 >= 1.) | (polynomial(x, xmin, xmax, c0, c1, c2, c3, c4, c5, c6, c7, c8, c9, c10, c11) <= 0)] = 0.
+    return {'c%d' % ii: basis[:, ii] for ii in range(12)}
+
+
 peak_models = {
     'Gaussian': gaussian,
     'Lorentzian': lorentzian,
     'PseudoVoigt': pseudo_voigt
 }
 
+peak_jacobians = {
+    'Gaussian': gaussian_jac,
+    'Lorentzian': lorentzian_jac,
+    'PseudoVoigt': pseudo_voigt_jac
+}
+
 background_models = {
     'Chebyshev': polynomial,
     # 'Interpolation': lambda x, *args, **kwargs: np.zeros(x.shape)
     'Interpolation': lambda x, *args, **kwargs: kwargs['func'](x)
 }
+
+background_jacobians = {
+    'Chebyshev': polynomial_jac
+}
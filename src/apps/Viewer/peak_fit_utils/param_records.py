@@ -0,0 +1,181 @@
+"""
+Compact storage of model parameters.
+
+Every peak keeps its parameters in one structured numpy array with a record per parameter (value, std, bounds,
+refinement flag), instead of three dicts of :code:`ufloat` objects. The parameter names and their positions in the
+array are the same for all peaks of a model and are kept once, in a :code:`ParamLayout`.
+
+:code:`ParamValues`, :code:`ParamBounds` and :code:`ParamRefine` are dict-like views of the array that behave like
+the dicts they replace: values are read and written as :code:`ufloat`, bounds as (lower, upper) tuples, refinement
+flags as bools.
+"""
+import numpy as np
+from collections.abc import MutableMapping
+from uncertainties import ufloat
+
+
+# refine: -1 if the parameter has no refinement flag
+param_dtype = np.dtype([('n', np.float64), ('s', np.float64), ('lb', np.float64), ('ub', np.float64),
+                        ('refine', np.int8), ('has_value', np.bool_), ('has_bounds', np.bool_)])
+
+
+class ParamLayout:
+    """
+    Names of the parameters of one model and their positions in the parameter records, shared by all peaks of the
+    model. Names are only ever appended, so a position stays valid.
+    """
+    __slots__ = ('model', 'names', 'slots')
+    _layouts = dict()
+
+    def __init__(self, model):
+        self.model = model
+        self.names = []
+        self.slots = dict()
+
+    @classmethod
+    def of(cls, model, names=()):
+        """
+        :return: the layout of :code:`model`, with :code:`names` added to it if they are not there yet
+        """
+        layout = cls._layouts.get(model)
+        if layout is None:
+            layout = cls._layouts.setdefault(model, cls(model))
+        for name in names:
+            layout.slot(name, add=True)
+        return layout
+
+    def slot(self, name, add=False):
+        """
+        :return: position of the parameter :code:`name`, None if the layout does not have it and :code:`add` is False
+        """
+        result = self.slots.get(name)
+        if result is None and add:
+            result = self.slots[name] = len(self.names)
+            self.names.append(name)
+        return result
+
+    def empty(self):
+        """
+        :return: parameter records without values, bounds and refinement flags for all names of the layout
+        """
+        result = np.zeros(len(self.names), dtype=param_dtype)
+        result['refine'] = -1
+        return result
+
+    def __reduce__(self):
+        # unpickled layouts (e.g. in worker processes) are the shared layout of the model, not a copy
+        return ParamLayout.of, (self.model, tuple(self.names))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class _ParamView(MutableMapping):
+    """
+    Dict-like view of one aspect of the parameter records of :code:`owner`, which has :code:`_layout` and
+    :code:`_rec` and a :code:`_record(name)` method returning the array and position to write to.
+    """
+    __slots__ = ('_owner', )
+
+    def __init__(self, owner):
+        self._owner = owner
+
+    def _present(self, rec):
+        raise NotImplementedError
+
+    def _get(self, rec, ii):
+        raise NotImplementedError
+
+    def _set(self, rec, ii, val):
+        raise NotImplementedError
+
+    def _clear(self, rec, ii):
+        raise NotImplementedError
+
+    def _slot(self, name):
+        rec = self._owner._rec
+        ii = self._owner._layout.slots.get(name)
+        if ii is None or ii >= rec.shape[0] or not self._present(rec)[ii]:
+            raise KeyError(name)
+        return rec, ii
+
+    def __getitem__(self, name):
+        return self._get(*self._slot(name))
+
+    def __setitem__(self, name, val):
+        rec, ii = self._owner._record(name)
+        self._set(rec, ii, val)
+
+    def __delitem__(self, name):
+        self._clear(*self._slot(name))
+
+    def __iter__(self):
+        names = self._owner._layout.names
+        return iter([names[ii] for ii in np.flatnonzero(self._present(self._owner._rec))])
+
+    def __len__(self):
+        return int(np.count_nonzero(self._present(self._owner._rec)))
+
+    def clear(self):
+        rec = self._owner._rec
+        for ii in np.flatnonzero(self._present(rec)):
+            self._clear(rec, ii)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class ParamValues(_ParamView):
+    __slots__ = ()
+
+    def _present(self, rec):
+        return rec['has_value']
+
+    def _get(self, rec, ii):
+        return ufloat(float(rec['n'][ii]), float(rec['s'][ii]))
+
+    def _set(self, rec, ii, val):
+        if hasattr(val, 'nominal_value'):
+            rec['n'][ii], rec['s'][ii] = val.nominal_value, val.std_dev
+        else:
+            rec['n'][ii], rec['s'][ii] = val, np.nan
+        rec['has_value'][ii] = True
+
+    def _clear(self, rec, ii):
+        rec['n'][ii], rec['s'][ii], rec['has_value'][ii] = np.nan, np.nan, False
+
+
+class ParamBounds(_ParamView):
+    __slots__ = ()
+
+    def _present(self, rec):
+        return rec['has_bounds']
+
+    def _get(self, rec, ii):
+        return rec['lb'][ii].item(), rec['ub'][ii].item()
+
+    def _set(self, rec, ii, val):
+        rec['lb'][ii], rec['ub'][ii] = val
+        rec['has_bounds'][ii] = True
+
+    def _clear(self, rec, ii):
+        rec['lb'][ii], rec['ub'][ii], rec['has_bounds'][ii] = np.nan, np.nan, False
+
+
+class ParamRefine(_ParamView):
+    __slots__ = ()
+
+    def _present(self, rec):
+        return rec['refine'] != -1
+
+    def _get(self, rec, ii):
+        return bool(rec['refine'][ii])
+
+    def _set(self, rec, ii, val):
+        rec['refine'][ii] = bool(val)
+
+    def _clear(self, rec, ii):
+        rec['refine'][ii] = -1
@@ -1,11 +1,10 @@
-from multiprocessing import Pool, cpu_count
-from scipy.optimize import least_squares
-from uncertainties import ufloat
+from scipy.optimize import least_squares, lsq_linear
 import numpy as np
 import logging
 
-from peak_fit_utils.models import peak_models, background_models
-from peak_fit_utils.metrics import upd_metrics
+from peak_fit_utils.models import background_models
+from peak_fit_utils.composite import CompositeModel
+from peak_fit_utils.metrics import upd_metrics, residual_weights, param_std
 from utils import log_ex_time
 
 logger = logging.getLogger('peak_fit_utils')
@@ -33,8 +32,7 @@ def get_peak_intervals(peak_list):
         return inter
 
     overlap_intervals = [
-        [peak.md_params['center'].n - peak.md_params['overlap_base'].n * peak.md_params['sigma'].n,
-            peak.md_params['center'].n + peak.md_params['overlap_base'].n * peak.md_params['sigma'].n]
+        [peak.cx - peak.overlap_base * peak.sigma, peak.cx + peak.overlap_base * peak.sigma]
         for peak in peak_list
     ]
 
@@ -44,75 +42,150 @@ def get_peak_intervals(peak_list):
     for l, r in overlap_intervals:
         tmp = []
         for ii, peak in enumerate(peak_list):
-            if l < peak.md_params['center'].n < r:
-                tmp.append([
-                    peak.md_params['center'].n - peak.md_params['base'].n * peak.md_params['sigma'].n,
-                    peak.md_params['center'].n + peak.md_params['base'].n * peak.md_params['sigma'].n,
-                ii])
+            if l < peak.cx < r:
+                tmp.append([peak.l_b, peak.r_b, ii])
         result.extend(recursive_merge(tmp, 0))
 
     return list(sorted(result, key=lambda x: x[0]))
 
 
 class IntervalOptimizer:
-    def __init__(self, peak_list, xdata, ydata, optimizer):
+    def __init__(self, peak_list, xdata, ydata, optimizer, analytic_jac=True, varpro_min_peaks=None, residuals='poisson',
+                 weights=None):
+        """
+        :param analytic_jac: pass the analytic Jacobian of the peak models to the optimizer, otherwise the optimizer
+        estimates it by finite differences
+        :param varpro_min_peaks: refine amplitudes by variable projection (see :code:`_fit_varpro`) in intervals with at
+        least this many peaks with refined amplitudes, None never does
+        :param residuals: objective, one of :code:`metrics.residual_modes`. 'legacy' is only kept to reproduce old
+        results, with variable projection it is the same as 'raw'.
+        :param weights: weights of the residuals over :code:`xdata`, by default :code:`residual_weights(ydata)`. Pass
+        the weights of the measured spectrum if :code:`ydata` has the background subtracted.
+        """
         self.peak_list = peak_list
         self.xdata = xdata
         self.ydata = ydata
         self.opt = optimizer
+        self.analytic_jac = analytic_jac
+        self.varpro_min_peaks = varpro_min_peaks
+        self.residuals = residuals
+        self.weights = residual_weights(ydata, residuals) if weights is None else weights
 
     def __call__(self, interval):
         ll, rr, *peak_ids = interval
         logger.info('IntervalOptimizer.__call__: refining peaks (%s) on [%d, %d]' % (str(peak_ids), ll, rr))
         iy = self.ydata[(self.xdata > ll) & (self.xdata < rr)]
         ix = self.xdata[(self.xdata > ll) & (self.xdata < rr)]
+        iw = self.weights[(self.xdata > ll) & (self.xdata < rr)]
         iy, ix = iy.astype(np.float64), ix.astype(np.float64)
 
-        iy_c_static = np.zeros(iy.shape)
-        for ii in range(len(self.peak_list)):
-            if ii not in peak_ids:
-                iy_c_static += peak_models[self.peak_list[ii].md_name](ix,
-                                                                       **{name: self.peak_list[ii].md_params[name].n for name
-                                                                     in
-                                                                     self.peak_list[ii].md_params})
-        iy -= iy_c_static
-
-        refined_params = {ii: [k for k in self.peak_list[ii].md_p_refine.keys() if
-                               self.peak_list[ii].md_p_refine[k]] for ii in peak_ids}
-        kwds = {ii: {k: self.peak_list[ii].md_params[k].n
-                     for k in self.peak_list[ii].md_p_refine.keys() if not self.peak_list[ii].md_p_refine[k]}
-                for ii in peak_ids}
+        others = [peak for ii, peak in enumerate(self.peak_list) if ii not in peak_ids]
+        if others:
+            iy -= CompositeModel(others, ix)()
 
-        def residuals(x, *args, **kwargs):
-            ycalc = np.zeros(iy.shape)
-            shift = 0
-            for ii in peak_ids:
-                x_ = x[shift:]
-                ycalc += peak_models[self.peak_list[ii].md_name](ix, **(kwds[ii]), **{name: val for (name, val) in
-                                                                                      zip(refined_params[ii], x_)})
-                shift += len(refined_params[ii])
-            return (iy - ycalc)**2
-
-        x0 = tuple([self.peak_list[ii].md_params[k].n for ii in peak_ids for k in self.peak_list[ii].md_p_refine.keys()
-              if self.peak_list[ii].md_p_refine[k]])
-        bounds = np.array([self.peak_list[ii].md_p_bounds[k] for ii in peak_ids for k in self.peak_list[ii].md_p_refine.keys()
-              if self.peak_list[ii].md_p_refine[k]]).T
-
-        opt_result = self.opt(residuals, x0=x0, bounds=bounds)
-        cov = np.sqrt(np.diagonal(np.linalg.inv(opt_result.jac.T.dot(opt_result.jac))))
-
-        idx = 0
-        for ii in peak_ids:
-            for k in self.peak_list[ii].md_p_refine.keys():
-                if self.peak_list[ii].md_p_refine[k]:
-                    self.peak_list[ii].md_params[k] = ufloat(opt_result.x[idx], cov[idx])
-                    idx += 1
+        peaks = [self.peak_list[ii] for ii in peak_ids]
+        if self.varpro_min_peaks is not None and \
+                sum(peak.md_p_refine.get('amplitude', False) for peak in peaks) >= max(1, self.varpro_min_peaks):
+            self._fit_varpro(ix, iy, iw, peaks)
+            return self.peak_list
+
+        model = CompositeModel(peaks, ix)
 
+        def residuals(x, *args, **kwargs):
+            if self.residuals == 'legacy':
+                return (iy - model(x))**2
+            return iw * (iy - model(x))
+
+        def jacobian(x, *args, **kwargs):
+            if self.residuals == 'legacy':
+                # d/dx (iy - ycalc)**2
+                return (-2. * (iy - model(x)))[:, np.newaxis] * model.jacobian(x)
+            return -iw[:, np.newaxis] * model.jacobian(x)
+
+        # parameters differ by orders of magnitude (amplitudes vs fractions), scaling by the Jacobian columns evens
+        # out the trust region. The legacy objective keeps the old unscaled steps.
+        opt_kwargs = dict() if self.residuals == 'legacy' else {'x_scale': 'jac'}
+        if self.analytic_jac:
+            opt_kwargs['jac'] = jacobian
+        opt_result = self.opt(residuals, x0=model.x0, bounds=model.bounds, **opt_kwargs)
+        if self.residuals == 'legacy':
+            cov = np.sqrt(np.diagonal(np.linalg.inv(opt_result.jac.T.dot(opt_result.jac))))
+        else:
+            cov = param_std(opt_result.jac, opt_result.fun, self.residuals)
+
+        model.write_back(opt_result.x, cov)
         return self.peak_list
 
+    def _fit_varpro(self, ix, iy, iw, peaks):
+        """
+        Variable projection refinement. Amplitudes enter the peak models linearly, so the amplitudes of the peaks that
+        refine them are not given to the optimizer: for every trial set of the other parameters (centers, sigmas,
+        fractions) they are the solution of a weighted linear least squares problem within the amplitude bounds. The
+        optimizer minimizes the weighted residuals of that solution, with the Kaufman approximation of the projected
+        Jacobian.
+        """
+        lin_ids = np.array([jj for jj, peak in enumerate(peaks) if peak.md_p_refine.get('amplitude', False)],
+                           dtype=np.int64)
+        fixed_ids = np.array([jj for jj in range(len(peaks)) if jj not in lin_ids], dtype=np.int64)
+        model = CompositeModel(peaks, ix, refine=[[k for k, v in peak.md_p_refine.items() if v and k != 'amplitude']
+                                                  for peak in peaks])
+        a_bounds = np.array([peaks[jj].md_p_bounds['amplitude'] for jj in lin_ids], dtype=np.float64).T
+
+        last = {'x': None, 'w_shapes': None, 'q': None}
+
+        def solve(x):
+            """
+            Sets the amplitudes of the model to the linear least squares solution for the parameters :code:`x`. The
+            solution goes through a QR decomposition of the weighted shapes, which :code:`jacobian` reuses for the
+            projection.
+
+            :return: (weighted peak shapes of the peaks with refined amplitudes, (points x peaks), orthonormal basis
+            of their span)
+            """
+            # least_squares evaluates the Jacobian at the point it has just evaluated the residuals at
+            if last['x'] is not None and np.array_equal(last['x'], x):
+                return last['w_shapes'], last['q']
+            shapes = model.shapes(x)
+            w_shapes = (shapes[lin_ids] * iw).T
+            w_y = iw * (iy - model.params[0, fixed_ids] @ shapes[fixed_ids])
+            q, r = np.linalg.qr(w_shapes)
+            amps = np.linalg.lstsq(r, q.T @ w_y, rcond=None)[0]
+            if np.any(amps < a_bounds[0]) or np.any(amps > a_bounds[1]):
+                amps = lsq_linear(w_shapes, w_y, bounds=a_bounds, method='bvls').x
+            model.set_amplitudes(lin_ids, amps)
+            last.update(x=np.copy(x), w_shapes=w_shapes, q=q)
+            return w_shapes, q
+
+        def residuals(x, *args, **kwargs):
+            solve(x)
+            return iw * (iy - model(x))
+
+        def jacobian(x, *args, **kwargs):
+            _, q = solve(x)
+            d = iw[:, np.newaxis] * model.jacobian(x)
+            return -(d - q @ (q.T @ d))
+
+        x0 = model.x0
+        if x0.shape[0] > 0:
+            opt_kwargs = {'x_scale': 'jac'}
+            if self.analytic_jac:
+                opt_kwargs['jac'] = jacobian
+            x_opt = self.opt(residuals, x0=x0, bounds=model.bounds, **opt_kwargs).x
+        else:
+            x_opt = x0
+
+        # uncertainties from the full Jacobian over all refined parameters
+        w_shapes, _ = solve(x_opt)
+        jac = np.concatenate((iw[:, np.newaxis] * model.jacobian(x_opt), w_shapes), axis=1)
+        std = param_std(jac, iw * (iy - model(x_opt)), self.residuals)
+
+        model.write_back(x_opt, std[:x_opt.shape[0]])
+        for kk, jj in enumerate(lin_ids):
+            peaks[jj]._set_value('amplitude', model.params[0, jj], std[x_opt.shape[0] + kk])
+
 
 @log_ex_time(logger=logger)
-def fit_peaks(peak_list, bckg_list, xx, yy):
+def fit_peaks(peak_list, bckg_list, xx, yy, analytic_jac=True, varpro_min_peaks=None, residuals='poisson'):
     intervals = get_peak_intervals(peak_list)
 
     yy_calc_bckg = np.zeros(yy.shape)
@@ -120,29 +193,20 @@ def fit_peaks(peak_list, bckg_list, xx, yy):
     for bc_md in bckg_list:
         yy_calc_bckg += background_models[bc_md.md_name](xx, **bc_md.func_params)
 
-    # parallel = True  # 22151.7 ms
-    parallel = False  # 718.5 ms
-
-    iopt = IntervalOptimizer(peak_list, xx, yy - yy_calc_bckg, least_squares)
-    if not parallel:
-        for interval in intervals:
-            try:
-                peak_list = iopt(interval)
-            except Exception as e:
-                logger.error('fit_peaks: error %s' % str(e))
-    else:
-        with Pool(cpu_count()) as p:
-            upd_peaks = p.map(iopt, intervals)
-
-        for interval, upd in zip(intervals, upd_peaks):
-            for ii in interval[2:]:
-                peak_list[ii] = upd[ii]
+    # intervals are refined one after another, multiple spectra are fitted in parallel by batch_refinement
+    iopt = IntervalOptimizer(peak_list, xx, yy - yy_calc_bckg, least_squares, analytic_jac=analytic_jac,
+                             varpro_min_peaks=varpro_min_peaks, residuals=residuals,
+                             weights=residual_weights(yy, residuals))
+    for interval in intervals:
+        try:
+            peak_list = iopt(interval)
+        except Exception as e:
+            logger.error('fit_peaks: error %s' % str(e))
 
-    peak_list = list(sorted(peak_list, key=lambda item: item.md_params['center']))
+    peak_list = list(sorted(peak_list, key=lambda item: item.cx))
 
     for peak in peak_list:
-        lb, rb = peak.md_params['center'].n - peak.md_params['base'].n * peak.md_params['sigma'].n, \
-                 peak.md_params['center'].n + peak.md_params['base'].n * peak.md_params['sigma'].n
+        lb, rb = peak.l_b, peak.r_b
 
         peak.upd_nref_params(lr_bh=np.interp([lb, rb], xx, yy_calc_bckg))
     chi2, peak_list = upd_metrics(peak_list, bckg_list, xx, yy)
@@ -0,0 +1,2 @@
+from unittests.test_models import TestJacobians
+from unittests.test_composite import TestCompositeModel
@@ -0,0 +1,48 @@
+from unittest import TestCase
+
+import numpy as np
+
+from peak_fit_utils.composite import CompositeModel
+from peak_fit_utils.PeakTrack import PeakData
+
+
+def check_composite_jacobian(xx, peak_list, refine=None, h=1e-6):
+    """
+    Compares :code:`CompositeModel.jacobian` to central finite differences of :code:`CompositeModel`.
+
+    :param refine: see :code:`CompositeModel`
+    :return: max relative deviation over all refined parameters
+    """
+    model = CompositeModel(peak_list, xx, refine=refine)
+    x0 = model.x0
+    jac = np.array(model.jacobian(x0))
+
+    result = 0.
+    for ii in range(x0.shape[0]):
+        x_up, x_down = x0.copy(), x0.copy()
+        x_up[ii] += h
+        x_down[ii] -= h
+        fd = (np.array(model(x_up)) - np.array(model(x_down))) / (2. * h)
+        result = max(result, np.max(np.abs(fd - jac[:, ii])) / np.max(np.abs(fd)))
+    return result
+
+
+class TestCompositeModel(TestCase):
+    def test_jacobian(self):
+        # overlapping peaks from Gaussian to Lorentzian, as PeakData only holds pseudo-Voigt peaks
+        xx = np.linspace(90., 110., 2001)
+        peak_list = [PeakData(0, cx, 30., cx - 0.3, cx + 0.3, cx - 2., cx + 2., 0., 0.) for cx in (99.5, 100.3, 101.)]
+        for peak, fraction in zip(peak_list, (0., 0.3, 1.)):
+            peak.md_params['fraction'] = fraction
+        refine = [('amplitude', 'center', 'sigma', 'fraction')] * len(peak_list)
+        self.assertLess(check_composite_jacobian(xx, peak_list, refine), 1e-6)
+
+    def test_write_back(self):
+        xx = np.linspace(90., 110., 201)
+        peak_list = [PeakData(0, cx, 30., cx - 0.3, cx + 0.3, cx - 2., cx + 2., 0., 0.) for cx in (99.5, 101.)]
+        model = CompositeModel(peak_list, xx, refine=[('amplitude', 'center')] * 2)
+        x = model.x0 + 0.1
+        model.write_back(x, np.full(x.shape, 0.01))
+        for (jj, name), val in zip(model.refined, x):
+            self.assertAlmostEqual(peak_list[jj].md_params[name].n, val)
+            self.assertAlmostEqual(peak_list[jj].md_params[name].s, 0.01)
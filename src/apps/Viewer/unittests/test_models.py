@@ -0,0 +1,41 @@
+from unittest import TestCase
+
+import numpy as np
+
+from peak_fit_utils.models import peak_models, peak_jacobians, background_models, background_jacobians
+
+
+def check_jacobians(h=1e-6):
+    """
+    Compares the analytic Jacobians of the models to central finite differences.
+
+    :return: {model: max relative deviation over all parameters}
+    """
+    xx = np.linspace(90., 110., 2001)
+    params = {
+        'Gaussian': {'amplitude': 30., 'center': 100.3, 'sigma': 0.4},
+        'Lorentzian': {'amplitude': 30., 'center': 100.3, 'sigma': 0.4},
+        'PseudoVoigt': {'amplitude': 30., 'center': 100.3, 'sigma': 0.4, 'fraction': 0.3},
+        'Chebyshev': {'xmin': 90., 'xmax': 110., **{'c%d' % ii: 10. / (ii + 1) for ii in range(12)}},
+    }
+    models = {**peak_models, **background_models}
+    jacobians = {**peak_jacobians, **background_jacobians}
+
+    result = dict()
+    for name, pp in params.items():
+        jac = jacobians[name](xx, **pp)
+        result[name] = 0.
+        for k in jac:
+            p_up, p_down = dict(pp), dict(pp)
+            p_up[k] += h
+            p_down[k] -= h
+            fd = (models[name](xx, **p_up) - models[name](xx, **p_down)) / (2. * h)
+            result[name] = max(result[name], np.max(np.abs(fd - jac[k])) / np.max(np.abs(fd)))
+    return result
+
+
+class TestJacobians(TestCase):
+    def test_models(self):
+        for name, deviation in check_jacobians().items():
+            with self.subTest(model=name):
+                self.assertLess(deviation, 1e-6)
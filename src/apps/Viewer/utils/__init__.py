@@ -1,3 +1,4 @@
 from .timing import log_ex_time
+from .process_pool import spawn_pool, cancel
 from .PhaseData import PhaseData
 from .script_utils import fileparts, fileparts2, fileparts3, requestFiles, read_fio, write_fio
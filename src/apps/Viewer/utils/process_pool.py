@@ -0,0 +1,23 @@
+import sys
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+def spawn_pool(n_processes):
+    """
+    Process pool with :code:`n_processes` workers. Processes are spawned rather than forked, as forking a process with
+    a running QApplication and its threads is not safe. Python 3.6 can not choose the start method of the pool and
+    uses the default of the platform, which is spawning on Windows.
+    """
+    if sys.version_info < (3, 7):
+        return ProcessPoolExecutor(max_workers=n_processes)
+    return ProcessPoolExecutor(max_workers=n_processes, mp_context=multiprocessing.get_context('spawn'))
+
+
+def cancel(futures):
+    """
+    Cancels the :code:`futures` that were not started yet, like :code:`executor.shutdown(cancel_futures=True)` does
+    from Python 3.9 on.
+    """
+    for future in futures:
+        future.cancel()
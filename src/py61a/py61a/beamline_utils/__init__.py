@@ -1,2 +1,2 @@
 from .angles import motors_to_angles
-from .fio import read_fio, write_fio
+from .fio import read_fio, write_fio, parse_fio
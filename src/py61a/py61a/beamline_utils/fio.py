@@ -1,54 +1,85 @@
+import numpy as np
 import pandas as pd
 import re
 
 
-def read_fio(f_name):
-    header = dict()
-    data = pd.DataFrame()
+param_line = re.compile(r'^(?P<key>[\w\.]+) = (?P<val>\S+)$')
+t_header_line = re.compile(r'^ Col (?P<col>[\d]+) (?P<key>[\w\.]+) (?P<type>[\w\.]+)$')
+
+
+def _float(s):
+    try:
+        return float(s)
+    except ValueError:
+        return np.nan
 
-    param_line = re.compile(r'^(?P<key>[\w\.]+) = (?P<val>[\d\.+-eE]+)\n')
-    t_header_line = re.compile(r'^ Col (?P<col>[\d]+) (?P<key>[\w\.]+) (?P<type>[\w\.]+)\n')
 
+def parse_fio(f_name):
+    """
+    Reads a .fio file in one pass. The :code:`%p` and :code:`%d` sections are located once, the parameter section is
+    parsed line by line and the data table is matched with a single regular expression over the whole section and
+    converted to float column by column. Table tokens that are not numbers become NaN, lines that do not have one
+    token per column are skipped.
+
+    :param f_name: path to the .fio file
+    :return: (dict parameter -> float, list of table column names, numpy array of shape (rows, columns))
+    """
     with open(f_name, 'r') as f:
-        lines = f.readlines()
+        text = f.read()
+
+    lines = text.split('\n')
+    p_start = lines.index('%p') + 1 if '%p' in lines else None
+    d_start = lines.index('%d') + 1 if '%d' in lines else None
 
-        for line in lines[lines.index('%p\n') + 1:]:
+    params = dict()
+    if p_start is not None:
+        p_stop = d_start if d_start is not None and d_start > p_start else len(lines)
+        for line in lines[p_start:p_stop]:
             m = param_line.match(line)
             if m:
-                header[m.group('key')] = float(m.group('val'))
+                try:
+                    params[m.group('key')] = float(m.group('val'))
+                except ValueError:
+                    pass
 
-        if not header:
-            return header, data
-
-        columns = dict()
-        for ii, line in enumerate(lines[lines.index('%d\n') + 1:]):
+    columns = dict()
+    if d_start is not None:
+        for line in lines[d_start:]:
             m = t_header_line.match(line)
             if m:
                 columns[int(m.group('col'))] = m.group('key')
             else:
                 break
+    if not columns:
+        return params, [], np.zeros((0, 0))
+
+    columns = list(columns.values())
+    table = '\n'.join(lines[d_start + len(columns):])
+    t_row_line = re.compile(r'^' + r'[^\S\n]+([\w\.+-]+)' * len(columns) + r'[^\S\n]*$', re.MULTILINE)
+    rows = t_row_line.findall(table)
+    if not rows:
+        return params, columns, np.zeros((0, len(columns)))
 
-        if not columns:
-            return header, data
+    if len(columns) == 1:
+        rows = [(row, ) for row in rows]
 
-        data = pd.DataFrame(columns=list(columns.values()))
-        # t_row_line = re.compile(r'^' + r'\s+([\d\.+-eE]+)' * len(columns) + r'\n')
-        t_row_line = re.compile(r'^' + r'\s+([\w\.+-]+)' * len(columns) + r'\n')
+    # each column is converted in one numpy call, only the columns with malformed tokens go value by value
+    values = np.empty((len(rows), len(columns)), dtype=np.float64)
+    for ii, tokens in enumerate(zip(*rows)):
+        try:
+            values[:, ii] = np.array(tokens, dtype=np.float64)
+        except ValueError:
+            values[:, ii] = np.fromiter(map(_float, tokens), dtype=np.float64, count=len(tokens))
+    return params, columns, values
 
-        def _float(s):
-            try:
-                return float(s)
-            except ValueError:
-                return None
 
-        for line in lines[lines.index('%d\n') + ii + 1:]:
-            m = t_row_line.match(line)
-            if m is not None:
-                vals = m.groups()
-                row = {columns[i + 1]: _float(vals[i]) for i in range(len(columns))}
-                data.loc[data.shape[0]] = row
+def read_fio(f_name):
+    params, columns, values = parse_fio(f_name)
+
+    if not params or not columns:
+        return params, pd.DataFrame()
 
-    return header, data
+    return params, pd.DataFrame(values, columns=columns)
 
 
 def write_fio(header, data, f_name):
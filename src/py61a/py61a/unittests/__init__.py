@@ -1,2 +1,2 @@
 from test_cryst_utils import TestBragg
-from test_beamline_utils import TestM2A
+from test_beamline_utils import TestM2A, TestParseFio
@@ -1,8 +1,10 @@
 from unittest import TestCase
+import os
+import tempfile
 
 import numpy as np
 import pandas as pd
-from py61a.beamline_utils import motors_to_angles
+from py61a.beamline_utils import motors_to_angles, parse_fio, read_fio
 
 
 class TestM2A(TestCase):
@@ -31,3 +33,35 @@ class TestM2A(TestCase):
 
     def test_orthogonal(self):
         self.assertTrue(True)
+
+
+class TestParseFio(TestCase):
+    text = '!\n! Comments\n!\n%c\nscan comment\n!\n! Parameter\n!\n%p\n' \
+           'eu.chi = 90.0\neu.x = -1.5e+01\nuser = someone\n' \
+           '!\n! Data\n!\n%d\n Col 1 eu.phi DOUBLE\n Col 2 xspress3_index INTEGER\n Col 3 eu.z DOUBLE\n' \
+           ' 0.000 1 2.5\n 45.000 2 nan\n 90.000 3 -\n ! not a row\n 135.000 4\n 180.000 5 1e-3'
+
+    def setUp(self) -> None:
+        fd, self.f_name = tempfile.mkstemp(suffix='.fio')
+        with os.fdopen(fd, 'w') as f:
+            f.write(self.text)
+
+    def tearDown(self) -> None:
+        os.remove(self.f_name)
+
+    def test_sections(self):
+        params, columns, values = parse_fio(self.f_name)
+        self.assertEqual(params, {'eu.chi': 90., 'eu.x': -15.})
+        self.assertEqual(columns, ['eu.phi', 'xspress3_index', 'eu.z'])
+        self.assertEqual(values.shape, (4, 3))
+        self.assertTrue(np.all(values[:, 1] == [1, 2, 3, 5]))
+
+    def test_malformed(self):
+        _, _, values = parse_fio(self.f_name)
+        self.assertTrue(np.all(np.isnan(values[1:3, 2])))
+        self.assertTrue(np.isclose(values[3, 2], 1e-3))
+
+    def test_read_fio(self):
+        header, data = read_fio(self.f_name)
+        self.assertEqual(list(data.columns), ['eu.phi', 'xspress3_index', 'eu.z'])
+        self.assertTrue(np.all(data['eu.phi'] == [0., 45., 90., 180.]))
@@ -0,0 +1,95 @@
+import os
+import glob
+import time
+import numpy as np
+
+from DatasetIO import P61ANexusReader
+from peak_fit_utils import BckgData
+from peak_fit_utils.batch_refinement import make_task, fit_spectrum, fit_spectra, apply_result
+from utils import spawn_pool
+
+from peak_fit import find_peak_list
+
+
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'data', 'nxs')
+
+
+def make_tasks(spectra, fit_type='prec', **kwargs):
+    """
+    :return: (tasks, peak lists the tasks were made from)
+    """
+    tasks, peak_lists = [], []
+    for idx, (xx, yy) in enumerate(spectra):
+        bc_md = BckgData('Chebyshev')
+        bc_md.md_params['xmin'] = bc_md.md_params['xmin'] + 20.
+        bc_md.md_params['xmax'] = bc_md.md_params['xmax'] - 40.
+        peak_lists.append(find_peak_list(xx, yy, idx))
+        tasks.append(make_task(idx, fit_type, xx, yy, peak_lists[-1], [bc_md], **kwargs))
+    return tasks, peak_lists
+
+
+def bench_batch(tasks, peak_lists, executor=None):
+    """
+    Fits :code:`tasks` in this process or on :code:`executor`, a pool that is already running, like the session pool
+    of the Viewer.
+
+    :return: (seconds, {idx: peak centers})
+    """
+    t0 = time.perf_counter()
+    if executor is None:
+        results = [fit_spectrum(task) for task in tasks]
+    else:
+        results = list(fit_spectra(executor, tasks))
+    dt = time.perf_counter() - t0
+
+    centers = dict()
+    for idx, result, error in results:
+        assert result is not None, error
+        _, _, peak_list = apply_result(list(peak_lists[idx]), result)
+        centers[idx] = np.array([peak.cx for peak in peak_list])
+    return dt, centers
+
+
+def start_pool(n_processes):
+    """
+    :return: (pool with its workers started, seconds it took)
+    """
+    t0 = time.perf_counter()
+    executor = spawn_pool(n_processes)
+    # workers are started on the first submit, and import the fit code on their first task
+    list(executor.map(abs, range(n_processes)))
+    return executor, time.perf_counter() - t0
+
+
+if __name__ == '__main__':
+    reader = P61ANexusReader()
+    spectra = []
+    for f_name in sorted(glob.glob(os.path.join(data_dir, 'sdp_00001', '*.nxs'))):
+        frame = reader.read(f_name)
+        spectra.extend((xx, np.asarray(yy, dtype=np.float64)) for xx, yy in zip(frame['DataX'], frame['DataY']))
+    # a scan of a few hundred spectra
+    spectra = spectra * 10
+
+    tasks, peak_lists = make_tasks(spectra, max_cycles=3)
+    t_serial, expected = bench_batch(tasks, peak_lists)
+    print('fit_to_precision, %d spectra, in process: %.01f s, %.01f spectra / s' %
+          (len(tasks), t_serial, len(tasks) / t_serial))
+
+    n_cpu = os.cpu_count() or 1
+    for n_processes in sorted({1, 2, 4, n_cpu} - {nn for nn in (2, 4) if nn > n_cpu}):
+        executor, t_start = start_pool(n_processes)
+        # the first batch pays for importing the fit code in the workers
+        t_first, _ = bench_batch(tasks[:n_processes], peak_lists, executor)
+        dt, centers = bench_batch(tasks, peak_lists, executor)
+        deviation = max(np.max(np.abs(centers[idx] - expected[idx]), initial=0.) for idx in expected)
+        assert deviation < 1e-9, 'results of the pool differ from the in-process fit'
+        print('fit_to_precision, %d spectra, %d processes: pool start %.02f s, first batch %.02f s, then %.01f s, '
+              '%.01f spectra / s, speedup %.02f, max deviation of the peak centers %.01e' %
+              (len(tasks), n_processes, t_start, t_first, dt, len(tasks) / dt, t_serial / dt, deviation))
+
+        # small batches on the running pool, to choose fit_processes_min_spectra
+        for n_spectra in (1, 2, 4, 8, 16, 32):
+            t_in, _ = bench_batch(tasks[:n_spectra], peak_lists)
+            t_pool, _ = bench_batch(tasks[:n_spectra], peak_lists, executor)
+            print('    %d spectra: in process %.01f ms, pool %.01f ms' % (n_spectra, t_in * 1e3, t_pool * 1e3))
+        executor.shutdown()
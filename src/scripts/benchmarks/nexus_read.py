@@ -0,0 +1,50 @@
+import os
+import glob
+import time
+import tempfile
+import numpy as np
+import h5py
+
+from DatasetIO import P61ANexusReader
+
+
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'data', 'nxs')
+
+
+def time_read(files, n_repeat=3):
+    reader = P61ANexusReader()
+    best, n_rows = np.inf, 0
+    for _ in range(n_repeat):
+        t0 = time.perf_counter()
+        n_rows = sum(reader.read(f_name).shape[0] for f_name in files)
+        best = min(best, time.perf_counter() - t0)
+    return best, n_rows
+
+
+def make_multiframe(f_name, n_frames, n_bins=4096):
+    rng = np.random.default_rng(0)
+    with h5py.File(f_name, 'w') as f:
+        for channel in (P61ANexusReader.ch0, P61ANexusReader.ch1):
+            f.create_dataset('/'.join(channel + P61ANexusReader.hist),
+                             data=rng.integers(0, 100, (n_frames, n_bins)), dtype=np.int32)
+            f.create_dataset('/'.join(channel + P61ANexusReader.all_event), data=np.full(n_frames, 2000.))
+            f.create_dataset('/'.join(channel + P61ANexusReader.all_good), data=np.full(n_frames, 1800.))
+            f.create_dataset('/'.join(channel + P61ANexusReader.time), data=np.full(n_frames, 8e7))
+
+
+if __name__ == '__main__':
+    for dd in sorted(glob.glob(os.path.join(data_dir, 'stress_0000*'))):
+        if not os.path.isdir(dd):
+            continue
+        files = sorted(glob.glob(os.path.join(dd, '*.nxs')))
+        dt, n_rows = time_read(files)
+        print('%s: %d files, %d spectra in %.01f ms (%.03f ms / spectrum)' %
+              (os.path.basename(dd), len(files), n_rows, dt * 1e3, dt * 1e3 / max(n_rows, 1)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_frames in (10, 100, 1000, 5000):
+            f_name = os.path.join(tmp, 'frames_%05d.nxs' % n_frames)
+            make_multiframe(f_name, n_frames)
+            dt, n_rows = time_read([f_name], n_repeat=1)
+            print('%d frames x 2 channels: %d spectra in %.01f ms (%.03f ms / spectrum)' %
+                  (n_frames, n_rows, dt * 1e3, dt * 1e3 / max(n_rows, 1)))
@@ -0,0 +1,209 @@
+import os
+import glob
+import time
+import numpy as np
+from scipy.optimize import least_squares
+from scipy.signal import find_peaks
+
+from DatasetIO import P61ANexusReader
+from peak_fit_utils import PeakData, BckgData, CompositeModel
+from peak_fit_utils import bckg_refinement
+from peak_fit_utils.models import peak_models, peak_jacobians, background_models
+from peak_fit_utils.peak_refinement import IntervalOptimizer, get_peak_intervals
+from peak_fit_utils.metrics import residual_modes
+from unittests.test_models import check_jacobians
+from unittests.test_composite import check_composite_jacobian
+
+
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'data', 'nxs')
+
+
+class CountingOptimizer:
+    """
+    :code:`least_squares` that adds up the number of residual and Jacobian evaluations of all its calls.
+    :code:`nfev` also counts the residual evaluations spent on finite difference Jacobians, which
+    :code:`least_squares` does not report.
+    """
+    def __init__(self):
+        self.nfev, self.njev = 0, 0
+
+    def __call__(self, fun, x0, **kwargs):
+        result = least_squares(fun, x0, **kwargs)
+        self.nfev += result.nfev
+        self.njev += result.njev or 0
+        if not callable(kwargs.get('jac')):
+            self.nfev += (result.njev or 0) * len(x0)
+        return result
+
+
+def find_peak_list(xx, yy, idx=0):
+    """
+    Peak search with the defaults of the tutorial, see :code:`AutoFindWidget.on_btn_this`
+    """
+    peaks, props = find_peaks(yy, height=50, prominence=50, width=3)
+    ip = np.arange(0, xx.shape[0])
+    return [PeakData(idx, xx[pk], yy[pk], np.interp(li, ip, xx), np.interp(ri, ip, xx),
+                     xx[lb], xx[rb], yy[lb], yy[rb])
+            for pk, li, ri, lb, rb in zip(peaks, props['left_ips'], props['right_ips'],
+                                          props['left_bases'], props['right_bases'])]
+
+
+def make_clusters(xx, n_spectra, n_peaks, seed=0):
+    """
+    Spectra with one cluster of :code:`n_peaks` overlapping pseudo-Voigt peaks, two sigma apart, with Poisson noise.
+
+    :return: list of (xx, yy, true centers, peak lists with the initial guesses)
+    """
+    rng = np.random.default_rng(seed)
+    result = []
+    for _ in range(n_spectra):
+        centers = 100. + 0.8 * np.arange(n_peaks) + rng.uniform(-0.05, 0.05, n_peaks)
+        amps = rng.uniform(200., 400., n_peaks)
+        yy = 20. + sum(peak_models['PseudoVoigt'](xx, amplitude=a, center=c, sigma=0.4, fraction=0.3)
+                       for a, c in zip(amps, centers))
+        yy = rng.poisson(yy).astype(np.float64)
+
+        peak_list = []
+        for cx in centers + rng.uniform(-0.1, 0.1, n_peaks):
+            peak = PeakData(0, cx, np.interp(cx, xx, yy), cx - 0.3, cx + 0.3, cx - 2., cx + 2., 20., 20.)
+            peak.overlap_base = 3.
+            peak.base = 6.
+            peak_list.append(peak)
+        result.append((xx, yy - 20., centers, peak_list))
+    return result
+
+
+def bench_clusters(clusters, varpro):
+    opt, dt, errors = CountingOptimizer(), 0., []
+    for xx, yy, centers, peak_list in clusters:
+        peak_list = [PeakData.from_dict(peak.to_dict()) for peak in peak_list]
+        iopt = IntervalOptimizer(peak_list, xx, yy, opt, varpro_min_peaks=1 if varpro else None)
+        t0 = time.perf_counter()
+        for interval in get_peak_intervals(peak_list):
+            iopt(interval)
+        dt += time.perf_counter() - t0
+        errors.extend(np.sort([peak.cx for peak in peak_list]) - centers)
+    return opt, dt, np.array(errors)
+
+
+def check_composite(xx, peak_list):
+    """
+    :return: max relative deviation of :code:`CompositeModel` from the sum of :code:`peak_models`
+    """
+    expected = sum(peak_models[peak.md_name](xx, **peak.md_values) for peak in peak_list)
+    return np.max(np.abs(CompositeModel(peak_list, xx)() - expected)) / np.max(np.abs(expected))
+
+
+def bench_eval(xx, peak_list, n_repeat=200):
+    """
+    Time per evaluation of the sum of the peaks and its Jacobian: peak by peak with :code:`peak_models` and
+    :code:`peak_jacobians`, and with one :code:`CompositeModel`.
+
+    :return: (peak by peak, composite) in seconds
+    """
+    model = CompositeModel(peak_list, xx)
+    x0 = model.x0
+    values = [peak.md_values for peak in peak_list]
+
+    t0 = time.perf_counter()
+    for _ in range(n_repeat):
+        yy = sum(peak_models[peak.md_name](xx, **vals) for peak, vals in zip(peak_list, values))
+        jac = [peak_jacobians[peak.md_name](xx, **vals) for peak, vals in zip(peak_list, values)]
+    t1 = time.perf_counter()
+    for ii in range(n_repeat):
+        # a new parameter vector every time, so that the peak shapes are recomputed
+        x0[0] += 1e-9 * (-1) ** ii
+        yy = model(x0)
+        jac = model.jacobian(x0)
+    t2 = time.perf_counter()
+    return (t1 - t0) / n_repeat, (t2 - t1) / n_repeat
+
+
+def bench_peaks(spectra, **kwargs):
+    opt, dt, params = CountingOptimizer(), 0., []
+    for xx, yy in spectra:
+        peak_list = find_peak_list(xx, yy)
+        iopt = IntervalOptimizer(peak_list, xx, yy, opt, **kwargs)
+        t0 = time.perf_counter()
+        for interval in get_peak_intervals(peak_list):
+            iopt(interval)
+        dt += time.perf_counter() - t0
+        params.extend(peak.cx for peak in peak_list)
+    return opt, dt, np.array(params)
+
+
+def bench_bckg(spectra, **kwargs):
+    opt, dt, curves = CountingOptimizer(), 0., []
+    bckg_refinement.least_squares = opt
+    try:
+        for xx, yy in spectra:
+            bc_md = BckgData('Chebyshev')
+            bc_md.md_params['xmin'] = bc_md.md_params['xmin'] + 20.
+            bc_md.md_params['xmax'] = bc_md.md_params['xmax'] - 40.
+            peak_list = find_peak_list(xx, yy)
+            t0 = time.perf_counter()
+            bckg_refinement.fit_bckg(peak_list, [bc_md], xx, yy, **kwargs)
+            dt += time.perf_counter() - t0
+            curves.append(background_models['Chebyshev'](xx, **bc_md.func_params) / np.max(yy))
+    finally:
+        bckg_refinement.least_squares = least_squares
+    return opt, dt, np.array(curves)
+
+
+if __name__ == '__main__':
+    jac_dev = max(check_jacobians().values())
+    print('Max relative deviation of the analytic Jacobians from finite differences: %.01e' % jac_dev)
+    assert jac_dev < 1e-6, 'analytic Jacobians do not match the models'
+
+    reader = P61ANexusReader()
+    spectra = []
+    for f_name in sorted(glob.glob(os.path.join(data_dir, 'sdp_00001', '*.nxs'))):
+        frame = reader.read(f_name)
+        spectra.extend((xx, np.asarray(yy, dtype=np.float64)) for xx, yy in zip(frame['DataX'], frame['DataY']))
+
+    results = {jac: bench_peaks(spectra, analytic_jac=jac) for jac in (False, True)}
+    for jac, (opt, dt, _) in results.items():
+        print('fit_peaks intervals, %d spectra, %s Jacobian: %d residual evaluations, %d Jacobian evaluations, '
+              '%.01f ms' % (len(spectra), 'analytic' if jac else 'finite difference', opt.nfev, opt.njev, dt * 1e3))
+    print('fit_peaks intervals: max deviation of the peak centers %.02e' %
+          np.max(np.abs(results[True][2] - results[False][2])))
+
+    results = {mode: bench_peaks(spectra, residuals=mode) for mode in residual_modes}
+    for mode, (opt, dt, centers) in results.items():
+        print('fit_peaks intervals, %d spectra, %s residuals: %d residual evaluations, %d Jacobian evaluations, '
+              '%.01f ms, max deviation of the peak centers from poisson %.02e' %
+              (len(spectra), mode, opt.nfev, opt.njev, dt * 1e3, np.max(np.abs(centers - results['poisson'][2]))))
+
+    for n_peaks in (1, 4, 16, 64):
+        xx, _, _, peak_list = make_clusters(spectra[0][0], 1, n_peaks)[0]
+        deviation = check_composite(xx, peak_list)
+        assert deviation < 1e-12, 'CompositeModel does not match the peak models'
+        assert check_composite_jacobian(xx, peak_list) < 1e-6, 'CompositeModel.jacobian does not match the model'
+        t_loop, t_comp = bench_eval(xx, peak_list)
+        print('%d peaks, model and Jacobian: peak by peak %.03f ms, composite %.03f ms, max relative deviation %.01e' %
+              (n_peaks, t_loop * 1e3, t_comp * 1e3, deviation))
+
+    for n_peaks in (2, 4, 6, 8, 12, 16):
+        clusters = make_clusters(spectra[0][0], 20, n_peaks)
+        for varpro in (False, True):
+            opt, dt, errors = bench_clusters(clusters, varpro)
+            print('fit_peaks, 20 clusters of %d peaks, %s: %d residual evaluations, %d Jacobian evaluations, '
+                  '%.01f ms, rms error of the centers %.03f' %
+                  (n_peaks, 'variable projection' if varpro else 'all parameters nonlinear', opt.nfev, opt.njev,
+                   dt * 1e3, np.sqrt(np.mean(errors ** 2))))
+
+    modes = {
+        'legacy residuals, finite difference Jacobian': {'residuals': 'legacy', 'analytic_jac': False},
+        'legacy residuals, analytic Jacobian': {'residuals': 'legacy', 'analytic_jac': True},
+        'raw residuals, nonlinear': {'residuals': 'raw', 'linear': False},
+        'poisson residuals, nonlinear': {'residuals': 'poisson', 'linear': False},
+        'raw residuals, linear solve': {'residuals': 'raw', 'linear': True},
+        'poisson residuals, linear solve': {'residuals': 'poisson', 'linear': True},
+    }
+    results = {mode: bench_bckg(spectra, **kwargs) for mode, kwargs in modes.items()}
+    for mode, (opt, dt, curves) in results.items():
+        # background curves relative to the spectrum maximum
+        print('fit_bckg, %d spectra, %s: %d residual evaluations, %d Jacobian evaluations, %.01f ms, '
+              'max deviation from the poisson linear solve %.02e' %
+              (len(spectra), mode, opt.nfev, opt.njev, dt * 1e3,
+               np.max(np.abs(curves - results['poisson residuals, linear solve'][2]))))
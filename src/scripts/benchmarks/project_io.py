@@ -0,0 +1,65 @@
+import os
+import time
+import tempfile
+import numpy as np
+import pandas as pd
+
+from P61App import P61App
+from DatasetIO import LazySpectrum
+from DatasetIO.energy_axes import energy_axis
+
+
+def make_rows(q_app, n_rows, n_bins=4096):
+    rng = np.random.default_rng(0)
+    xx = energy_axis(0, (5E-2, 0.), n_bins, offset=0.5)
+    frame = pd.DataFrame({c: [None] * n_rows for c in q_app.data.columns}, dtype=object)
+    frame['DataX'] = [xx] * n_rows
+    frame['DataY'] = list(rng.integers(0, 100, (n_rows, n_bins)).astype(np.float64))
+    frame['DeadTime'] = 10.
+    frame['CountTime'] = 1.
+    frame['Cps'] = 1E3
+    frame['Channel'] = 0
+    frame['DataID'] = ['bench.nxs:%05d' % ii for ii in range(n_rows)]
+    frame['ScreenName'] = frame['DataID']
+    frame['Active'] = True
+    frame['Color'] = [next(q_app.params['ColorWheel']) for _ in range(n_rows)]
+    frame['Motors'] = [{'eu.chi': float(ii), 'eu.phi': 0.} for ii in range(n_rows)]
+    frame['PeakDataList'] = [[] for _ in range(n_rows)]
+    frame['BckgDataList'] = [[] for _ in range(n_rows)]
+    q_app.data_model.insert_data(0, frame)
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - t0
+
+
+def read_all(q_app):
+    for yy in q_app.data['DataY']:
+        np.asarray(yy)
+
+
+if __name__ == '__main__':
+    q_app = P61App([])
+    q_app.config['use_threads'] = False
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_rows in (100, 1000, 5000):
+            q_app.data_model.remove_data(list(range(q_app.data.shape[0])))
+            make_rows(q_app, n_rows)
+
+            for ext in ('.pickle', '.h5'):
+                f_name = os.path.join(tmp, 'proj_%05d%s' % (n_rows, ext))
+                dt_save = timed(q_app.save_proj_as, f_name)
+                dt_load = timed(q_app.load_proj_from, f_name)
+                lazy = isinstance(q_app.data.loc[0, 'DataY'], LazySpectrum)
+                dt_read = timed(read_all, q_app)
+                print('%d spectra, %s: save %.01f ms, load %.01f ms, reading all spectra after load %.01f ms '
+                      '(lazy: %s), %.01f MB on disk' %
+                      (n_rows, ext, dt_save * 1e3, dt_load * 1e3, dt_read * 1e3, lazy,
+                       os.path.getsize(f_name) / 2 ** 20))
+
+                # the next save must not read from the file it replaces
+                q_app.data_model.remove_data(list(range(q_app.data.shape[0])))
+                make_rows(q_app, n_rows)